@@ -35,6 +35,10 @@ module.exports = {
       env: {
         PYTHONUNBUFFERED: '1',
         PYTHONPATH: './r_api',
+        // Rワーカープロセス数（各ワーカーがモデルを読み込んだRセッションを持つ、0でプール無効）
+        // ワーカーはPM2の管理外の子プロセスのため、max_memory_restartにワーカーのメモリは含まれない。
+        // プールではモデルセット・シャドウの予測・/admin/profile・pre-fork方式は使えないため、既定は0
+        R_WORKERS: '0',
       },
       // ログ設定
       error_file: './logs/r-api-error.log',
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+大きな入力ファイルの一括予測（オフライン・並列）
+病院システム形式のCSV（CP932）をチャンクに分け、モデルを読み込んだワーカープロセスで並列に予測し、
+結果をCSVまたはParquetに書き出します。APIは起動しません。
+
+チャンクごとの結果は <出力>.parts/ に保存するため、途中で止まっても --resume で続きから再開できます
+（入力ファイル・チャンクの行数・モデルのバージョンが同じ場合のみ）。
+
+使い方:
+  python batch_score.py 入力.csv -o 結果.parquet --workers 8
+  python batch_score.py 入力.csv -o 結果.csv --chunk-size 2000 --resume
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from csv_scoring import (
+    ERROR_COLUMN, ROW_COLUMN, VERSION_COLUMN, output_columns, read_csv_chunks, count_csv_rows, prepare_chunk,
+    fill_records, mark_fallbacks, fail_records, format_csv
+)
+from r_worker_pool import init_worker, worker_model_info, worker_problems
+
+DEFAULT_CHUNK_SIZE = 2000
+MANIFEST_FILE = 'manifest.json'
+
+
+def part_path(parts_dir: str, chunk_index: int, output_format: str) -> str:
+    return os.path.join(parts_dir, f"chunk_{chunk_index:06d}.{output_format}")
+
+
+def records_to_frame(records, columns, id_column: Optional[str]) -> pd.DataFrame:
+    """レコードを列の型をそろえたデータフレームに変換（チャンクごとに型が変わらないようにする）"""
+    df = pd.DataFrame.from_records(records, columns=columns)
+    for column in columns:
+        if column == ROW_COLUMN:
+            df[column] = df[column].astype('int64')
+        elif column in (VERSION_COLUMN, ERROR_COLUMN, id_column):
+            df[column] = df[column].astype('string')
+        else:
+            df[column] = df[column].astype('float64')
+    return df
+
+
+def init_scoring_worker():
+    """ワーカープロセスの初期化（モデルを読み込めなかった場合は例外を送出し、予測を始めずにプールを止める）
+
+    score_csv.pyと同じく、モデルが1つもない・変数が入力の列と一致しない場合は予測しない。
+    親プロセスではモデルを読み込まない（Rセッションがワーカー数より1つ多くならないようにする）。
+    """
+    init_worker()
+    problems = worker_problems(worker_model_info())
+    if problems:
+        for problem in problems:
+            print(f"❌ [worker {os.getpid()}] エラー: {problem}")
+        raise RuntimeError(', '.join(problems))
+
+
+def score_chunk(chunk_index: int, start_row: int, chunk: pd.DataFrame, id_column: Optional[str],
+                parts_dir: str, output_format: str) -> Dict:
+    """ワーカープロセスで1チャンクを予測し、結果をチャンクのファイルに保存する"""
+    import predict_api_fastapi as api
+
+    records, requests, indices = prepare_chunk(chunk, start_row, api.PredictionRequest, id_column)
+    if requests:
+        try:
+            # 代替値（0または項目の合計）を使った行は、予測値を書き込んだうえでエラーとして数える
+            fallbacks = [[] for _ in requests]
+            responses = api.predict_requests(requests, fallbacks=fallbacks)
+            fill_records(records, indices, [response.model_dump() for response in responses])
+            mark_fallbacks(records, indices, fallbacks)
+        except Exception as e:
+            fail_records(records, indices, e)
+
+    # 書き込み途中のファイルを完了したチャンクと間違えないよう、一時ファイルに書いてから名前を変える
+    path = part_path(parts_dir, chunk_index, output_format)
+    temp_path = path + '.tmp'
+    columns = output_columns(id_column)
+    if output_format == 'parquet':
+        records_to_frame(records, columns, id_column).to_parquet(temp_path, index=False)
+    else:
+        with open(temp_path, 'wb') as f:
+            f.write(format_csv(records, columns))
+    os.replace(temp_path, path)
+    return {
+        "chunk": chunk_index,
+        "rows": len(records),
+        "errors": sum(1 for record in records if ERROR_COLUMN in record),
+    }
+
+
+def prepare_parts_dir(parts_dir: str, manifest: Dict, resume: bool):
+    """チャンクの保存先を用意する（再開の場合は前回と同じ条件かを確認）"""
+    manifest_path = os.path.join(parts_dir, MANIFEST_FILE)
+    if resume and os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            previous = json.load(f)
+        if previous != manifest:
+            print("エラー: 前回と入力ファイル・チャンクの行数・モデルのバージョンなどが異なるため再開できません")
+            print(f"  前回: {previous}")
+            print(f"  今回: {manifest}")
+            print(f"  最初からやり直す場合は --resume を付けずに実行してください（{parts_dir} を削除します）")
+            sys.exit(1)
+        return
+    if os.path.exists(parts_dir):
+        shutil.rmtree(parts_dir)
+    os.makedirs(parts_dir)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def merge_parts(parts_dir: str, n_chunks: int, output: str, output_format: str, columns):
+    """チャンクごとの結果を順に1つのファイルにまとめる（全体をメモリに読み込まない）"""
+    if output_format == 'parquet':
+        import pyarrow.parquet as pq
+        writer = None
+        for chunk_index in range(n_chunks):
+            table = pq.read_table(part_path(parts_dir, chunk_index, output_format))
+            if writer is None:
+                writer = pq.ParquetWriter(output, table.schema)
+            writer.write_table(table)
+        if writer is not None:
+            writer.close()
+    else:
+        with open(output, 'wb') as out:
+            out.write(format_csv([], columns, header=True))
+            for chunk_index in range(n_chunks):
+                with open(part_path(parts_dir, chunk_index, output_format), 'rb') as f:
+                    shutil.copyfileobj(f, out)
+
+
+def report_progress(result: Dict, scored_rows: int, total_rows: int, done_chunks, chunk_size: int,
+                    started: float):
+    """進捗（完了した行数・速度・残り時間の目安）を表示"""
+    elapsed = time.perf_counter() - started
+    done_rows = min(scored_rows + len(done_chunks) * chunk_size, total_rows)
+    rate = scored_rows / elapsed if elapsed > 0 else 0.0
+    remaining = (total_rows - done_rows) / rate if rate > 0 else 0.0
+    print(f"チャンク{result['chunk']}完了: {done_rows}/{total_rows}行 "
+          f"({done_rows / max(total_rows, 1) * 100:.1f}%), {rate:.0f}行/秒, 残り約{remaining:.0f}秒")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="大きな入力ファイルの一括予測（オフライン・並列）")
+    parser.add_argument('input', help="入力のCSV（CP932、学習データと同じ列）")
+    parser.add_argument('-o', '--output', required=True, help="結果の保存先（.csv または .parquet）")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="ワーカープロセス数（既定はCPUコア数）")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="1チャンクの行数")
+    parser.add_argument('--id-column', help="結果に含める入力の列（患者IDなど）")
+    parser.add_argument('--resume', action='store_true', help="前回保存したチャンクの続きから再開する")
+    parser.add_argument('--keep-parts', action='store_true', help="完了後もチャンクごとの結果を残す")
+    args = parser.parse_args()
+
+    output_format = 'parquet' if args.output.lower().endswith('.parquet') else 'csv'
+    if output_format == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            print("エラー: Parquetで保存するには pyarrow をインストールしてください（pip install pyarrow）")
+            sys.exit(1)
+
+    import predict_api_fastapi as api
+
+    stat = os.stat(args.input)
+    manifest = {
+        "input": os.path.abspath(args.input),
+        "input_size": stat.st_size,
+        "input_mtime_ns": stat.st_mtime_ns,
+        "chunk_size": args.chunk_size,
+        "id_column": args.id_column,
+        "format": output_format,
+        "engine": api.PREDICTION_ENGINE,
+        "model_version": api.model_files_version(),
+    }
+    parts_dir = args.output + '.parts'
+    prepare_parts_dir(parts_dir, manifest, args.resume)
+
+    # 進捗の表示と再開時の完了済みチャンクの確認に使うため、チャンクと同じ区切り方で数える
+    total_rows = count_csv_rows(args.input)
+    total_chunks = -(-total_rows // args.chunk_size)
+    done_chunks = {
+        i for i in range(total_chunks) if os.path.exists(part_path(parts_dir, i, output_format))
+    }
+    print("=" * 50)
+    print(f"一括予測: {total_rows}行, {total_chunks}チャンク, {args.workers}プロセス")
+    if done_chunks:
+        print(f"再開: {len(done_chunks)}チャンクは前回完了済み")
+    print("=" * 50)
+
+    started = time.perf_counter()
+    scored_rows = 0
+    errors = 0
+    n_chunks = 0
+    try:
+        # 各ワーカーが独立したRセッションを持つよう、forkではなくspawnで起動する
+        with ProcessPoolExecutor(
+            max_workers=args.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_scoring_worker,
+        ) as executor:
+            pending = set()
+            for chunk_index, chunk in enumerate(read_csv_chunks(args.input, args.chunk_size)):
+                n_chunks = chunk_index + 1
+                if chunk_index in done_chunks:
+                    continue
+                # 読み込んだチャンクがメモリに溜まらないよう、実行中のチャンク数を制限する
+                if len(pending) >= args.workers * 2:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        result = future.result()
+                        scored_rows += result["rows"]
+                        errors += result["errors"]
+                        report_progress(result, scored_rows, total_rows, done_chunks, args.chunk_size, started)
+                pending.add(executor.submit(
+                    score_chunk, chunk_index, chunk_index * args.chunk_size, chunk,
+                    args.id_column, parts_dir, output_format
+                ))
+            for future in wait(pending).done:
+                result = future.result()
+                scored_rows += result["rows"]
+                errors += result["errors"]
+                report_progress(result, scored_rows, total_rows, done_chunks, args.chunk_size, started)
+    except BrokenProcessPool:
+        # ワーカーがモデルを読み込めなかった場合（init_scoring_worker）は、予測を始めずにここで止まる
+        print("エラー: ワーカープロセスが停止したため中止しました（モデルを読み込めなかった場合など、上のワーカーのエラーを確認してください）")
+        print("  完了したチャンクは --resume で再開すると再利用されます")
+        sys.exit(1)
+
+    print("\n結果をまとめています...")
+    merge_parts(parts_dir, n_chunks, args.output, output_format, output_columns(args.id_column))
+    if not args.keep_parts:
+        shutil.rmtree(parts_dir)
+
+    elapsed = time.perf_counter() - started
+    print(f"完了: {scored_rows}行を予測（エラー {errors}行）, {elapsed:.1f}秒")
+    print(f"結果を保存しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+予測APIの負荷テスト・レイテンシ計測スクリプト
+学習データCSVの入院時データから/predictの入力を作成し、
+起動中のAPIに並列に送信する（http）か、このプロセス内でモデルを直接呼び出して（inprocess）計測します
+
+使い方:
+  python benchmark.py --mode http --url http://localhost:5000 --requests 1000 --concurrency 8
+  python benchmark.py --mode inprocess --requests 200
+
+結果（p50/p95/p99レイテンシ、リクエスト/秒、モデルごとの時間の内訳）はJSONで保存します
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from training_data import TRAINING_CSV_PATH, read_training_csv, csv_to_payloads
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_results')
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """ソート済みの値のパーセンタイル（線形補間）"""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * p / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize_latencies(latencies: List[float]) -> Dict[str, float]:
+    """レイテンシ（秒）の統計をミリ秒で返す"""
+    values = sorted(latencies)
+    return {
+        "p50": round(percentile(values, 50) * 1000, 3),
+        "p95": round(percentile(values, 95) * 1000, 3),
+        "p99": round(percentile(values, 99) * 1000, 3),
+        "mean": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        "max": round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+
+def summarize_model_times(model_seconds: Dict[str, float], n_requests: int) -> Dict[str, Dict[str, float]]:
+    """モデルごとの合計時間から、1リクエストあたりの時間と全体に占める割合を求める"""
+    total = sum(model_seconds.values())
+    return {
+        key: {
+            "mean_ms": round(seconds / max(n_requests, 1) * 1000, 3),
+            "share": round(seconds / total, 4) if total else 0.0,
+        }
+        for key, seconds in sorted(model_seconds.items(), key=lambda item: -item[1])
+    }
+
+
+# ============================================
+# HTTP（起動中のAPIに送信）
+# ============================================
+def scrape_model_seconds(url: str) -> Dict[str, float]:
+    """/metricsからモデルごとの予測時間の合計を取得"""
+    try:
+        with urllib.request.urlopen(f"{url}/metrics", timeout=10) as response:
+            text = response.read().decode('utf-8')
+    except Exception as e:
+        print(f"警告: /metricsの取得に失敗しました: {e}")
+        return {}
+    seconds = {}
+    prefix = 'fim_model_duration_seconds_sum{model="'
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            key, value = line[len(prefix):].split('"} ')
+            seconds[key] = float(value)
+    return seconds
+
+
+def fetch_cache_stats(url: str) -> Dict[str, int]:
+    """/healthから予測キャッシュの統計を取得（CSVの行を繰り返すため、2周目以降はキャッシュに当たる）"""
+    try:
+        with urllib.request.urlopen(f"{url}/health", timeout=10) as response:
+            return json.loads(response.read().decode('utf-8')).get("cache", {})
+    except Exception:
+        return {}
+
+
+def post_prediction(url: str, payload: Dict, timeout: float):
+    """/predictに1件送信し、（レイテンシ, ステータス）を返す"""
+    body = json.dumps(payload).encode('utf-8')
+    request = urllib.request.Request(
+        f"{url}/predict", data=body, headers={'Content-Type': 'application/json'}
+    )
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = 0
+    return time.perf_counter() - started, status
+
+
+def run_http(payloads: List[Dict], url: str, concurrency: int, timeout: float) -> Dict:
+    before = scrape_model_seconds(url)
+    cache_before = fetch_cache_stats(url)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda payload: post_prediction(url, payload, timeout), payloads))
+    elapsed = time.perf_counter() - started
+    after = scrape_model_seconds(url)
+    cache_after = fetch_cache_stats(url)
+
+    latencies = [latency for latency, status in results if status == 200]
+    errors = {}
+    for _, status in results:
+        if status != 200:
+            errors[str(status)] = errors.get(str(status), 0) + 1
+    model_seconds = {key: after[key] - before.get(key, 0.0) for key in after}
+    return {
+        "requests": len(payloads),
+        "succeeded": len(latencies),
+        "errors": errors,
+        "duration_seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": summarize_latencies(latencies),
+        "cache_hits": cache_after.get("hits", 0) - cache_before.get("hits", 0),
+        "per_model": summarize_model_times(model_seconds, len(latencies)),
+    }
+
+
+# ============================================
+# inprocess（このプロセス内でモデルを直接呼び出す）
+# ============================================
+def run_inprocess(payloads: List[Dict]) -> Dict:
+    import predict_api_fastapi as api
+
+    print("モデルを読み込み中...")
+    snapshot = api.load_models()
+    if len(snapshot.models) == 0:
+        print("エラー: モデルが読み込まれていません")
+        sys.exit(1)
+
+    def predict_one_model(key, X):
+        if snapshot.engine != 'r':
+            return api.predict_all_models(X, {key: snapshot.models[key]}, snapshot.engine)[key][0]
+        return api.predict_with_r_model(key, X)
+
+    latencies = []
+    model_seconds = {key: 0.0 for key in snapshot.models}
+    prepare_seconds = 0.0
+    errors = {}
+    started = time.perf_counter()
+    for payload in payloads:
+        request_started = time.perf_counter()
+        X = api.encode_request(api.PredictionRequest(**payload))
+        prepare_seconds += time.perf_counter() - request_started
+        failed = False
+        for key in snapshot.models:
+            model_started = time.perf_counter()
+            try:
+                predict_one_model(key, X)
+            except Exception:
+                failed = True
+                errors[key] = errors.get(key, 0) + 1
+            model_seconds[key] += time.perf_counter() - model_started
+        if not failed:
+            latencies.append(time.perf_counter() - request_started)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "engine": snapshot.engine,
+        "model_version": snapshot.version,
+        "requests": len(payloads),
+        "succeeded": len(latencies),
+        "errors": errors,
+        "duration_seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": summarize_latencies(latencies),
+        "prepare_mean_ms": round(prepare_seconds / max(len(payloads), 1) * 1000, 3),
+        "per_model": summarize_model_times(model_seconds, len(payloads)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="予測APIの負荷テスト・レイテンシ計測")
+    parser.add_argument('--mode', choices=['http', 'inprocess'], default='http',
+                        help="http: 起動中のAPIに送信, inprocess: このプロセス内でモデルを直接呼び出す")
+    parser.add_argument('--url', default='http://localhost:5000', help="APIのURL（httpの場合）")
+    parser.add_argument('--csv', default=TRAINING_CSV_PATH, help="入力に使うCSV（CP932）")
+    parser.add_argument('--requests', type=int, default=500, help="送信するリクエスト数（CSVの行を繰り返し使用）")
+    parser.add_argument('--concurrency', type=int, default=8, help="同時に送信する数（httpの場合）")
+    parser.add_argument('--timeout', type=float, default=10.0, help="1リクエストのタイムアウト（秒）")
+    parser.add_argument('--output', help="結果のJSONの保存先（省略時は benchmark_results/ に保存）")
+    args = parser.parse_args()
+
+    rows = csv_to_payloads(read_training_csv(args.csv))
+    payloads = [rows[i % len(rows)] for i in range(args.requests)]
+
+    print("=" * 50)
+    print(f"ベンチマーク: {args.mode}, {args.requests}リクエスト"
+          + (f", 同時{args.concurrency}" if args.mode == 'http' else ""))
+    print("=" * 50)
+
+    if args.mode == 'http':
+        result = run_http(payloads, args.url, args.concurrency, args.timeout)
+    else:
+        result = run_inprocess(payloads)
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec='seconds'),
+        "mode": args.mode,
+        "config": {
+            "url": args.url if args.mode == 'http' else None,
+            "csv": os.path.basename(args.csv),
+            "requests": args.requests,
+            "concurrency": args.concurrency if args.mode == 'http' else 1,
+        },
+        **result,
+    }
+
+    latency = report["latency_ms"]
+    print(f"\n成功: {report['succeeded']}/{report['requests']}, エラー: {report['errors']}")
+    print(f"スループット: {report['requests_per_second']} リクエスト/秒")
+    print(f"レイテンシ: p50 {latency['p50']}ms, p95 {latency['p95']}ms, p99 {latency['p99']}ms")
+    print("\nモデルごとの時間（1リクエストあたり）:")
+    for key, stats in report["per_model"].items():
+        print(f"  {key}: {stats['mean_ms']}ms ({stats['share'] * 100:.1f}%)")
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"benchmark_{args.mode}_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n結果を保存しました: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+病院システム形式のCSV（CP932）の一括予測
+CSVを一定の行数ずつ読み込み、まとめて予測した結果をNDJSONまたはCSVで順に出力する
+（ファイル全体をメモリに読み込まないため、行数が多くても使用メモリは増えない）
+"""
+import csv
+import io
+import json
+import math
+import os
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Tuple
+
+from training_data import (
+    CSV_ENCODING, DISCHARGE_MOTION_COLUMNS, DISCHARGE_COGNITIVE_COLUMNS, DISCHARGE_TOTAL_COLUMNS,
+    row_to_payload
+)
+
+if TYPE_CHECKING:
+    # CSVを読み込む時に初めてインポートする
+    import pandas as pd
+
+# 1回に読み込んで予測する行数
+CSV_CHUNK_SIZE = int(os.environ.get('CSV_CHUNK_SIZE', '500'))
+
+# 出力形式
+OUTPUT_FORMATS = ('ndjson', 'csv')
+
+# 予測値の列名（退院時FIMの列名の前に「予測」を付ける）
+PREDICTED_PREFIX = '予測'
+ROW_COLUMN = '行'
+VERSION_COLUMN = 'モデルバージョン'
+ERROR_COLUMN = 'エラー'
+
+
+def output_columns(id_column: Optional[str] = None) -> List[str]:
+    """出力の列（行番号、ID列、予測値、モデルバージョン、エラー）"""
+    columns = [ROW_COLUMN] + ([id_column] if id_column else [])
+    columns += [PREDICTED_PREFIX + column for column in DISCHARGE_MOTION_COLUMNS.values()]
+    columns += [PREDICTED_PREFIX + column for column in DISCHARGE_COGNITIVE_COLUMNS.values()]
+    columns += [PREDICTED_PREFIX + column for column in DISCHARGE_TOTAL_COLUMNS.values()]
+    return columns + [VERSION_COLUMN, ERROR_COLUMN]
+
+
+def read_csv_chunks(source, chunk_size: int = CSV_CHUNK_SIZE) -> Iterator['pd.DataFrame']:
+    """CSV（パスまたはファイル）をchunk_size行ずつ読み込む"""
+    import pandas as pd
+    return pd.read_csv(source, encoding=CSV_ENCODING, chunksize=chunk_size)
+
+
+def count_csv_rows(path: str) -> int:
+    """CSVのデータ行数（ヘッダーを除く）
+
+    read_csv_chunksと同じく、引用符で囲まれた値の中の改行は行の区切りとせず、空行は数えない。
+    """
+    with open(path, encoding=CSV_ENCODING, newline='') as f:
+        rows = sum(1 for row in csv.reader(f) if row)
+    return max(rows - 1, 0)
+
+
+def prepare_chunk(chunk: 'pd.DataFrame', start_row: int, request_class: Callable,
+                  id_column: Optional[str] = None) -> Tuple[List[Dict], List, List[int]]:
+    """CSVの行を予測の入力に変換する
+
+    返り値: (出力のレコード, 予測するリクエスト, リクエストに対応するレコードの番号)
+    変換・入力チェックに失敗した行は予測せず、レコードにエラーを記録する。
+    """
+    records, requests, indices = [], [], []
+    for offset, row in enumerate(chunk.to_dict('records')):
+        record = {ROW_COLUMN: start_row + offset + 1}
+        if id_column:
+            record[id_column] = row.get(id_column)
+        try:
+            requests.append(request_class(**row_to_payload(row)))
+            indices.append(len(records))
+        except Exception as e:
+            record[ERROR_COLUMN] = str(e).replace('\n', ' ')
+        records.append(record)
+    return records, requests, indices
+
+
+def fill_records(records: List[Dict], indices: List[int], responses: List[Dict]):
+    """予測結果（レスポンスのdict）をレコードの予測値の列に書き込む"""
+    for index, response in zip(indices, responses):
+        record = records[index]
+        for column, value in zip(DISCHARGE_MOTION_COLUMNS.values(), response['motion'] or []):
+            record[PREDICTED_PREFIX + column] = value
+        for column, value in zip(DISCHARGE_COGNITIVE_COLUMNS.values(), response['cognitive'] or []):
+            record[PREDICTED_PREFIX + column] = value
+        for field, column in DISCHARGE_TOTAL_COLUMNS.items():
+            record[PREDICTED_PREFIX + column] = response[field]
+        record[VERSION_COLUMN] = response.get('modelVersion')
+
+
+def mark_fallbacks(records: List[Dict], indices: List[int], fallbacks: List[List[str]]):
+    """モデルがない・予測に失敗して代替値（0または項目の合計）を使ったレコードにエラーを記録"""
+    for index, keys in zip(indices, fallbacks):
+        if keys:
+            records[index][ERROR_COLUMN] = f"代替値を使用しました（モデルがない・予測に失敗）: {', '.join(keys)}"
+
+
+def fail_records(records: List[Dict], indices: List[int], error: Exception):
+    """予測に失敗したチャンクのレコードにエラーを記録"""
+    for index in indices:
+        records[index][ERROR_COLUMN] = str(error).replace('\n', ' ')
+
+
+def _json_value(value):
+    # pandasの欠損値（NaN）はJSONのnullにする
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def format_ndjson(records: List[Dict]) -> bytes:
+    """レコードを1行1レコードのJSON（UTF-8）に変換"""
+    return ''.join(
+        json.dumps({key: _json_value(value) for key, value in record.items()}, ensure_ascii=False) + '\n'
+        for record in records
+    ).encode('utf-8')
+
+
+def format_csv(records: List[Dict], columns: List[str], header: bool = False) -> bytes:
+    """レコードをCSV（入力と同じCP932）に変換"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction='ignore', lineterminator='\n')
+    if header:
+        writer.writeheader()
+    writer.writerows(records)
+    return buffer.getvalue().encode(CSV_ENCODING, errors='replace')
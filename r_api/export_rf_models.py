@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Rモデル（.rds）の木構造をネイティブ推論エンジン用の.npzに書き出すスクリプト
+caretのfinalModel（randomForest）から全ての木を取り出し、r_models/に保存します
+使い方: python export_rf_models.py
+書き出し後、PREDICTION_ENGINE=native でFastAPIを起動するとRを使わずに予測します
+"""
+import os
+import sys
+
+import numpy as np
+import rpy2.robjects as ro
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from predict_api_fastapi import MODELS_DIR, MODEL_FILES, load_r_models
+from rf_engine import ForestModel, native_model_filename
+
+# finalModelの木構造を取り出すR関数
+# 行列（nrnodes x ntree）は列優先のベクトルとして返す
+r_extract_forest = ro.r('''
+    function(model) {
+        fm <- model$finalModel
+        if (!inherits(fm, "randomForest")) stop("finalModelがrandomForestではありません")
+        if (fm$type != "regression") stop("回帰モデルではありません")
+        if (any(fm$forest$ncat > 1)) stop("カテゴリ変数の分割には対応していません")
+        if (!is.null(fm$coefs)) stop("corr.bias = TRUEのモデルには対応していません")
+        feature_names <- fm$xNames
+        if (is.null(feature_names)) feature_names <- rownames(fm$importance)
+        list(
+            feature_names = gsub("`", "", feature_names),
+            nrnodes = as.integer(fm$forest$nrnodes),
+            ndbigtree = as.integer(fm$forest$ndbigtree),
+            left = as.integer(fm$forest$leftDaughter),
+            right = as.integer(fm$forest$rightDaughter),
+            bestvar = as.integer(fm$forest$bestvar),
+            xbestsplit = as.numeric(fm$forest$xbestsplit),
+            nodepred = as.numeric(fm$forest$nodepred),
+            nodestatus = as.integer(fm$forest$nodestatus)
+        )
+    }
+''')
+
+# randomForestの終端ノードを表すnodestatusの値
+NODE_TERMINAL = -1
+
+
+def extract_forest(r_model) -> ForestModel:
+    """caretのtrainオブジェクトからForestModelを作成"""
+    info = r_extract_forest(r_model)
+
+    def get(name):
+        return np.asarray(info.rx2(name))
+
+    feature_names = [str(name) for name in info.rx2('feature_names')]
+    nrnodes = int(get('nrnodes')[0])
+    ndbigtree = get('ndbigtree')
+
+    def as_matrix(name):
+        return get(name).reshape((nrnodes, len(ndbigtree)), order='F')
+
+    left = as_matrix('left')
+    right = as_matrix('right')
+    bestvar = as_matrix('bestvar')
+    xbestsplit = as_matrix('xbestsplit')
+    nodepred = as_matrix('nodepred')
+    nodestatus = as_matrix('nodestatus')
+
+    trees = []
+    for t, n_nodes in enumerate(ndbigtree):
+        n_nodes = int(n_nodes)
+        is_leaf = nodestatus[:n_nodes, t] == NODE_TERMINAL
+        # Rの1始まりの番号を0始まりに変換（葉は-1）
+        trees.append({
+            'feature': np.where(is_leaf, -1, bestvar[:n_nodes, t] - 1),
+            'threshold': xbestsplit[:n_nodes, t],
+            'left': np.where(is_leaf, -1, left[:n_nodes, t] - 1),
+            'right': np.where(is_leaf, -1, right[:n_nodes, t] - 1),
+            'value': nodepred[:n_nodes, t],
+        })
+    return ForestModel.from_trees(trees, feature_names)
+
+
+def main():
+    print("=" * 50)
+    print("Rモデルの木構造の書き出し")
+    print("=" * 50)
+
+    r_models = load_r_models()
+    if len(r_models) == 0:
+        print("❌ エラー: Rモデルが読み込まれていません")
+        sys.exit(1)
+
+    failed = 0
+    for key, r_model in r_models.items():
+        output_path = os.path.join(MODELS_DIR, native_model_filename(MODEL_FILES[key]))
+        try:
+            forest = extract_forest(r_model)
+            forest.save(output_path)
+            print(f"✅ {key}: {forest.n_trees}本の木, 最大深さ{forest.max_depth} -> {output_path}")
+        except Exception as e:
+            failed += 1
+            print(f"❌ {key}: 書き出しに失敗 - {e}")
+
+    print(f"\n書き出し完了: {len(r_models) - failed}個成功, {failed}個失敗")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+予測の入力をモデルに渡す数値の行列に変換するエンコーダー
+列ごとの値の取り出し方は起動時に1回だけ組み立て、リクエストごとには
+値を事前に確保した数値バッファに書き込むだけにする（1行でも複数行でも同じ処理）
+"""
+import threading
+from typing import TYPE_CHECKING, Callable, List, Sequence
+
+import numpy as np
+
+if TYPE_CHECKING:
+    # 確認用のto_dataframe()でのみ使う（予測の処理ではpandasをインポートしない）
+    import pandas as pd
+
+# 個人情報の列（Rの学習データの列名）: リクエストから値を取り出す関数
+PERSONAL_FEATURES = {
+    'gender': lambda r: 0.0 if r.gender == 'male' else 1.0,
+    'age': lambda r: float(r.age),
+    'bmi': lambda r: float(r.bmi),
+    'care_level': lambda r: 1.0 if r.careLevel == 'yes' else 0.0,
+    'days_from_onset': lambda r: float(r.daysFromOnset),
+}
+
+# 運動機能項目（12項目）の列名（Rの学習データの列名、motionValuesの項目名と同じ）
+MOTION_FEATURES = ['食事', '整容', '清拭', '更衣上半身', '更衣下半身',
+                   'トイレ動作', '排尿管理', '排便管理', 'ベッド移乗',
+                   'トイレ移乗', '浴槽移乗', '歩行']
+
+# 認知機能項目（5項目）の列名（Rの学習データの列名、cognitiveValuesの項目名と同じ）
+COGNITIVE_FEATURES = ['理解', '表出', '社会的交流', '問題解決', '記憶']
+
+# モデルに渡す列の順序
+FEATURE_COLUMNS = list(PERSONAL_FEATURES) + MOTION_FEATURES + COGNITIVE_FEATURES
+
+
+def _motion_getter(item: str) -> Callable:
+    return lambda r: float(r.motionValues.get(item, 0.0))
+
+
+def _cognitive_getter(item: str) -> Callable:
+    return lambda r: float(r.cognitiveValues.get(item, 0.0))
+
+
+class FeatureEncoder:
+    """リクエストを列の順序どおりの数値の行列（行が患者）に変換する
+
+    encode() が返す行列は同じスレッドの次の encode() で上書きされるバッファの一部のため、
+    保持する場合は copy() すること。
+    """
+
+    def __init__(self, columns: Sequence[str] = FEATURE_COLUMNS):
+        self.columns = list(columns)
+        self.getters = [self._compile(column) for column in self.columns]
+        self.index = {column: i for i, column in enumerate(self.columns)}
+        self.local = threading.local()
+        self.index_cache = {}
+
+    @staticmethod
+    def _compile(column: str) -> Callable:
+        if column in PERSONAL_FEATURES:
+            return PERSONAL_FEATURES[column]
+        if column in MOTION_FEATURES:
+            return _motion_getter(column)
+        if column in COGNITIVE_FEATURES:
+            return _cognitive_getter(column)
+        raise ValueError(f"列 {column} の値をリクエストから取り出せません")
+
+    @property
+    def n_features(self) -> int:
+        return len(self.columns)
+
+    def _buffer(self, n_rows: int) -> np.ndarray:
+        """スレッドごとのバッファ（足りない場合のみ倍の大きさで確保し直す）"""
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is None or buffer.shape[0] < n_rows:
+            capacity = max(n_rows, 2 * buffer.shape[0] if buffer is not None else 1)
+            buffer = self.local.buffer = np.empty((capacity, self.n_features), dtype=np.float64)
+        return buffer[:n_rows]
+
+    def encode(self, requests: List) -> np.ndarray:
+        """複数のリクエストを1つの行列（len(requests) x n_features）に変換"""
+        X = self._buffer(len(requests))
+        getters = self.getters
+        for i, request in enumerate(requests):
+            X[i] = [getter(request) for getter in getters]
+        return X
+
+    def column_indices(self, names: Sequence[str]) -> np.ndarray:
+        """モデルの変数名の順に並べるための列番号（モデルごとに1回だけ計算する）"""
+        key = tuple(names)
+        indices = self.index_cache.get(key)
+        if indices is None:
+            missing = [name for name in names if name not in self.index]
+            if missing:
+                raise KeyError(f"入力にない列があります: {missing}")
+            indices = self.index_cache[key] = np.array([self.index[name] for name in names], dtype=np.intp)
+        return indices
+
+    def to_dataframe(self, X: np.ndarray) -> 'pd.DataFrame':
+        """行列を列名付きのデータフレームに変換（確認用）"""
+        import pandas as pd
+        return pd.DataFrame(X, columns=self.columns)
@@ -0,0 +1,139 @@
+"""
+k近傍法による代替の予測エンジン（NumPy）
+学習データCSVの入院時の値が近い患者k人の退院時FIMを、距離で重み付けして平均する。
+Rやランダムフォレストのモデルがなくても予測できるため、劣化モードとして使用する
+（距離の重みはserver_r_model.jsのfindClosestCSVRecordと同じ）
+"""
+import hashlib
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from feature_encoder import FEATURE_COLUMNS, MOTION_FEATURES
+from training_data import (
+    TRAINING_CSV_PATH, PERSONAL_COLUMNS, ADMISSION_MOTION_COLUMNS, ADMISSION_COGNITIVE_COLUMNS,
+    discharge_columns, read_training_csv
+)
+
+# 近傍として使う患者数
+KNN_NEIGHBORS = int(os.environ.get('KNN_NEIGHBORS', '5'))
+# 近傍を探す学習データのCSV
+KNN_DATA_PATH = os.environ.get('KNN_DATA_PATH', TRAINING_CSV_PATH)
+
+# 個人情報の列: 列名（FEATURE_COLUMNS） -> 学習データCSVの列（PERSONAL_COLUMNSのキー）
+PERSONAL_FEATURE_COLUMNS = {
+    'gender': 'gender',
+    'age': 'age',
+    'bmi': 'bmi',
+    'care_level': 'careLevel',
+    'days_from_onset': 'daysFromOnset',
+}
+
+# 距離を計算するときに差に掛ける値（FIMの各項目は1）
+FEATURE_WEIGHTS = {
+    'gender': 10.0,
+    'age': 1 / 10,
+    'bmi': 1 / 5,
+    'care_level': 10.0,
+    'days_from_onset': 1 / 10,
+}
+
+# 距離が0の患者の重みが無限大にならないよう距離に足す値
+DISTANCE_EPSILON = 1e-6
+
+
+def input_columns() -> List[str]:
+    """FEATURE_COLUMNSの各列に対応する学習データCSVの入院時の列"""
+    columns = []
+    for feature in FEATURE_COLUMNS:
+        if feature in PERSONAL_FEATURE_COLUMNS:
+            columns.append(PERSONAL_COLUMNS[PERSONAL_FEATURE_COLUMNS[feature]])
+        elif feature in MOTION_FEATURES:
+            columns.append(ADMISSION_MOTION_COLUMNS[feature])
+        else:
+            columns.append(ADMISSION_COGNITIVE_COLUMNS[feature])
+    return columns
+
+
+def data_version(path: str = KNN_DATA_PATH) -> str:
+    """学習データCSVの名前・サイズ・更新日時から求めたバージョン（ランダムフォレストと区別するため knn- を付ける）"""
+    stat = os.stat(path)
+    entry = (os.path.basename(path), stat.st_size, stat.st_mtime_ns)
+    return 'knn-' + hashlib.sha1(repr(entry).encode('utf-8')).hexdigest()[:12]
+
+
+class NeighborIndex:
+    """学習データの入院時の値（重みを掛けた行列）と退院時の値
+
+    距離の計算は全行・全患者をまとめて行列演算で行う（1行でも複数行でも同じ処理）。
+    """
+
+    def __init__(self, features: np.ndarray, targets: Dict[str, np.ndarray], k: int = KNN_NEIGHBORS):
+        self.weights = np.array([FEATURE_WEIGHTS.get(name, 1.0) for name in FEATURE_COLUMNS])
+        self.points = np.asarray(features, dtype=np.float64) * self.weights
+        self.squared_norms = (self.points ** 2).sum(axis=1)
+        self.targets = targets
+        self.k = max(1, min(k, len(self.points)))
+        self.feature_names = list(FEATURE_COLUMNS)
+
+    @property
+    def n_records(self) -> int:
+        return len(self.points)
+
+    @classmethod
+    def from_csv(cls, targets: Dict[str, str], path: str = KNN_DATA_PATH,
+                 k: int = KNN_NEIGHBORS) -> 'NeighborIndex':
+        """学習データCSVから作成（使う列に欠損がある患者は除く）"""
+        df = read_training_csv(path)
+        columns = input_columns()
+        df = df.dropna(subset=columns + list(targets.values()))
+        return cls(
+            df[columns].to_numpy(dtype=np.float64),
+            {key: df[column].to_numpy(dtype=np.float64) for key, column in targets.items()},
+            k,
+        )
+
+    def neighbors(self, X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """各行の近傍k人の位置と重み（距離の逆数を行ごとに合計1にしたもの）
+
+        X: 行が患者、列がFEATURE_COLUMNSの順に並んだ数値配列
+        """
+        Xw = np.asarray(X, dtype=np.float64) * self.weights
+        # |x - p|^2 = |x|^2 + |p|^2 - 2 x・p（丸め誤差で負にならないよう0で切る）
+        squared = (Xw ** 2).sum(axis=1)[:, None] + self.squared_norms[None, :] - 2.0 * Xw @ self.points.T
+        squared = np.maximum(squared, 0.0)
+        if self.k < self.n_records:
+            nearest = np.argpartition(squared, self.k - 1, axis=1)[:, :self.k]
+        else:
+            nearest = np.broadcast_to(np.arange(self.n_records), (len(Xw), self.n_records))
+        distances = np.sqrt(np.take_along_axis(squared, nearest, axis=1))
+        weights = 1.0 / (distances + DISTANCE_EPSILON)
+        return nearest, weights / weights.sum(axis=1, keepdims=True)
+
+    def predict(self, X: np.ndarray, keys: List[str]) -> Dict[str, np.ndarray]:
+        """keysの退院時の値を、近傍の値の重み付き平均で予測する（近傍の探索は1回のみ）"""
+        nearest, weights = self.neighbors(X)
+        return {key: (self.targets[key][nearest] * weights).sum(axis=1) for key in keys}
+
+
+class NeighborModel:
+    """1つの予測値（退院時の1列）を近傍から求めるモデル（同じNeighborIndexを共有する）"""
+
+    def __init__(self, index: NeighborIndex, key: str):
+        self.index = index
+        self.key = key
+        self.feature_names = index.feature_names
+
+
+def load_neighbor_models(motion_items: List[str], cognitive_items: List[str],
+                         path: str = KNN_DATA_PATH, k: int = KNN_NEIGHBORS) -> Dict[str, NeighborModel]:
+    """学習データCSVからモデルのキーごとの近傍モデルを作成（読み込めない場合は空）"""
+    targets = discharge_columns(motion_items, cognitive_items)
+    try:
+        index = NeighborIndex.from_csv(targets, path, k)
+    except Exception as e:
+        print(f"❌ 警告: {path} から近傍モデルを作成できません: {e}")
+        return {}
+    print(f"✅ 近傍モデル作成完了: {index.n_records}人の学習データ, k={index.k}")
+    return {key: NeighborModel(index, key) for key in targets}
@@ -0,0 +1,198 @@
+"""
+予測APIのメトリクス（Prometheusのテキスト形式で/metricsから出力）
+カウンター・ゲージ・ヒストグラムを最小限の実装で持つ（追加の依存パッケージなし）
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+# 処理時間のヒストグラムのバケット（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 予測値の差のヒストグラムのバケット（FIMの点数）
+DIFFERENCE_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0)
+
+_registry = []
+_lock = threading.Lock()
+# record_observations()で集めている間、このスレッドで記録したヒストグラムの値
+# （publishがFalseの間は、このスレッドで記録した値をメトリクスに含めない）
+_local = threading.local()
+
+
+def _publishing() -> bool:
+    return getattr(_local, 'publish', True)
+
+
+def _escape_label_value(value: str) -> str:
+    """ラベルの値をテキスト形式でエスケープ（\\, ", 改行）"""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = '') -> str:
+    parts = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric:
+    metric_type = ''
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.values = {}
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.metric_type}']
+        for key, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    """増加のみのカウンター"""
+    metric_type = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        observations = getattr(_local, 'observations', None)
+        if observations is not None:
+            observations.append((self, key, amount))
+        if not _publishing():
+            return
+        with _lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    """増減する値（処理中のリクエスト数など）"""
+    metric_type = 'gauge'
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with _lock:
+            self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    """処理時間の分布（バケットごとの累積件数・合計・件数）"""
+    metric_type = 'histogram'
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        observations = getattr(_local, 'observations', None)
+        if observations is not None:
+            observations.append((self, key, value))
+        if not _publishing():
+            return
+        with _lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][i] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """withブロックの処理時間を記録"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.metric_type}']
+        for key, state in sorted(self.values.items()):
+            for bound, count in zip(self.buckets, state['counts']):
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.label_names, key, le)} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(state["sum"])}')
+            lines.append(f'{self.name}_count{_format_labels(self.label_names, key)} {state["count"]}')
+        return lines
+
+
+@contextmanager
+def record_observations(publish: bool = True):
+    """withブロックの間にこのスレッドで記録したカウンター・ヒストグラムの値を（メトリクス, ラベルの値, 値）のリストに集める
+
+    1件の予測の段階ごとの処理時間を返す場合（Server-Timing）に使用する。
+    publish=Falseの場合は、ブロック内のカウンター・ヒストグラムの値を/metricsに含めない（ウォームアップなど）。
+    """
+    observations = []
+    _local.observations = observations
+    _local.publish = publish
+    try:
+        yield observations
+    finally:
+        _local.observations = None
+        _local.publish = True
+
+
+def export_observations(observations: List[Tuple]) -> List[Tuple]:
+    """record_observations()で集めた値を、別のプロセスに渡せる（メトリクス名, ラベルの値, 値）のリストにする"""
+    return [(metric.name, key, value) for metric, key, value in observations]
+
+
+def replay_observations(exported: List[Tuple]):
+    """export_observations()の値をこのプロセスのメトリクスに記録する（ワーカープロセスで記録した値を/metricsに含める）"""
+    metrics = {metric.name: metric for metric in _registry}
+    for name, key, value in exported:
+        metric = metrics.get(name)
+        if isinstance(metric, Histogram):
+            metric.observe(value, **dict(zip(metric.label_names, key)))
+        elif isinstance(metric, Counter):
+            metric.inc(value, **dict(zip(metric.label_names, key)))
+
+
+def render_metrics() -> str:
+    """全てのメトリクスをPrometheusのテキスト形式で出力"""
+    with _lock:
+        lines = [line for metric in _registry for line in metric.render()]
+    return '\n'.join(lines) + '\n'
+
+
+# ============================================
+# 予測APIのメトリクス
+# ============================================
+REQUESTS = Counter('fim_requests_total', 'HTTPリクエスト数', ('path', 'status'))
+REQUEST_ERRORS = Counter('fim_request_errors_total', 'エラーになったHTTPリクエスト数（ステータス4xx/5xx）', ('path', 'status'))
+REQUESTS_IN_FLIGHT = Gauge('fim_requests_in_flight', '処理中のHTTPリクエスト数', ('path',))
+REQUEST_DURATION = Histogram('fim_request_duration_seconds', 'HTTPリクエストの処理時間', ('path',))
+STAGE_DURATION = Histogram('fim_stage_duration_seconds', '予測処理の段階ごとの処理時間', ('stage',))
+MODEL_DURATION = Histogram('fim_model_duration_seconds', 'モデルごとの予測時間', ('model',))
+MODEL_FALLBACKS = Counter('fim_model_fallbacks_total', '予測できず代替値（0または項目の合計）を使った件数', ('model', 'reason'))
+PREDICTED_ROWS = Counter('fim_predicted_rows_total', 'モデルで予測した行数（患者数）')
+REQUESTS_REJECTED = Counter('fim_requests_rejected_total', '待ち行列の上限・期限切れで断った予測リクエスト数', ('reason',))
+EVENT_LOOP_LAG = Histogram('fim_event_loop_lag_seconds', 'イベントループの遅延（定期的なsleepの超過時間）')
+MODEL_SET_DURATION = Histogram('fim_model_set_duration_seconds', 'モデルセットごとの予測時間（role: primary / shadow）', ('model_set', 'role'))
+SHADOW_DIFFERENCE = Histogram('fim_shadow_difference_points', 'シャドウとプライマリの予測値の差の絶対値（FIMの点数）',
+                              ('shadow', 'primary', 'output'), buckets=DIFFERENCE_BUCKETS)
+SHADOW_DROPPED = Counter('fim_shadow_dropped_total', '待ちが上限に達したため予測しなかったシャドウのリクエスト数', ('model_set',))
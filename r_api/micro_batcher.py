@@ -0,0 +1,93 @@
+"""
+マイクロバッチ処理
+同時に届いた/predictのリクエストを短い待ち時間の間にまとめ、
+1回の複数行予測で処理してから各リクエストに結果を返す
+"""
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, List
+
+# まとめる待ち時間（ミリ秒、0の場合はマイクロバッチ処理を使わない）
+BATCH_WINDOW_MS = float(os.environ.get('BATCH_WINDOW_MS', '5'))
+# 1回にまとめる最大件数（この件数に達したら待ち時間を待たずに予測する）
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', '32'))
+
+
+class MicroBatcher:
+    """リクエストをまとめて予測関数に渡す
+
+    predict_fn は入力のリストを受け取り、同じ順序で結果のリストを返す非同期関数。
+    予測中のバッチがない場合は待たずに（既にキューにある分だけをまとめて）すぐに予測する。
+    予測中のバッチがある場合は、最初のリクエストが届いてから window_ms 経過するか、
+    max_batch_size 件集まった時点で予測する（混雑している時のみ待ってまとめる）。
+    """
+
+    def __init__(self, predict_fn: Callable[[List[Any]], Awaitable[List[Any]]],
+                 window_ms: float = BATCH_WINDOW_MS, max_batch_size: int = BATCH_MAX_SIZE):
+        self.predict_fn = predict_fn
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.queue = None
+        self.task = None
+        # 実行中の予測タスク（ガベージコレクションされないよう参照を保持）
+        self.pending = set()
+
+    def start(self):
+        """バッチを組み立てるバックグラウンドタスクを開始"""
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """バックグラウンドタスクを停止"""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def submit(self, item: Any) -> Any:
+        """1件の入力を投入し、まとめて予測された結果を待つ"""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            # 予測中のバッチがなければ待ち時間を待たない（1件のみのリクエストを遅らせない）
+            deadline = loop.time() + (self.window if self.pending else 0.0)
+            while len(batch) < self.max_batch_size:
+                # 既にキューにあるものは待たずに取り出す
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # 予測中も次のバッチを組み立てられるよう別タスクで実行
+            task = asyncio.create_task(self.process(batch))
+            self.pending.add(task)
+            task.add_done_callback(self.pending.discard)
+
+    async def process(self, batch: List):
+        # 呼び出し元が既に諦めた（キャンセルされた）リクエストは除く
+        batch = [(item, future) for item, future in batch if not future.done()]
+        if not batch:
+            return
+        try:
+            results = await self.predict_fn([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
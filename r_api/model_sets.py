@@ -0,0 +1,223 @@
+"""
+名前付きのモデルセット（再学習した新しいモデルと現在のモデルを同時に読み込んで比較する）
+MODELS_DIR の下のサブディレクトリを1つのモデルセットとし、リクエストを重みまたはヘッダーで
+いずれかのセット（プライマリ）に振り分ける。シャドウのセットはレスポンスを返した後に同じ入力で予測し、
+プライマリの予測値との差を集計する（シャドウの結果はレスポンスには使わない）
+"""
+import asyncio
+import os
+import random
+import threading
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+
+# 読み込むモデルセット（MODELS_DIRの下のディレクトリ名をカンマ区切りで指定、最初のセットがデフォルト）
+# 指定しない場合はこれまでどおり MODELS_DIR のモデルのみを使う
+MODEL_SETS = [name.strip() for name in os.environ.get('MODEL_SETS', '').split(',') if name.strip()]
+# プライマリのセットに振り分ける重み（例: "current:90,candidate:10"、省略時は全てデフォルトのセット）
+MODEL_SET_WEIGHTS = os.environ.get('MODEL_SET_WEIGHTS', '')
+# レスポンスを返した後に予測して比較するセット（省略時はシャドウの予測を行わない）
+SHADOW_MODEL_SET = os.environ.get('SHADOW_MODEL_SET') or None
+# シャドウの予測を待つリクエストの上限（超えた分は予測せずに破棄する）
+SHADOW_QUEUE_SIZE = int(os.environ.get('SHADOW_QUEUE_SIZE', '256'))
+# シャドウの予測で1回にまとめる最大件数
+SHADOW_BATCH_SIZE = int(os.environ.get('SHADOW_BATCH_SIZE', '8'))
+# プライマリの予測の待ちがなくなるのを確認する間隔（秒）
+SHADOW_IDLE_POLL = 0.005
+
+# リクエストでプライマリのセットを指定するヘッダー
+MODEL_SET_HEADER = 'X-Model-Set'
+# 予測時間の分位点を求めるために保持する直近の件数（セット・役割ごと）
+LATENCY_SAMPLES = 1000
+# 予測値の差がこの値以下の場合に「一致」とする（FIMの点数）
+AGREEMENT_THRESHOLD = 0.5
+
+
+def parse_weights(spec: str, names: List[str]) -> Dict[str, float]:
+    """"名前:重み" のカンマ区切りをdictにする（省略時は最初のセットのみ）"""
+    if not names:
+        return {}
+    if not spec.strip():
+        return {names[0]: 1.0}
+    weights = {}
+    for entry in spec.split(','):
+        name, _, weight = entry.strip().partition(':')
+        if name not in names:
+            raise ValueError(f"MODEL_SET_WEIGHTS のモデルセット {name} が MODEL_SETS にありません: {names}")
+        weights[name] = float(weight or 1)
+        if weights[name] < 0:
+            raise ValueError(f"MODEL_SET_WEIGHTS の重みは0以上にしてください: {entry}")
+    if sum(weights.values()) <= 0:
+        raise ValueError("MODEL_SET_WEIGHTS の重みの合計が0です")
+    return weights
+
+
+PRIMARY_WEIGHTS = parse_weights(MODEL_SET_WEIGHTS, MODEL_SETS)
+if SHADOW_MODEL_SET is not None and SHADOW_MODEL_SET not in MODEL_SETS:
+    raise ValueError(f"SHADOW_MODEL_SET のモデルセット {SHADOW_MODEL_SET} が MODEL_SETS にありません: {MODEL_SETS}")
+
+
+def choose_model_set(weights: Dict[str, float], available: List[str], rng=random) -> Optional[str]:
+    """読み込み済みのセットの中から重みに従ってプライマリのセットを選ぶ（選べない場合はNone）"""
+    candidates = [(name, weight) for name, weight in weights.items() if name in available and weight > 0]
+    if not candidates:
+        return None
+    names, values = zip(*candidates)
+    return rng.choices(names, weights=values)[0]
+
+
+def prediction_differences(primary: Dict, shadow: Dict,
+                           motion_items: List[str], cognitive_items: List[str]) -> Dict[str, float]:
+    """レスポンス（dict）の予測値ごとの差（シャドウ - プライマリ、両方にある値のみ）
+
+    合計値はレスポンスの項目名（total, motionTotal, cognitiveTotal）、項目はモデルのキーで返す。
+    """
+    differences = {}
+    for field in ('total', 'motionTotal', 'cognitiveTotal'):
+        if primary.get(field) is not None and shadow.get(field) is not None:
+            differences[field] = shadow[field] - primary[field]
+    for field, items in (('motion', motion_items), ('cognitive', cognitive_items)):
+        if primary.get(field) is not None and shadow.get(field) is not None:
+            # 運動機能の最後の値（階段）はモデルがないため比較しない
+            for item, a, b in zip(items, primary[field], shadow[field]):
+                differences[item] = b - a
+    return differences
+
+
+class ModelSetStats:
+    """モデルセットごとの予測時間と、シャドウとプライマリの予測値の差の集計（/healthで確認）"""
+
+    def __init__(self, max_samples: int = LATENCY_SAMPLES):
+        self.lock = threading.Lock()
+        self.max_samples = max_samples
+        # (セット, 役割) -> 直近の予測時間（秒）, 呼び出し回数, 行数
+        self.latencies = {}
+        self.calls = {}
+        self.rows = {}
+        # (シャドウ, プライマリ) -> 予測値 -> [件数, 差の絶対値の合計, 差の合計, 差の絶対値の最大, 一致した件数]
+        self.differences = {}
+
+    def observe_latency(self, model_set: str, role: str, seconds: float, n_rows: int):
+        key = (model_set, role)
+        with self.lock:
+            if key not in self.latencies:
+                self.latencies[key] = deque(maxlen=self.max_samples)
+            self.latencies[key].append(seconds)
+            self.calls[key] = self.calls.get(key, 0) + 1
+            self.rows[key] = self.rows.get(key, 0) + n_rows
+
+    def observe_differences(self, shadow: str, primary: str, differences: Dict[str, float]):
+        with self.lock:
+            totals = self.differences.setdefault((shadow, primary), {})
+            for name, difference in differences.items():
+                entry = totals.setdefault(name, [0, 0.0, 0.0, 0.0, 0])
+                entry[0] += 1
+                entry[1] += abs(difference)
+                entry[2] += difference
+                entry[3] = max(entry[3], abs(difference))
+                entry[4] += abs(difference) <= AGREEMENT_THRESHOLD
+
+    def latency_summary(self, model_set: str) -> Dict:
+        """役割（primary / shadow）ごとの予測時間（直近の中央値・95パーセンタイル）と件数"""
+        summary = {}
+        with self.lock:
+            for (name, role), samples in self.latencies.items():
+                if name != model_set or not samples:
+                    continue
+                values = np.array(samples)
+                summary[role] = {
+                    "calls": self.calls[(name, role)],
+                    "rows": self.rows[(name, role)],
+                    "p50_seconds": round(float(np.percentile(values, 50)), 6),
+                    "p95_seconds": round(float(np.percentile(values, 95)), 6),
+                    "mean_seconds": round(float(values.mean()), 6),
+                }
+        return summary
+
+    def difference_summary(self) -> Dict:
+        """シャドウとプライマリの組ごと・予測値ごとの差（平均絶対差, 平均差, 最大絶対差, 一致率）"""
+        summary = {}
+        with self.lock:
+            for (shadow, primary), totals in self.differences.items():
+                summary[f"{shadow}_vs_{primary}"] = {
+                    name: {
+                        "count": n,
+                        "mean_abs_difference": round(abs_sum / n, 4),
+                        "mean_difference": round(total / n, 4),
+                        "max_abs_difference": round(max_abs, 4),
+                        "agreement_rate": round(agreed / n, 4),
+                    }
+                    for name, (n, abs_sum, total, max_abs, agreed) in totals.items()
+                }
+        return summary
+
+
+class ShadowEvaluator:
+    """シャドウのセットの予測をレスポンスの処理の外で行う
+
+    submit()は予測を待たずに戻る（待ちが上限に達している場合は破棄する）。
+    予測はバックグラウンドタスクでまとめて行い、is_idle()がTrueを返すまで（プライマリの予測の待ちが
+    なくなるまで）始めない。evaluate_fnはsubmitした値のリストを受け取る非同期関数。
+    """
+
+    def __init__(self, evaluate_fn: Callable[[List], Awaitable], is_idle: Callable[[], bool],
+                 max_queue: int = SHADOW_QUEUE_SIZE, batch_size: int = SHADOW_BATCH_SIZE):
+        self.evaluate_fn = evaluate_fn
+        self.is_idle = is_idle
+        self.max_queue = max_queue
+        self.batch_size = max(1, batch_size)
+        self.queue = deque()
+        self.wakeup = None
+        self.task = None
+        self.evaluated = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self):
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def submit(self, item) -> bool:
+        """予測する値を追加（待ちが上限に達している場合は破棄してFalse）"""
+        if len(self.queue) >= self.max_queue:
+            self.dropped += 1
+            return False
+        self.queue.append(item)
+        self.wakeup.set()
+        return True
+
+    async def run(self):
+        while True:
+            if not self.queue:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+            # プライマリの予測を優先する（待ち行列が空になってから始める）
+            while not self.is_idle():
+                await asyncio.sleep(SHADOW_IDLE_POLL)
+            batch = [self.queue.popleft() for _ in range(min(self.batch_size, len(self.queue)))]
+            try:
+                await self.evaluate_fn(batch)
+                self.evaluated += len(batch)
+            except Exception as e:
+                self.failed += len(batch)
+                print(f"⚠️  警告: シャドウの予測に失敗しました: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": len(self.queue),
+            "max_queue": self.max_queue,
+            "evaluated": self.evaluated,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
@@ -2,26 +2,54 @@
 FIM予測APIサーバー（FastAPI）
 Rで学習したランダムフォレストモデルを直接使用
 """
-from fastapi import FastAPI, HTTPException
+from fastapi import BackgroundTasks, FastAPI, File, Header, HTTPException, Query, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Dict, List, Optional
-import rpy2.robjects as ro
-from rpy2.robjects import pandas2ri
-from rpy2.robjects.packages import importr
-import pandas as pd
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, field_validator, model_validator
+from starlette.routing import Match
+from typing import Dict, List, NamedTuple, Optional
+import numpy as np
+import asyncio
+import bz2
+import cProfile
+import gzip
+import hashlib
+import lzma
+import math
 import os
+import signal
 import sys
-
-# Rのパッケージをインポート
-try:
-    base = importr('base')
-    caret = importr('caret')
-    pandas2ri.activate()
-    print("Rパッケージの読み込みが完了しました")
-except Exception as e:
-    print(f"警告: Rパッケージの読み込みに失敗しました: {e}")
-    print("Rとrpy2が正しくインストールされているか確認してください")
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from rf_engine import load_forests, native_model_filename
+from knn_engine import KNN_DATA_PATH, data_version, load_neighbor_models
+from training_data import read_training_csv, csv_to_payloads
+from feature_encoder import FEATURE_COLUMNS, MOTION_FEATURES, COGNITIVE_FEATURES, FeatureEncoder
+from r_worker_pool import R_WORKERS, RWorkerPool
+from process_memory import process_memory
+from model_sets import (
+    MODEL_SETS, MODEL_SET_HEADER, PRIMARY_WEIGHTS, SHADOW_MODEL_SET, ModelSetStats, ShadowEvaluator,
+    choose_model_set, prediction_differences
+)
+from micro_batcher import BATCH_WINDOW_MS, BATCH_MAX_SIZE, MicroBatcher
+from prediction_cache import PREDICTION_CACHE_SIZE, PredictionCache
+from prediction_executor import (
+    PREDICTION_QUEUE_SIZE, DeadlineExceededError, PredictionExecutor, QueueFullError,
+    deadline_after, wait_until
+)
+from csv_scoring import (
+    CSV_CHUNK_SIZE, ERROR_COLUMN, OUTPUT_FORMATS, output_columns, read_csv_chunks, prepare_chunk,
+    fill_records, mark_fallbacks, fail_records, format_ndjson, format_csv
+)
+from metrics import (
+    REQUESTS, REQUEST_ERRORS, REQUESTS_IN_FLIGHT, REQUEST_DURATION, STAGE_DURATION,
+    MODEL_DURATION, MODEL_FALLBACKS, PREDICTED_ROWS, REQUESTS_REJECTED, EVENT_LOOP_LAG, MODEL_SET_DURATION,
+    SHADOW_DIFFERENCE, SHADOW_DROPPED, render_metrics, record_observations
+)
+from profiling import (
+    PROFILE_MAX_SECONDS, RPROF_INTERVAL, timing_entries, server_timing_header, python_profile_files, make_zip
+)
 
 app = FastAPI(
     title="FIM予測API",
@@ -38,10 +66,185 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# どのエンドポイントにも一致しないリクエストのpathラベル（存在しないURLごとに系列を増やさない）
+UNMATCHED_PATH_LABEL = '<unmatched>'
+
+def route_path_label(request) -> str:
+    """メトリクスのpathラベル（リクエストのURLではなく、一致したエンドポイントのパスのテンプレート）"""
+    label = UNMATCHED_PATH_LABEL
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and label == UNMATCHED_PATH_LABEL:
+            # パスは一致するがメソッドが異なる（405）
+            label = route.path
+    return label
+
+@app.middleware("http")
+async def record_request_metrics(request, call_next):
+    """リクエスト数・処理中の数・処理時間・エラー数を記録"""
+    path = route_path_label(request)
+    REQUESTS_IN_FLIGHT.inc(path=path)
+    started = time.perf_counter()
+    # 受け付けた時刻（Server-Timingの入力チェックの時間に使用）
+    request.state.started = started
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        REQUESTS_IN_FLIGHT.dec(path=path)
+        REQUEST_DURATION.observe(time.perf_counter() - started, path=path)
+        REQUESTS.inc(path=path, status=status)
+        if status >= 400:
+            REQUEST_ERRORS.inc(path=path, status=status)
+
 # Rモデルのパス（r_api/r_models/ディレクトリ）
 MODELS_DIR = os.path.join(os.path.dirname(__file__), 'r_models')
 r_models = {}
 
+# 埋め込みRとR関数（r_engineモジュール）。インポート時にはRを起動せず、init_r_engine()で読み込む
+r_engine = None
+# Rの起動・パッケージの読み込みにかかった時間（秒）
+r_engine_init_seconds = None
+
+# モデルファイルを並列に読み込むスレッド数
+MODEL_LOAD_THREADS = int(os.environ.get('MODEL_LOAD_THREADS', '8'))
+# モデルごとの読み込み時間・サイズ・使用メモリ
+model_load_stats = {}
+
+# Rモデルの読み込み時に予測に使わない要素（学習データ・リサンプリングの結果など）を取り除くか（"1"で有効）
+# 取り除く前と予測値が完全に一致しない場合は、そのモデルは取り除かずに使う
+MODEL_SLIM = os.environ.get('MODEL_SLIM', '0') == '1'
+# 取り除く要素: caretのtrainオブジェクト / trainControl / finalModel（randomForest）
+SLIM_MODEL_COMPONENTS = ['trainingData', 'pred', 'resample', 'resampledCM', 'results', 'times', 'dots']
+SLIM_CONTROL_COMPONENTS = ['index', 'indexOut', 'indexFinal', 'seeds']
+SLIM_FINAL_MODEL_COMPONENTS = ['y', 'predicted', 'oob.times', 'votes', 'proximity', 'inbag',
+                               'localImportance', 'importanceSD', 'mse', 'rsq', 'test']
+# 取り除く前後の予測値を比べる学習データの行数
+SLIM_CHECK_ROWS = 50
+
+# モデルを読み込んだ後、予測できる状態にする前に全モデルで予測する行数（0の場合はウォームアップしない）
+# 初回の予測で行われるパッケージの読み込みなどを、利用者のリクエストより前に済ませる
+WARMUP_ROWS = int(os.environ.get('WARMUP_ROWS', '8'))
+# ウォームアップで全モデルを予測する回数（1回目が初回、2回目以降の中央値が2回目以降の予測時間）
+WARMUP_PASSES = int(os.environ.get('WARMUP_PASSES', '3'))
+# 最後のウォームアップの結果（モデルごとの初回・2回目以降の予測時間）
+warmup_stats = {}
+# 全モデルの読み込みが完了し、予測できる状態かどうか（/readyで確認）
+models_ready = False
+model_load_seconds = None
+
+# 予測エンジン（"r": rpy2経由でRモデルを使用, "native": 書き出した木構造をNumPyで評価,
+# "knn": 学習データCSVの近い患者の退院時FIMから予測（劣化モード））
+PREDICTION_ENGINE = os.environ.get('PREDICTION_ENGINE', 'r')
+native_models = {}
+# 設定した予測エンジンのモデルが1つも読み込めない場合に、k近傍法で予測を続けるか（"1"で有効）
+KNN_FALLBACK = os.environ.get('KNN_FALLBACK', '0') == '1'
+
+# Rワーカープール（R_WORKERS > 0 の場合に起動時に作成）
+worker_pool = None
+
+# 予測結果のキャッシュ（モデルを読み込み直すと破棄される）
+prediction_cache = PredictionCache(PREDICTION_CACHE_SIZE)
+
+# 予測処理の専用スレッド（Rの呼び出しはイベントループではなく全てこのスレッドで行う）
+prediction_executor = PredictionExecutor(PREDICTION_QUEUE_SIZE)
+
+# 同時リクエストをまとめるマイクロバッチ処理（BATCH_WINDOW_MS > 0 の場合に起動時に作成）
+micro_batcher = None
+
+# 一括予測で待ち行列が空くのを待つ間隔（秒）
+BULK_RETRY_INTERVAL = 0.1
+
+# 全ての/predictでServer-Timingヘッダーを返すか（/admin/profilingで切り替え、X-Profileヘッダーでリクエストごとにも指定できる）
+profiling_enabled = False
+# /admin/profileのプロファイリングを実行中か
+profile_session_active = False
+
+# 起動時のモデル読み込みタスク
+model_loading_task = None
+
+# イベントループの遅延を測定するタスク
+event_loop_monitor_task = None
+EVENT_LOOP_MONITOR_INTERVAL = 0.5
+
+# モデルの再読み込み（同時に複数の再読み込みを行わないためのロック）
+reload_lock = None
+model_watch_task = None
+# モデルディレクトリを監視する間隔（秒、0の場合は監視しない）
+MODEL_WATCH_INTERVAL = float(os.environ.get('MODEL_WATCH_INTERVAL', '0'))
+# 管理用エンドポイントのトークン（設定した場合はX-Admin-Tokenヘッダーで一致を確認）
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+# pre-fork方式の親プロセスのPID（prefork_server.pyがforkの前に設定する。それ以外はNone）
+prefork_parent_pid = None
+
+# 予測対象の項目（モデルキー、レスポンスの並び順）
+MOTION_ITEMS = ['eat', 'groom', 'bath', 'dress_up', 'dress_low', 
+                'toile', 'bladder', 'bowel', 'trans_bed', 
+                'trans_toile', 'trans_bath', 'gait']
+COGNITIVE_ITEMS = ['comp', 'express', 'social', 'problem', 'memory']
+
+# リクエストのoutputsで指定できる予測値（省略時は全て）
+OUTPUTS = ['total', 'motion_total', 'cognitive_total', 'motion_items', 'cognitive_items']
+
+# 合計値を項目の予測値の合計で求める場合の項目
+TOTAL_ITEMS = {
+    'motion_total': MOTION_ITEMS,
+    'cognitive_total': COGNITIVE_ITEMS,
+}
+
+# 入力のFIM項目の値の範囲
+FIM_ITEM_MIN = 1
+FIM_ITEM_MAX = 7
+# 感度分析で予測する行数（項目数 x 値の数）の上限（全てのFIM項目（運動12 + 認知5 = 17項目）を1-7に動かす場合は17 x 7 = 119行）
+SENSITIVITY_MAX_ROWS = int(os.environ.get('SENSITIVITY_MAX_ROWS', '256'))
+
+# モデルに渡せる変数の型（Rのクラス名）
+NUMERIC_TYPES = ('numeric', 'integer', 'double')
+
+# モデルファイルのリスト（Rで保存した.rdsファイル）
+MODEL_FILES = {
+    'total': 'rf_model_all_FIM.rds',
+    'motion_total': 'rf_model_motor_FIM.rds',
+    'cognitive_total': 'rf_model_cog_FIM.rds',
+    'eat': 'rf_model_eat_FIM.rds',
+    'groom': 'rf_model_groom_FIM.rds',
+    'bath': 'rf_model_bath_FIM.rds',
+    'dress_up': 'rf_model_dress_up_FIM.rds',
+    'dress_low': 'rf_model_dress_low_FIM.rds',
+    'toile': 'rf_model_toile_FIM.rds',
+    'bladder': 'rf_model_bladder_FIM.rds',
+    'bowel': 'rf_model_bowel_FIM.rds',
+    'trans_bed': 'rf_model_trans_bed_FIM.rds',
+    'trans_toile': 'rf_model_trans_toile_FIM.rds',
+    'trans_bath': 'rf_model_trans_bath_FIM.rds',
+    'gait': 'rf_model_gait_FIM.rds',
+    'comp': 'rf_model_comp_FIM.rds',
+    'express': 'rf_model_express_FIM.rds',
+    'social': 'rf_model_social_FIM.rds',
+    'problem': 'rf_model_problem_FIM.rds',
+    'memory': 'rf_model_memory_FIM.rds',
+}
+
+# 入力をモデルに渡す数値の行列に変換するエンコーダー（起動時に1回だけ作成）
+feature_encoder = FeatureEncoder(FEATURE_COLUMNS)
+
+def validate_fim_items(values: Dict[str, float], items: List[str]) -> Dict[str, float]:
+    """FIM項目が全て揃っており、値が1-7の範囲にあるかを確認（Rに渡す前に不正な入力を拒否する）"""
+    missing = [item for item in items if item not in values]
+    if missing:
+        raise ValueError(f"FIM項目が不足しています: {missing}")
+    out_of_range = [
+        item for item in items
+        if not (FIM_ITEM_MIN <= values[item] <= FIM_ITEM_MAX)
+    ]
+    if out_of_range:
+        raise ValueError(f"FIM項目の値は{FIM_ITEM_MIN}-{FIM_ITEM_MAX}の範囲で入力してください: {out_of_range}")
+    return values
+
 # リクエストモデル
 class PredictionRequest(BaseModel):
     gender: str  # "male" or "female"
@@ -51,78 +254,269 @@ class PredictionRequest(BaseModel):
     daysFromOnset: float
     motionValues: Dict[str, float]
     cognitiveValues: Dict[str, float]
+    outputs: Optional[List[str]] = None  # 返す予測値（OUTPUTSから選択、省略時は全て）
+    sumTotals: bool = False  # 合計値を合計のモデルではなく項目の予測値の合計で求める
+    
+    @field_validator('outputs')
+    @classmethod
+    def check_outputs(cls, outputs: Optional[List[str]]) -> Optional[List[str]]:
+        if outputs is not None:
+            unknown = [output for output in outputs if output not in OUTPUTS]
+            if unknown or not outputs:
+                raise ValueError(f"outputsには次の値を指定してください: {OUTPUTS}（指定された値: {outputs}）")
+        return outputs
+    
+    @field_validator('motionValues')
+    @classmethod
+    def check_motion_values(cls, values: Dict[str, float]) -> Dict[str, float]:
+        return validate_fim_items(values, MOTION_FEATURES)
+    
+    @field_validator('cognitiveValues')
+    @classmethod
+    def check_cognitive_values(cls, values: Dict[str, float]) -> Dict[str, float]:
+        return validate_fim_items(values, COGNITIVE_FEATURES)
 
 # レスポンスモデル
+# outputsで指定されなかった予測値はNone
 class PredictionResponse(BaseModel):
-    motion: List[float]
-    cognitive: List[float]
-    motionTotal: float
-    cognitiveTotal: float
-    total: float
-
-def load_r_models():
-    """Rで学習したモデルを読み込む"""
-    global r_models
+    motion: Optional[List[float]] = None
+    cognitive: Optional[List[float]] = None
+    motionTotal: Optional[float] = None
+    cognitiveTotal: Optional[float] = None
+    total: Optional[float] = None
+    modelVersion: Optional[str] = None  # 予測に使用したモデルのバージョン
+
+# 感度分析（1項目の値を動かした場合の予測値の変化）のリクエスト
+class SensitivityRequest(BaseModel):
+    base: PredictionRequest  # 基準の入力（outputs・sumTotalsもここで指定）
+    items: List[str]  # 値を動かす項目（例: "歩行", "トイレ移乗"）
+    values: List[float] = list(range(FIM_ITEM_MIN, FIM_ITEM_MAX + 1))  # 各項目に設定する値
     
-    print(f"モデルディレクトリ: {MODELS_DIR}")
-    print(f"モデルディレクトリの存在: {os.path.exists(MODELS_DIR)}")
+    @field_validator('items')
+    @classmethod
+    def check_items(cls, items: List[str]) -> List[str]:
+        unknown = [item for item in items if item not in MOTION_FEATURES + COGNITIVE_FEATURES]
+        if unknown or not items:
+            raise ValueError(f"itemsにはFIM項目の名前を指定してください（指定された値: {items}）")
+        return items
     
-    if not os.path.exists(MODELS_DIR):
-        print(f"❌ エラー: モデルディレクトリが存在しません: {MODELS_DIR}")
-        return
+    @field_validator('values')
+    @classmethod
+    def check_values(cls, values: List[float]) -> List[float]:
+        if not values or not all(FIM_ITEM_MIN <= value <= FIM_ITEM_MAX for value in values):
+            raise ValueError(f"valuesは{FIM_ITEM_MIN}-{FIM_ITEM_MAX}の範囲で指定してください")
+        return values
+    
+    @model_validator(mode='after')
+    def check_grid_size(self) -> 'SensitivityRequest':
+        # 1件のリクエストで予測処理のスレッドを長時間使わないよう、予測する行数を制限する
+        rows = len(self.items) * len(self.values)
+        if rows > SENSITIVITY_MAX_ROWS:
+            raise ValueError(f"項目数 x 値の数（{rows}）が上限（{SENSITIVITY_MAX_ROWS}）を超えています")
+        return self
+
+# 感度分析のレスポンス
+# items: 項目ごとに、予測値の名前（total, motionTotalなど）-> valuesの順に並べた予測値
+class SensitivityResponse(BaseModel):
+    values: List[float]
+    base: PredictionResponse
+    items: Dict[str, Dict[str, list]]
+    modelVersion: Optional[str] = None
+
+# 読み込み済みのモデルの組とそのバージョン
+# 再読み込み時は新しい組を作成してから丸ごと差し替えるため、予測中のリクエストは古い組で完了する
+class ModelSnapshot(NamedTuple):
+    version: Optional[str]
+    models: Dict
+    # モデルの予測エンジン（KNN_FALLBACKで代替した場合は "knn"）
+    engine: str = PREDICTION_ENGINE
+
+model_snapshot = ModelSnapshot(None, {})
+
+# 最後に読み込んだモデルの組で、入力の列と一致しなかったモデルとその内容
+model_schema_errors = {}
+
+# デフォルト以外のモデルセット（MODEL_SETSの2つ目以降）: セット名 -> モデルの組
+# デフォルトのセットは model_snapshot を使う
+model_set_snapshots = {}
+# デフォルト以外のモデルセットの読み込み時間・使用メモリ（セット名 -> model_load_statsと同じ形式）
+model_set_load_stats = {}
+# デフォルト以外のモデルセットで、変数が入力の列と一致しなかったモデル
+model_set_schema_errors = {}
+# モデルセットごとの予測時間・シャドウとの予測値の差
+model_set_stats = ModelSetStats()
+# シャドウのセットの予測（SHADOW_MODEL_SETを指定した場合に起動時に作成）
+shadow_evaluator = None
+# シャドウの予測を行うスレッド（ネイティブモデル・近傍モデルの場合）
+shadow_executor = None
+# シャドウの予測を行うワーカープロセス（Rモデルの場合。プライマリの予測の専用スレッドを使わないよう別のRで予測する）
+shadow_pool = None
+shadow_pool_task = None
+
+def default_model_set() -> Optional[str]:
+    """デフォルトのモデルセット（MODEL_SETSの最初のセット、モデルセットを使わない場合はNone）"""
+    return MODEL_SETS[0] if MODEL_SETS else None
+
+def shadow_set_in_pool_only() -> bool:
+    """シャドウのセットをシャドウの予測用のワーカーのみに読み込むか
     
-    # モデルファイルのリスト（Rで保存した.rdsファイル）
-    model_files = {
-        'total': 'rf_model_all_FIM.rds',
-        'motion_total': 'rf_model_motor_FIM.rds',
-        'cognitive_total': 'rf_model_cog_FIM.rds',
-        'eat': 'rf_model_eat_FIM.rds',
-        'groom': 'rf_model_groom_FIM.rds',
-        'bath': 'rf_model_bath_FIM.rds',
-        'dress_up': 'rf_model_dress_up_FIM.rds',
-        'dress_low': 'rf_model_dress_low_FIM.rds',
-        'toile': 'rf_model_toile_FIM.rds',
-        'bladder': 'rf_model_bladder_FIM.rds',
-        'bowel': 'rf_model_bowel_FIM.rds',
-        'trans_bed': 'rf_model_trans_bed_FIM.rds',
-        'trans_toile': 'rf_model_trans_toile_FIM.rds',
-        'trans_bath': 'rf_model_trans_bath_FIM.rds',
-        'gait': 'rf_model_gait_FIM.rds',
-        'comp': 'rf_model_comp_FIM.rds',
-        'express': 'rf_model_express_FIM.rds',
-        'social': 'rf_model_social_FIM.rds',
-        'problem': 'rf_model_problem_FIM.rds',
-        'memory': 'rf_model_memory_FIM.rds',
+    Rモデル（R_WORKERS=0）のシャドウの予測は別のワーカープロセスで行うため、振り分けの重みが0のシャドウのセットは
+    このプロセスでは使わない（読み込むと同じモデルがメモリに2つ残る）。
+    """
+    return (SHADOW_MODEL_SET is not None and PREDICTION_ENGINE == 'r' and R_WORKERS == 0
+            and SHADOW_MODEL_SET != default_model_set() and PRIMARY_WEIGHTS.get(SHADOW_MODEL_SET, 0.0) == 0)
+
+def primary_model_sets() -> List[str]:
+    """このプロセスに読み込むモデルセット（シャドウの予測用のワーカーのみで使うセットを除く）"""
+    if shadow_set_in_pool_only():
+        return [name for name in MODEL_SETS if name != SHADOW_MODEL_SET]
+    return MODEL_SETS
+
+def model_set_dir(model_set: Optional[str] = None) -> str:
+    """モデルセットのモデルファイルのディレクトリ（省略時はデフォルトのセット）
+    
+    モデルセットを使わない場合は MODELS_DIR、使う場合は MODELS_DIR/<セット名>。
+    """
+    name = model_set or default_model_set()
+    return os.path.join(MODELS_DIR, name) if name else MODELS_DIR
+
+def load_stats_for(model_set: Optional[str] = None) -> Dict:
+    """モデルセットの読み込み時間・使用メモリを記録するdict（デフォルトのセットはmodel_load_stats）"""
+    if model_set is None or model_set == default_model_set():
+        return model_load_stats
+    return model_set_load_stats.setdefault(model_set, {})
+
+def init_r_engine():
+    """埋め込みRを起動し、caretと予測に使うR関数を読み込む（読み込み済みの場合は何もしない）
+    
+    Rモデルを読み込む時に呼び出す。ネイティブモデル・k近傍法のみを使う場合や、入力の変換のみを使う
+    スクリプトではRを起動しない。サーバーでは起動時にメインスレッドで呼び出す。
+    戻り値: r_engineモジュール（Rを起動できない場合はNone）
+    """
+    global r_engine, r_engine_init_seconds
+    
+    if r_engine is not None:
+        return r_engine
+    started = time.perf_counter()
+    try:
+        import r_engine as engine
+    except Exception as e:
+        print(f"警告: Rパッケージの読み込みに失敗しました: {e}")
+        print("Rとrpy2が正しくインストールされているか確認してください")
+        return None
+    r_engine_init_seconds = round(time.perf_counter() - started, 3)
+    r_engine = engine
+    print(f"Rパッケージの読み込みが完了しました（{r_engine_init_seconds}秒）")
+    return r_engine
+
+def read_model_file(key: str, model_path: str, stats: Dict) -> bytes:
+    """.rdsファイルを読み込み、シリアライズされたRオブジェクトのバイト列に展開する
+    
+    圧縮の展開はPython側で行う（GILを解放するため複数ファイルを並列に処理できる）。
+    """
+    started = time.perf_counter()
+    with open(model_path, 'rb') as f:
+        data = f.read()
+    size_bytes = len(data)
+    
+    # saveRDSの圧縮形式（gzip / bzip2 / xz、または非圧縮）を判定して展開
+    if data[:2] == b'\x1f\x8b':
+        data = gzip.decompress(data)
+    elif data[:3] == b'BZh':
+        data = bz2.decompress(data)
+    elif data[:6] == b'\xfd7zXZ\x00':
+        data = lzma.decompress(data)
+    
+    stats[key] = {
+        "file": os.path.basename(model_path),
+        "size_bytes": size_bytes,
+        "decompressed_bytes": len(data),
+        "read_seconds": round(time.perf_counter() - started, 4),
     }
+    return data
+
+def read_model_files(model_set: Optional[str] = None) -> Dict[str, bytes]:
+    """全てのモデルファイルを並列に読み込む（Rオブジェクトへの復元は行わない）
+    
+    model_set: 読み込むモデルセット（省略時はデフォルトのセット）
+    """
+    models_dir = model_set_dir(model_set)
+    stats = load_stats_for(model_set)
+    print(f"モデルディレクトリ: {models_dir}")
+    print(f"モデルディレクトリの存在: {os.path.exists(models_dir)}")
+    
+    if not os.path.exists(models_dir):
+        print(f"❌ エラー: モデルディレクトリが存在しません: {models_dir}")
+        return {}
     
     # ディレクトリ内のファイルを確認
     try:
-        existing_files = os.listdir(MODELS_DIR)
+        existing_files = os.listdir(models_dir)
         print(f"モデルディレクトリ内のファイル: {existing_files}")
     except Exception as e:
         print(f"警告: ディレクトリの読み取りに失敗: {e}")
         existing_files = []
     
-    # 各モデルを読み込む
-    loaded_count = 0
-    for key, filename in model_files.items():
-        model_path = os.path.join(MODELS_DIR, filename)
-        if os.path.exists(model_path):
+    # 読み込むファイルを確認
+    model_paths = {}
+    for key, filename in MODEL_FILES.items():
+        model_path = os.path.join(models_dir, filename)
+        if not os.path.exists(model_path):
+            print(f"⚠️  警告: {model_path} が見つかりません")
+        elif not os.access(model_path, os.R_OK):
+            # ファイルの読み取り権限を確認
+            print(f"❌ エラー: {model_path} に読み取り権限がありません")
+        else:
+            model_paths[key] = model_path
+    
+    # 各ファイルを並列に読み込む
+    raw_files = {}
+    with ThreadPoolExecutor(max_workers=MODEL_LOAD_THREADS) as executor:
+        futures = {
+            key: executor.submit(read_model_file, key, model_path, stats)
+            for key, model_path in model_paths.items()
+        }
+        for key, future in futures.items():
             try:
-                # ファイルの読み取り権限を確認
-                if not os.access(model_path, os.R_OK):
-                    print(f"❌ エラー: {model_path} に読み取り権限がありません")
-                    continue
-                
-                r_models[key] = base.readRDS(model_path)
-                print(f"✅ Rモデル読み込み完了: {key} ({filename})")
-                loaded_count += 1
+                raw_files[key] = future.result()
             except Exception as e:
-                print(f"❌ 警告: {model_path} の読み込みに失敗: {e}")
-                import traceback
-                print(f"   詳細: {traceback.format_exc()}")
-        else:
-            print(f"⚠️  警告: {model_path} が見つかりません")
+                print(f"❌ 警告: {model_paths[key]} の読み込みに失敗: {e}")
+    return raw_files
+
+def load_r_models(raw_files: Optional[Dict[str, bytes]] = None, model_set: Optional[str] = None) -> Dict:
+    """Rで学習したモデルを読み込む
+    
+    raw_files: read_model_files()の結果（省略時はここで読み込む）
+    model_set: 読み込むモデルセット（省略時はデフォルトのセット）
+    ファイルの読み込みは並列に行い、RオブジェクトへのunserializeはRのスレッドで順に行う。
+    """
+    global r_models
+    
+    if init_r_engine() is None:
+        raw_files = {}
+    elif raw_files is None:
+        raw_files = read_model_files(model_set)
+    load_stats = load_stats_for(model_set)
+    
+    # 各モデルを新しい組に読み込む
+    models = {}
+    loaded_count = 0
+    for key, data in raw_files.items():
+        filename = MODEL_FILES[key]
+        try:
+            started = time.perf_counter()
+            models[key] = r_engine.unserialize(r_engine.ro.vectors.ByteVector(data))
+            load_stats[key]["unserialize_seconds"] = round(time.perf_counter() - started, 4)
+            if MODEL_SLIM:
+                models[key] = slim_r_model(key, models[key], load_stats)
+            stats = load_stats[key]
+            print(f"✅ Rモデル読み込み完了: {key} ({filename}, {stats['size_bytes']:,} bytes, "
+                  f"読み込み {stats['read_seconds']}秒, 復元 {stats['unserialize_seconds']}秒)")
+            loaded_count += 1
+        except Exception as e:
+            print(f"❌ 警告: {filename} の読み込みに失敗: {e}")
+            import traceback
+            print(f"   詳細: {traceback.format_exc()}")
     
     print(f"読み込み完了: {loaded_count}個のRモデルが正常に読み込まれました")
     
@@ -132,202 +526,1461 @@ def load_r_models():
         print("   1. モデルファイル（.rds）が r_api/r_models/ ディレクトリに存在するか")
         print("   2. ファイルの読み取り権限があるか")
         print("   3. Rとrpy2が正しくインストールされているか")
+    elif model_set is None:
+        r_models = models
+    return models
+
+def slim_r_model(key: str, model, load_stats: Dict):
+    """予測に使わない要素を取り除いたモデルを返す（予測値が変わる場合は元のモデル）"""
+    ro = r_engine.ro
+    before = int(r_engine.model_memory(model).rx2('total')[0])
+    result = r_engine.slim_model(
+        model, ro.StrVector(SLIM_MODEL_COMPONENTS), ro.StrVector(SLIM_CONTROL_COMPONENTS),
+        ro.StrVector(SLIM_FINAL_MODEL_COMPONENTS), SLIM_CHECK_ROWS
+    )
+    if not bool(result.rx2('slimmed')[0]):
+        print(f"⚠️  警告: {key} の不要な要素を取り除けません（元のモデルを使用）: {result.rx2('reason')[0]}")
+        load_stats[key]["slim"] = {"slimmed": False, "reason": str(result.rx2('reason')[0])}
+        return model
+    slim = result.rx2('model')
+    after = int(r_engine.model_memory(slim).rx2('total')[0])
+    load_stats[key]["slim"] = {"slimmed": True, "before_bytes": before, "after_bytes": after}
+    return slim
 
-def prepare_r_dataframe(input_data: PredictionRequest) -> pd.DataFrame:
-    """入力データをRのデータフレーム形式に変換
-    
-    注意: Rの学習データの列名に合わせる必要があります。
-    実際のRの学習データの列名を確認して調整してください。
-    """
-    # 基本情報
-    gender = 0 if input_data.gender == 'male' else 1
-    age = input_data.age
-    bmi = input_data.bmi
-    care_level = 1 if input_data.careLevel == 'yes' else 0
-    days_from_onset = input_data.daysFromOnset
-    
-    # 運動機能項目（12項目）の順序（Rの学習データの順序に合わせる）
-    motion_order = ['食事', '整容', '清拭', '更衣上半身', '更衣下半身', 
-                    'トイレ動作', '排尿管理', '排便管理', 'ベッド移乗', 
-                    'トイレ移乗', '浴槽移乗', '歩行']
-    motion_values = [input_data.motionValues.get(item, 0.0) for item in motion_order]
-    
-    # 認知機能項目（5項目）の順序（Rの学習データの順序に合わせる）
-    cognitive_order = ['理解', '表出', '社会的交流', '問題解決', '記憶']
-    cognitive_values = [input_data.cognitiveValues.get(item, 0.0) for item in cognitive_order]
-    
-    # データフレームを作成
-    # 注意: 列名はRの学習データの列名と一致させる必要があります
-    # 一般的な形式を想定していますが、実際のRデータに合わせて調整してください
-    data = {
-        'gender': [gender],
-        'age': [age],
-        'bmi': [bmi],
-        'care_level': [care_level],
-        'days_from_onset': [days_from_onset],
+def model_memory(model, engine: str = PREDICTION_ENGINE) -> Dict:
+    """モデルの使用メモリ（バイト）と構成要素ごとの内訳
+
+    Rモデルはobject.size、ネイティブモデルは配列のサイズから求める。
+    """
+    if engine == 'native':
+        components = {name: int(value.nbytes) for name, value in vars(model).items() if isinstance(value, np.ndarray)}
+        return {"total_bytes": sum(components.values()), "components": components}
+    info = r_engine.model_memory(model)
+    sizes = info.rx2('components')
+    return {
+        "total_bytes": int(info.rx2('total')[0]),
+        "components": {str(name): int(size) for name, size in zip(sizes.names, sizes)},
     }
+
+def record_model_memory(models: Dict, engine: str, model_set: Optional[str] = None):
+    """各モデルの使用メモリをモデルセットの読み込み時間と同じdict（デフォルトはmodel_load_stats）に記録（/healthで確認）"""
+    load_stats = load_stats_for(model_set)
+    for key, model in models.items():
+        try:
+            load_stats.setdefault(key, {})["memory"] = model_memory(model, engine)
+        except Exception as e:
+            print(f"⚠️  警告: {key} の使用メモリを取得できません: {e}")
+
+def load_native_models(model_set: Optional[str] = None) -> Dict:
+    """export_rf_models.pyで書き出したネイティブモデル（.npz）を読み込む（省略時はデフォルトのセット）"""
+    global native_models
     
-    # 運動機能項目を追加
-    # 注意: 列名はRの学習データの列名と一致させる必要があります
-    # Rの学習データの列名を確認して、必要に応じて調整してください
-    motion_col_names = ['食事', '整容', '清拭', '更衣上半身', '更衣下半身',
-                        'トイレ動作', '排尿管理', '排便管理', 'ベッド移乗',
-                        'トイレ移乗', '浴槽移乗', '歩行']
-    for i, col_name in enumerate(motion_col_names):
-        data[col_name] = [motion_values[i]]
-    
-    # 認知機能項目を追加
-    # 注意: 列名はRの学習データの列名と一致させる必要があります
-    cognitive_col_names = ['理解', '表出', '社会的交流', '問題解決', '記憶']
-    for i, col_name in enumerate(cognitive_col_names):
-        data[col_name] = [cognitive_values[i]]
-    
-    df = pd.DataFrame(data)
-    return df
-
-def predict_with_r_model(model_key: str, input_df: pd.DataFrame) -> float:
+    models = load_forests(model_set_dir(model_set), MODEL_FILES)
+    print(f"読み込み完了: {len(models)}個のネイティブモデルが正常に読み込まれました")
+    if models and model_set is None:
+        native_models = models
+    return models
+
+def load_knn_models() -> Dict:
+    """学習データCSVからk近傍法のモデルを作成する（全てのキーで1つの近傍の探索を共有する）"""
+    return load_neighbor_models(MOTION_ITEMS, COGNITIVE_ITEMS)
+
+def model_files_version(engine: str = PREDICTION_ENGINE, model_set: Optional[str] = None) -> str:
+    """モデルファイルの名前・サイズ・更新日時から求めたバージョン（省略時はデフォルトのセット）
+    
+    ファイルが置き換えられるとバージョンが変わる（ディレクトリの監視にも使用）。
+    k近傍法の場合は学習データCSVから求める。
+    """
+    if engine == 'knn':
+        return data_version(KNN_DATA_PATH) if os.path.exists(KNN_DATA_PATH) else 'knn'
+    entries = []
+    for filename in sorted(MODEL_FILES.values()):
+        if engine == 'native':
+            filename = native_model_filename(filename)
+        path = os.path.join(model_set_dir(model_set), filename)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            entries.append((filename, stat.st_size, stat.st_mtime_ns))
+    return hashlib.sha1(repr(entries).encode('utf-8')).hexdigest()[:12]
+
+def model_schema(model, engine: str = PREDICTION_ENGINE) -> Dict[str, str]:
+    """モデルが予測に使う変数名と型（ネイティブモデル・近傍モデルの変数は全て数値）"""
+    if engine in ('native', 'knn'):
+        return {name: 'numeric' for name in model.feature_names}
+    info = r_engine.model_schema(model)
+    return dict(zip([str(name) for name in info.rx2('names')], [str(t) for t in info.rx2('types')]))
+
+def check_model_schemas(models: Dict, engine: str = PREDICTION_ENGINE) -> Dict[str, List[str]]:
+    """各モデルの変数名と型をエンコーダーの列と照合し、一致しない内容をモデルごとに返す
+    
+    読み込み時に1回だけ確認し、予測のたびにRの中で列の不一致のエラーが起きないようにする。
+    """
+    errors = {}
+    for key, model in models.items():
+        problems = []
+        try:
+            schema = model_schema(model, engine)
+            missing = [name for name in schema if name not in feature_encoder.index]
+            if missing:
+                problems.append(f"入力にない変数: {missing}")
+            not_numeric = [f"{name} ({t})" for name, t in schema.items() if t not in NUMERIC_TYPES]
+            if not_numeric:
+                problems.append(f"数値ではない変数: {not_numeric}")
+        except Exception as e:
+            problems.append(f"変数の情報を取得できません: {e}")
+        if problems:
+            errors[key] = problems
+            print(f"❌ エラー: {key} の変数が入力の列と一致しません: {'; '.join(problems)}")
+    return errors
+
+def load_engine_models(engine: str, raw_files: Optional[Dict[str, bytes]] = None,
+                       model_set: Optional[str] = None) -> Dict:
+    """予測エンジンのモデルを読み込む（省略時はデフォルトのモデルセット、k近傍法はセットによらず同じ）"""
+    if engine == 'knn':
+        print("k近傍法のモデルを作成中...")
+        return load_knn_models()
+    if engine == 'native':
+        print("ネイティブモデルを読み込み中...")
+        return load_native_models(model_set)
+    print("Rモデルを読み込み中...")
+    return load_r_models(raw_files, model_set)
+
+def load_models(raw_files: Optional[Dict[str, bytes]] = None,
+                extra_raw_files: Optional[Dict[str, Dict[str, bytes]]] = None,
+                load_extra_sets: bool = True) -> ModelSnapshot:
+    """設定された予測エンジンのモデルを読み込み、現在のモデルの組を差し替える
+    
+    raw_files: Rモデルの場合のread_model_files()の結果（省略時はここで読み込む）
+    extra_raw_files: デフォルト以外のモデルセットのread_model_files()の結果（セット名 -> 結果）
+    1つも読み込めなかった場合や、変数が入力の列と一致しないモデルがある場合は差し替えない
+    （それまでのモデルを使い続ける。起動時の場合は予測できる状態にならない）。
+    ただしKNN_FALLBACKの場合、1つも読み込めなければk近傍法のモデルに差し替える（劣化モード）。
+    MODEL_SETSを指定した場合は、デフォルト以外のモデルセットも読み込む（load_extra_sets=Falseの場合は読み込まない）。
+    """
+    global model_snapshot, model_schema_errors, warmup_stats
+    
+    engine = PREDICTION_ENGINE
+    version = model_files_version(engine)
+    models = load_engine_models(engine, raw_files)
+    
+    if not models and KNN_FALLBACK and engine != 'knn':
+        print("⚠️  警告: モデルが読み込めないため、k近傍法で予測します（劣化モード）")
+        engine = 'knn'
+        version = model_files_version(engine)
+        models = load_knn_models()
+    
+    model_schema_errors = check_model_schemas(models, engine)
+    if engine != 'knn':
+        record_model_memory(models, engine)
+    
+    if model_schema_errors:
+        print(f"❌ エラー: 変数が入力の列と一致しないモデルがあるため差し替えません: {list(model_schema_errors)}")
+    elif models and engine == model_snapshot.engine and len(models) < len(model_snapshot.models):
+        # 一部のファイルが読み込めなかった（書き込み途中など）場合は差し替えない
+        print(f"⚠️  警告: 読み込めたモデルが現在より少ないため差し替えません（{len(models)}/{len(model_snapshot.models)}個）")
+    elif models:
+        # 差し替える前にウォームアップし、差し替え直後のリクエストが初回の予測時間を待たないようにする
+        stats = warm_up_models(models, engine)
+        if stats:
+            warmup_stats = stats
+        model_snapshot = ModelSnapshot(version, models, engine)
+        # 古いモデルの予測結果を使わないようキャッシュを破棄
+        prediction_cache.clear()
+        print(f"モデルバージョン: {version}")
+    
+    # ワーカープールのワーカーはデフォルトのセットのみで予測するため、他のセットは読み込まない
+    if R_WORKERS == 0 and load_extra_sets:
+        for name in primary_model_sets()[1:]:
+            load_extra_model_set(name, (extra_raw_files or {}).get(name))
+    return model_snapshot
+
+def load_single_model_set(name: str):
+    """1つのモデルセットのみを読み込む（シャドウの予測を行うワーカープロセスで使用）"""
+    if name == default_model_set():
+        load_models(load_extra_sets=False)
+    else:
+        load_extra_model_set(name)
+
+def load_extra_model_set(name: str, raw_files: Optional[Dict[str, bytes]] = None):
+    """デフォルト以外のモデルセットを読み込み、そのセットのモデルの組を差し替える
+    
+    差し替えない条件はデフォルトのセットと同じ（k近傍法への切り替えは行わない）。
+    """
+    global model_set_snapshots
+    
+    engine = PREDICTION_ENGINE
+    print(f"モデルセット {name} を読み込み中...")
+    version = model_files_version(engine, name)
+    models = load_engine_models(engine, raw_files, name)
+    errors = check_model_schemas(models, engine)
+    model_set_schema_errors[name] = errors
+    if engine != 'knn':
+        record_model_memory(models, engine, name)
+    
+    current = model_set_snapshots.get(name)
+    if errors:
+        print(f"❌ エラー: モデルセット {name} に変数が入力の列と一致しないモデルがあるため差し替えません: {list(errors)}")
+    elif not models:
+        print(f"❌ エラー: モデルセット {name} のモデルが1つも読み込まれていません（{model_set_dir(name)}）")
+    elif current is not None and len(models) < len(current.models):
+        print(f"⚠️  警告: モデルセット {name} の読み込めたモデルが現在より少ないため差し替えません"
+              f"（{len(models)}/{len(current.models)}個）")
+    else:
+        warm_up_models(models, engine)
+        # 予測中のリクエストが参照しているdictは変更せず、新しいdictに差し替える
+        model_set_snapshots = {**model_set_snapshots, name: ModelSnapshot(version, models, engine)}
+        print(f"モデルセット {name} のモデルバージョン: {version}")
+
+def warmup_requests(n_rows: int) -> List[PredictionRequest]:
+    """ウォームアップの入力（学習データCSVの先頭の行、読み込めない場合は固定の値）"""
+    try:
+        requests = [PredictionRequest(**payload) for payload in csv_to_payloads(read_training_csv().head(n_rows))]
+        if requests:
+            return requests
+    except Exception as e:
+        print(f"⚠️  警告: 学習データを読み込めないため、固定の値でウォームアップします: {e}")
+    request = PredictionRequest(
+        gender='male', age=70, bmi=22, careLevel='no', daysFromOnset=30,
+        motionValues={item: 4 for item in MOTION_FEATURES},
+        cognitiveValues={item: 4 for item in COGNITIVE_FEATURES},
+    )
+    return [request] * n_rows
+
+def warm_up_models(models: Dict, engine: str = PREDICTION_ENGINE) -> Dict:
+    """全モデルでWARMUP_PASSES回予測し、モデルごとの初回（cold）と2回目以降（warm）の予測時間を返す"""
+    if WARMUP_ROWS <= 0 or not models:
+        return {}
+    started = time.perf_counter()
+    try:
+        X = encode_requests(warmup_requests(WARMUP_ROWS)).copy()
+        passes = []
+        for _ in range(max(WARMUP_PASSES, 1)):
+            # 合成した入力の予測は本番のメトリクス（予測行数・モデルごとの予測時間）に含めない
+            with record_observations(publish=False) as observations:
+                predict_all_models(X, models, engine)
+            passes.append({labels[0]: seconds for metric, labels, seconds in observations if metric is MODEL_DURATION})
+    except Exception as e:
+        print(f"⚠️  警告: ウォームアップに失敗しました: {e}")
+        return {}
+    
+    latencies = {}
+    for key in models:
+        warm = [timings[key] for timings in passes[1:] if key in timings]
+        latencies[key] = {
+            "cold_seconds": round(passes[0].get(key, math.nan), 6),
+            "warm_seconds": round(float(np.median(warm)), 6) if warm else None,
+        }
+    stats = {
+        "rows": len(X),
+        "passes": len(passes),
+        "seconds": round(time.perf_counter() - started, 3),
+        "models": latencies,
+    }
+    cold_total = sum(passes[0].values())
+    warm_total = float(np.median([sum(timings.values()) for timings in passes[1:]])) if len(passes) > 1 else None
+    print(f"ウォームアップ完了: {stats['seconds']}秒（全モデルの予測時間 初回 {cold_total:.4f}秒"
+          + (f", 2回目以降 {warm_total:.4f}秒）" if warm_total is not None else "）"))
+    return stats
+
+def current_load_stats() -> Dict:
+    """デフォルトのセットのモデルの読み込み時間（ワーカープール使用時は全ワーカーをまとめた値）"""
+    if worker_pool is not None:
+        return worker_pool.load_stats
+    return model_load_stats
+
+def current_warmup_stats() -> Dict:
+    """最後のウォームアップの結果（ワーカープール使用時はワーカー側の結果）"""
+    if worker_pool is not None:
+        return worker_pool.warmup
+    return warmup_stats
+
+def active_models() -> Dict:
+    """設定された予測エンジンで使用している現在のモデルを返す"""
+    return model_snapshot.models
+
+def current_engine() -> str:
+    """現在のモデルの予測エンジン（ワーカープール使用時はワーカー側のエンジン）"""
+    if worker_pool is not None:
+        return worker_pool.engine
+    return model_snapshot.engine
+
+def current_model_version() -> Optional[str]:
+    """現在のモデルのバージョン（ワーカープール使用時はワーカー側のバージョン）"""
+    if worker_pool is not None:
+        return worker_pool.model_version
+    return model_snapshot.version
+
+def loaded_model_sets() -> List[str]:
+    """予測に使用できるモデルセット（モデルセットを使わない場合・ワーカープール使用時は空）"""
+    if not MODEL_SETS or worker_pool is not None:
+        return []
+    names = [default_model_set()] if model_snapshot.models else []
+    return names + [name for name in primary_model_sets()[1:] if name in model_set_snapshots]
+
+def model_set_snapshot(model_set: Optional[str] = None) -> ModelSnapshot:
+    """モデルセットのモデルの組（省略時・デフォルトのセットは現在のモデルの組）"""
+    if model_set is None or model_set == default_model_set():
+        return model_snapshot
+    return model_set_snapshots[model_set]
+
+def model_set_version(model_set: Optional[str] = None) -> Optional[str]:
+    """モデルセットのモデルのバージョン（省略時は現在のモデルのバージョン）"""
+    if model_set is None:
+        return current_model_version()
+    return model_set_snapshot(model_set).version
+
+def route_request(requested: Optional[str] = None) -> Optional[str]:
+    """リクエストを予測するモデルセット（X-Model-Setヘッダーで指定したセット、省略時はMODEL_SET_WEIGHTSの重みで選ぶ）
+    
+    モデルセットを使わない場合はNone（現在のモデルの組で予測）。読み込まれていないセットを指定した場合はValueError。
+    """
+    available = loaded_model_sets()
+    if not available:
+        return None
+    if requested:
+        if requested not in available:
+            raise ValueError(f"モデルセット {requested} は読み込まれていません（使用できるセット: {available}）")
+        return requested
+    return choose_model_set(PRIMARY_WEIGHTS, available) or default_model_set()
+
+def schema_errors() -> Dict[str, List[str]]:
+    """最後に読み込んだモデルの組で、変数が入力の列と一致しなかったモデル"""
+    return model_schema_errors
+
+def available_model_keys() -> List[str]:
+    """予測に使用できるモデルのキー（ワーカープール使用時はワーカー側のモデル）"""
+    if worker_pool is not None:
+        return worker_pool.available_models
+    return list(active_models().keys())
+
+def encode_request(input_data: PredictionRequest) -> np.ndarray:
+    """入力データをモデルに渡す数値の行列に変換（1行）"""
+    return encode_requests([input_data])
+
+def encode_requests(requests: List[PredictionRequest]) -> np.ndarray:
+    """複数の入力データを1つの数値の行列に変換（1患者1行、列はFEATURE_COLUMNSの順）
+    
+    列の並びと値の取り出し方は起動時に作成したエンコーダーで決まっているため、
+    リクエストごとに列名のリストやデータフレームは作成しない。
+    """
+    return feature_encoder.encode(requests)
+
+def to_r_dataframe(X: np.ndarray):
+    """数値の行列をRのデータフレームに変換（1回のR呼び出しで作成）"""
+    return r_engine.make_frame(r_engine.ro.FloatVector(X.ravel(order='F')), X.shape[0], r_engine.feature_columns)
+
+def cache_key(input_data: PredictionRequest) -> tuple:
+    """予測キャッシュのキー（モデルが受け取る値が同じ入力は同じキーになる）
+    
+    性別・要介護度はモデルに渡す0/1の値、数値はfloatの値、FIM項目は項目名順に並べる。
+    """
+    return (
+        0 if input_data.gender == 'male' else 1,
+        float(input_data.age),
+        float(input_data.bmi),
+        1 if input_data.careLevel == 'yes' else 0,
+        float(input_data.daysFromOnset),
+        tuple(sorted((item, float(value)) for item, value in input_data.motionValues.items())),
+        tuple(sorted((item, float(value)) for item, value in input_data.cognitiveValues.items())),
+        output_spec(input_data),
+    )
+
+def output_spec(input_data: PredictionRequest) -> tuple:
+    """リクエストが求める予測値の組（OUTPUTSの順に並べた出力, 項目の合計で求めるか）"""
+    outputs = input_data.outputs or OUTPUTS
+    return tuple(output for output in OUTPUTS if output in outputs), input_data.sumTotals
+
+def required_models(outputs: tuple, sum_totals: bool, models: Dict) -> List[str]:
+    """出力に必要なモデルのキー（予測に失敗しない場合に使うモデルのみ）
+    
+    合計のモデルがない場合やsum_totalsの場合は、合計の代わりに項目のモデルを使う。
+    """
+    keys = []
+    
+    def add(*new_keys):
+        keys.extend(key for key in new_keys if key not in keys)
+    
+    def add_total(total_key):
+        if not sum_totals and total_key in models:
+            add(total_key)
+        elif total_key == 'total':
+            add_total('motion_total')
+            add_total('cognitive_total')
+        else:
+            add(*TOTAL_ITEMS[total_key])
+    
+    if 'motion_items' in outputs:
+        add(*MOTION_ITEMS)
+    if 'cognitive_items' in outputs:
+        add(*COGNITIVE_ITEMS)
+    for total_key in ('total', 'motion_total', 'cognitive_total'):
+        if total_key in outputs:
+            add_total(total_key)
+    return keys
+
+def predict_with_r_model(model_key: str, X: np.ndarray) -> float:
     """Rモデルを使用して予測を実行"""
+    return predict_with_r_model_batch(model_key, X)[0]
+
+def predict_with_r_model_batch(model_key: str, X: np.ndarray) -> List[float]:
+    """Rモデルを使用して全行の予測を1回で実行"""
     if model_key not in r_models:
         raise ValueError(f"モデル {model_key} が読み込まれていません")
     
     try:
-        # pandas DataFrameをRのデータフレームに変換
-        r_df = pandas2ri.py2rpy(input_df)
+        # 数値の行列をRのデータフレームに変換
+        r_df = to_r_dataframe(X)
         
-        # Rのpredict関数を呼び出す
-        prediction = caret.predict(r_models[model_key], r_df)
+        # Rのpredict関数を呼び出す（全行をまとめて予測）
+        prediction = r_engine.caret.predict(r_models[model_key], r_df)
         
-        # RのベクトルをPythonのfloatに変換
-        return float(prediction[0])
+        # RのベクトルをPythonのfloatのリストに変換
+        return [float(value) for value in prediction]
     except Exception as e:
         # エラーの詳細を出力（列名の不一致などを確認）
         print(f"予測エラー ({model_key}): {e}")
-        print(f"入力データフレームの列名: {list(input_df.columns)}")
+        print(f"入力データフレームの列名: {FEATURE_COLUMNS}")
         raise
 
-@app.on_event("startup")
-async def startup_event():
-    """アプリケーション起動時にRモデルを読み込む"""
-    print("Rモデルを読み込み中...")
-    load_r_models()
+def predict_all_models(X: np.ndarray, models: Dict, engine: str = PREDICTION_ENGINE) -> Dict[str, List[float]]:
+    """モデルの予測エンジンで全モデルを評価する（失敗したモデルの値はNaN）"""
+    if engine == 'knn':
+        return predict_all_knn_models(X, models)
+    if engine == 'native':
+        return predict_all_native_models(X, models)
+    return predict_all_r_models(X, models)
+
+def predict_all_r_models(X: np.ndarray, models: Optional[Dict] = None) -> Dict[str, List[float]]:
+    """全Rモデルを1回のR呼び出しで評価する（models省略時は読み込み済みのRモデル）
+    
+    入力の変換も1回だけ行う。予測に失敗したモデルの値はNaNになる。
+    """
+    if models is None:
+        models = r_models
+    model_keys = list(models.keys())
+    n_rows = len(X)
+    
+    # 数値の行列をRのデータフレームに変換（1回のみ）
+    with STAGE_DURATION.time(stage='convert'):
+        r_df = to_r_dataframe(X)
+    
+    # R側で全モデルの予測を実行し、1つの名前付き数値ベクトルとして受け取る
+    with STAGE_DURATION.time(stage='r_predict'):
+        r_model_list = r_engine.ro.ListVector([(key, models[key]) for key in model_keys])
+        result = r_engine.predict_all(r_model_list, r_df)
+        values = [float(value) for value in result[0]]
+    for key, seconds in zip(model_keys, result[1]):
+        MODEL_DURATION.observe(float(seconds), model=key)
+    PREDICTED_ROWS.inc(n_rows)
+    
+    return {
+        key: values[i * n_rows:(i + 1) * n_rows]
+        for i, key in enumerate(model_keys)
+    }
+
+def predict_all_native_models(X: np.ndarray, models: Optional[Dict] = None) -> Dict[str, List[float]]:
+    """全ネイティブモデルをNumPyで評価する（models省略時は読み込み済みのネイティブモデル）
+    
+    列はモデルの学習時の変数名の順に並べ替える。予測に失敗したモデルの値はNaNになる。
+    """
+    if models is None:
+        models = native_models
+    predictions = {}
+    with STAGE_DURATION.time(stage='native_predict'):
+        for key, forest in models.items():
+            started = time.perf_counter()
+            try:
+                columns = feature_encoder.column_indices(forest.feature_names)
+                predictions[key] = forest.predict(X[:, columns]).tolist()
+            except Exception as e:
+                print(f"予測エラー ({key}): {e}")
+                predictions[key] = [math.nan] * len(X)
+            MODEL_DURATION.observe(time.perf_counter() - started, model=key)
+    PREDICTED_ROWS.inc(len(X))
+    return predictions
+
+def predict_all_knn_models(X: np.ndarray, models: Dict) -> Dict[str, List[float]]:
+    """全ての近傍モデルを評価する（近傍の探索は全行・全モデルで1回のみ）"""
+    if not models:
+        return {}
+    started = time.perf_counter()
+    with STAGE_DURATION.time(stage='knn_predict'):
+        try:
+            index = next(iter(models.values())).index
+            values = index.predict(X, [model.key for model in models.values()])
+            predictions = {key: values[model.key].tolist() for key, model in models.items()}
+        except Exception as e:
+            print(f"予測エラー (knn): {e}")
+            predictions = {key: [math.nan] * len(X) for key in models}
+    # 近傍の探索は全モデル共通のため、モデルごとの時間は合計をモデル数で割った値とする
+    seconds = (time.perf_counter() - started) / len(models)
+    for key in models:
+        MODEL_DURATION.observe(seconds, model=key)
+    PREDICTED_ROWS.inc(len(X))
+    return predictions
+
+def count_fallbacks(predictions: Dict[str, List[float]], keys, n_rows: int):
+    """代替値（0または項目の合計）を使う件数をモデルごとに記録（keys: 予測に使おうとしたモデル）"""
+    for key in keys:
+        if key not in predictions:
+            MODEL_FALLBACKS.inc(n_rows, model=key, reason='not_loaded')
+        else:
+            failed = sum(1 for value in predictions[key] if math.isnan(value))
+            if failed:
+                MODEL_FALLBACKS.inc(failed, model=key, reason='error')
+
+def fill_missing(values: List[float], fallbacks: List[float]) -> List[float]:
+    """NaN（予測失敗）の値を代替値で置き換える"""
+    return [fallback if math.isnan(value) else value for value, fallback in zip(values, fallbacks)]
+
+def fallback_models(predictions: Dict[str, List[float]], keys, n_rows: int) -> List[List[str]]:
+    """行ごとに、代替値を使ったモデルのキーのリスト（count_fallbacksで数える行と同じ）"""
+    rows = [[] for _ in range(n_rows)]
+    for key in sorted(keys):
+        values = predictions.get(key)
+        for i in range(n_rows):
+            if values is None or math.isnan(values[i]):
+                rows[i].append(key)
+    return rows
+
+def predict_rows(X: np.ndarray, outputs: tuple = tuple(OUTPUTS),
+                 sum_totals: bool = False, snapshot: Optional[ModelSnapshot] = None,
+                 fallbacks: Optional[List[List[str]]] = None) -> List[PredictionResponse]:
+    """入力の行列の全行について予測し、行ごとのレスポンスを返す
+    
+    outputsに必要なモデルのみを、R側で1回の呼び出しにまとめて評価する。
+    合計のモデルが失敗した場合は、代替値（項目の合計）に必要な項目のモデルを追加で評価する。
+    予測の途中でモデルが再読み込みされても、開始時点のモデルの組で最後まで予測する。
+    snapshot: 予測に使うモデルの組（省略時は現在のモデルの組）
+    fallbacks: 指定した場合、行ごとに代替値を使ったモデルのキーを追加する（一括予測でエラーとして数えるため）
+    """
+    n_rows = len(X)
+    missing = [math.nan] * n_rows
+    if snapshot is None:
+        snapshot = model_snapshot
+    models = snapshot.models
+    
+    # 出力に必要なモデルの予測を実行
+    needed = required_models(outputs, sum_totals, models)
+    predictions = predict_all_models(X, {key: models[key] for key in needed if key in models}, snapshot.engine)
+    attempted = set(needed)
+    assemble_started = time.perf_counter()
+    
+    def model_values(key):
+        """モデルの予測値（まだ評価していないモデルはここで評価、モデルがない場合はNaN）"""
+        if key not in attempted:
+            attempted.add(key)
+            if key in models:
+                predictions.update(predict_all_models(X, {key: models[key]}, snapshot.engine))
+        return predictions.get(key, missing)
+    
+    item_predictions = {}
+    
+    def item_values(item):
+        """運動機能項目・認知機能項目（FIMスコアは0-7の範囲、モデルがない・失敗した場合は0）"""
+        if item not in item_predictions:
+            values = fill_missing(model_values(item), [0.0] * n_rows)
+            item_predictions[item] = [max(0.0, min(7.0, value)) for value in values]
+        return item_predictions[item]
+    
+    total_predictions = {}
+    
+    def total_values(total_key):
+        """合計値の予測（モデルがない・失敗した場合、sum_totalsの場合は項目の合計）"""
+        if total_key not in total_predictions:
+            values = missing if sum_totals else model_values(total_key)
+            if any(math.isnan(value) for value in values):
+                if total_key == 'total':
+                    parts = [total_values('motion_total'), total_values('cognitive_total')]
+                else:
+                    parts = [item_values(item) for item in TOTAL_ITEMS[total_key]]
+                values = fill_missing(values, [sum(row) for row in zip(*parts)])
+            total_predictions[total_key] = values
+        return total_predictions[total_key]
+    
+    motion_rows = cognitive_rows = None
+    if 'motion_items' in outputs:
+        motion_rows = [list(row) for row in zip(*[item_values(item) for item in MOTION_ITEMS])]
+    if 'cognitive_items' in outputs:
+        cognitive_rows = [list(row) for row in zip(*[item_values(item) for item in COGNITIVE_ITEMS])]
+    totals = {key: total_values(key) for key in ('total', 'motion_total', 'cognitive_total') if key in outputs}
+    count_fallbacks(predictions, attempted, n_rows)
+    if fallbacks is not None:
+        for row, keys in zip(fallbacks, fallback_models(predictions, attempted, n_rows)):
+            row.extend(keys)
+    
+    responses = []
+    for i in range(n_rows):
+        responses.append(PredictionResponse(
+            # 階段の値を追加（モデルがない場合は0）
+            motion=motion_rows[i] + [0.0] if motion_rows is not None else None,
+            cognitive=cognitive_rows[i] if cognitive_rows is not None else None,
+            motionTotal=float(totals['motion_total'][i]) if 'motion_total' in totals else None,
+            cognitiveTotal=float(totals['cognitive_total'][i]) if 'cognitive_total' in totals else None,
+            total=float(totals['total'][i]) if 'total' in totals else None,
+            modelVersion=snapshot.version
+        ))
+    STAGE_DURATION.observe(time.perf_counter() - assemble_started, stage='assemble')
+    return responses
+
+def build_error_detail(e: Exception) -> str:
+    """例外からクライアント向けの詳細なエラーメッセージを作成"""
+    error_detail = str(e)
+    if "モデル" in error_detail or "model" in error_detail.lower():
+        error_detail += "\nRモデルが正しく読み込まれているか確認してください。"
+    elif "列名" in error_detail or "column" in error_detail.lower():
+        error_detail += "\n入力データの列名がRモデルの期待する形式と一致しているか確認してください。"
+    elif "rpy2" in error_detail.lower():
+        error_detail += "\nrpy2が正しくインストールされ、Rが利用可能か確認してください。"
+    return error_detail
+
+async def run_predictions(requests: List[PredictionRequest], deadline: Optional[float] = None,
+                          model_set: Optional[str] = None) -> List[PredictionResponse]:
+    """予測を実行（キャッシュにない入力のみ予測する）
     
-    if len(r_models) == 0:
+    キャッシュのキーにはモデルのバージョンを含め、古いモデルや別のモデルセットの結果を返さないようにする。
+    deadline: この時刻（time.monotonic()）までに予測が始まらなければ実行しない
+    model_set: 予測に使うモデルセット（省略時は現在のモデルの組）
+    """
+    version = model_set_version(model_set)
+    keys = [cache_key(request) for request in requests]
+    results = [prediction_cache.get((version, key)) for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+    
+    if missing:
+        computed = await compute_predictions([requests[i] for i in missing], deadline, model_set)
+        for i, response in zip(missing, computed):
+            prediction_cache.put((response.modelVersion, keys[i]), response)
+            results[i] = response
+    return results
+
+async def run_batched_predictions(items: List[tuple]) -> List[PredictionResponse]:
+    """マイクロバッチ処理でまとめた（リクエスト, 期限, モデルセット）の組を予測
+    
+    モデルセットごとに、まとめたリクエストのうち最も遅い期限まで予測を実行する。
+    """
+    groups = {}
+    for i, (_, _, model_set) in enumerate(items):
+        groups.setdefault(model_set, []).append(i)
+    
+    results = [None] * len(items)
+    for model_set, indices in groups.items():
+        requests = [items[i][0] for i in indices]
+        responses = await run_predictions(requests, max(items[i][1] for i in indices), model_set)
+        for i, response in zip(indices, responses):
+            results[i] = response
+    return results
+
+async def compute_predictions(requests: List[PredictionRequest], deadline: Optional[float] = None,
+                              model_set: Optional[str] = None,
+                              fallbacks: Optional[List[List[str]]] = None) -> List[PredictionResponse]:
+    """予測を実行（ワーカープール使用時はワーカーに振り分け、それ以外は予測処理の専用スレッドで実行）
+    
+    どちらの場合もイベントループは止めない。待ちが上限に達している場合はQueueFullError、
+    期限までに完了しない場合はDeadlineExceededErrorを送出する。
+    model_set: 予測に使うモデルセット（ワーカープール使用時はNoneのみ）
+    fallbacks: predict_requests()と同じ（代替値を使ったモデルのキーをリクエストごとに設定する）
+    """
+    if worker_pool is not None:
+        # ワーカー内の段階ごと・モデルごとの時間はワーカーから返された値を記録する（ここではワーカーとの往復時間）
+        with STAGE_DURATION.time(stage='worker'):
+            results = await wait_until(
+                worker_pool.predict([request.model_dump() for request in requests], fallbacks), deadline
+            )
+        return [PredictionResponse(**result) for result in results]
+    
+    return await prediction_executor.run(predict_requests, requests, model_set, 'primary', fallbacks,
+                                         deadline=deadline)
+
+def predict_with_timing(requests: List[PredictionRequest], submitted: float,
+                        model_set: Optional[str] = None) -> tuple:
+    """予測を実行し、段階ごと・モデルごとの処理時間とあわせて返す（予測処理の専用スレッドで呼び出す）
+    
+    submitted: 専用スレッドに渡した時刻（time.perf_counter()、待ち時間の計算に使用）
+    """
+    queue_seconds = time.perf_counter() - submitted
+    with record_observations() as observations:
+        responses = predict_requests(requests, model_set)
+    return responses, {"queue": queue_seconds, **timing_entries(observations)}
+
+async def profiled_predict(request: PredictionRequest, started: float, deadline: Optional[float],
+                           model_set: Optional[str] = None) -> tuple:
+    """キャッシュ・マイクロバッチ処理を使わずに予測し、処理時間の内訳をServer-Timingヘッダーで返す
+    
+    started: リクエストを受け付けた時刻（受け付けからここまでをvalidationとする）
+    戻り値: (Server-Timingヘッダー付きのレスポンス, 予測結果)
+    """
+    timings = {"validation": time.perf_counter() - started}
+    if worker_pool is not None:
+        # 段階ごとの処理時間はワーカーのプロセスで記録されるため、ワーカーとの往復時間のみ
+        worker_started = time.perf_counter()
+        response = (await compute_predictions([request], deadline))[0]
+        timings["worker"] = time.perf_counter() - worker_started
+    else:
+        responses, stage_timings = await prediction_executor.run(
+            predict_with_timing, [request], time.perf_counter(), model_set, deadline=deadline
+        )
+        response = responses[0]
+        timings.update(stage_timings)
+    timings["total"] = time.perf_counter() - started
+    headers = {"Server-Timing": server_timing_header(timings)}
+    if model_set is not None:
+        headers[MODEL_SET_HEADER] = model_set
+    return JSONResponse(content=response.model_dump(), headers=headers), response
+
+def predict_requests(requests: List[PredictionRequest], model_set: Optional[str] = None,
+                     role: str = 'primary',
+                     fallbacks: Optional[List[List[str]]] = None) -> List[PredictionResponse]:
+    """このプロセスで予測を実行（予測処理の専用スレッドで呼び出す）
+    
+    求める予測値（outputs, sumTotals）が同じリクエストごとにまとめて予測する。
+    model_set: 予測に使うモデルセット（省略時は現在のモデルの組）
+    role: モデルセットの予測時間を記録する役割（primary: レスポンスに使う予測, shadow: 比較のみの予測）
+    fallbacks: リクエストと同じ長さのリストを指定した場合、リクエストごとに代替値を使ったモデルのキーのリストを設定する
+    """
+    snapshot = model_set_snapshot(model_set)
+    started = time.perf_counter()
+    groups = {}
+    for i, request in enumerate(requests):
+        groups.setdefault(output_spec(request), []).append(i)
+    
+    results = [None] * len(requests)
+    for (outputs, sum_totals), indices in groups.items():
+        # 入力データをモデルに渡す数値の行列に変換
+        with STAGE_DURATION.time(stage='prepare'):
+            X = encode_requests([requests[i] for i in indices])
+        group_fallbacks = [[] for _ in indices]
+        for i, response in zip(indices, predict_rows(X, outputs, sum_totals, snapshot, group_fallbacks)):
+            results[i] = response
+        if fallbacks is not None:
+            for i, keys in zip(indices, group_fallbacks):
+                fallbacks[i] = keys
+    
+    if model_set is not None:
+        seconds = time.perf_counter() - started
+        MODEL_SET_DURATION.observe(seconds, model_set=model_set, role=role)
+        model_set_stats.observe_latency(model_set, role, seconds, len(requests))
+    return results
+
+def prediction_idle() -> bool:
+    """プライマリの予測の待ちがないか（マイクロバッチ処理でまとめている途中のリクエストも含む）"""
+    return prediction_executor.queued == 0 and (micro_batcher is None or micro_batcher.queue.empty())
+
+def submit_shadow(requests: List[PredictionRequest], model_set: Optional[str],
+                  responses: List[PredictionResponse]):
+    """シャドウのセットで同じ入力を予測するよう登録する（予測は待たない）
+    
+    レスポンスを返した後（バックグラウンドタスク）に呼び出す。プライマリがシャドウのセットの場合は比較しない。
+    """
+    if shadow_evaluator is None or model_set is None or model_set == SHADOW_MODEL_SET:
+        return
+    if PREDICTION_ENGINE == 'r':
+        if shadow_pool is None or not shadow_pool.available_models:
+            # シャドウの予測用のワーカーが起動中（または起動できなかった）
+            return
+    elif SHADOW_MODEL_SET not in loaded_model_sets():
+        return
+    for request, response in zip(requests, responses):
+        if not shadow_evaluator.submit((request, model_set, response)):
+            SHADOW_DROPPED.inc(model_set=SHADOW_MODEL_SET)
+
+async def evaluate_shadow(items: List[tuple]):
+    """シャドウのセットで予測し、プライマリのレスポンスとの差を記録する
+    
+    items: (リクエスト, プライマリのモデルセット, プライマリのレスポンス) のリスト
+    シャドウの予測はキャッシュを使わず、結果もキャッシュしない。
+    """
+    requests = [request for request, _, _ in items]
+    if shadow_pool is not None:
+        started = time.perf_counter()
+        results = await shadow_pool.predict([request.model_dump() for request in requests])
+        model_set_stats.observe_latency(SHADOW_MODEL_SET, 'shadow', time.perf_counter() - started, len(requests))
+        responses = [PredictionResponse(**result) for result in results]
+    else:
+        responses = await shadow_executor.run(predict_requests, requests, SHADOW_MODEL_SET, 'shadow', admit=False)
+    for (_, primary, primary_response), response in zip(items, responses):
+        differences = prediction_differences(
+            primary_response.model_dump(), response.model_dump(), MOTION_ITEMS, COGNITIVE_ITEMS
+        )
+        model_set_stats.observe_differences(SHADOW_MODEL_SET, primary, differences)
+        for name, difference in differences.items():
+            SHADOW_DIFFERENCE.observe(abs(difference), shadow=SHADOW_MODEL_SET, primary=primary, output=name)
+
+async def start_shadow_pool():
+    """Rモデルのシャドウの予測を行うワーカープロセスを起動し、現在のワーカーと差し替える
+
+    ワーカーはシャドウのセットのみを読み込んだ別のRで予測するため、シャドウの予測中もプライマリの予測は待たない。
+    """
+    global shadow_pool
+    
+    print(f"シャドウの予測用のワーカーを起動中（モデルセット {SHADOW_MODEL_SET}）...")
+    new_pool = RWorkerPool(1, model_set=SHADOW_MODEL_SET, role='shadow')
+    await new_pool.start()
+    if len(new_pool.available_models) == 0:
+        print("⚠️  警告: シャドウの予測用のワーカーでモデルを読み込めないため、シャドウの予測を行いません")
+        new_pool.shutdown()
+        return
+    old_pool, shadow_pool = shadow_pool, new_pool
+    if old_pool is not None:
+        asyncio.get_running_loop().run_in_executor(None, old_pool.shutdown, False)
+
+async def load_model_set():
+    """モデルの組を読み込み、現在のモデルと差し替える
+    
+    ワーカープール使用時は新しいモデルを読み込んだプールを起動してから差し替え、
+    古いプールは処理中の予測が終わってから終了する。
+    """
+    global worker_pool, model_schema_errors
+    
+    loop = asyncio.get_running_loop()
+    if R_WORKERS > 0:
+        # モデルは各ワーカープロセスで読み込む（変数の照合もワーカー側で行う）
+        print(f"Rワーカープールを起動中（{R_WORKERS}プロセス）...")
+        new_pool = RWorkerPool(R_WORKERS)
+        await new_pool.start()
+        model_schema_errors = new_pool.schema_errors
+        if len(new_pool.available_models) == 0:
+            # 読み込みに失敗したワーカーがある（そのワーカーが代替値を返さないよう、プール全体を使わない）
+            print("⚠️  警告: 全てのワーカーでモデルを読み込めなかったため、新しいワーカープールに差し替えません")
+            new_pool.shutdown()
+            return
+        if worker_pool is not None and len(new_pool.available_models) < len(worker_pool.available_models):
+            print("⚠️  警告: 新しいワーカーで読み込めたモデルが現在より少ないため差し替えません")
+            new_pool.shutdown()
+            return
+        old_pool, worker_pool = worker_pool, new_pool
+        prediction_cache.clear()
+        if old_pool is not None:
+            loop.run_in_executor(None, old_pool.shutdown, False)
+    elif PREDICTION_ENGINE in ('native', 'knn'):
+        # 予測処理の専用スレッドとは別のスレッドで読み込み・ウォームアップし、最後にモデルの組を差し替える
+        # （読み込み中も予測処理の専用スレッドは現在のモデルで予測を続ける）
+        await loop.run_in_executor(None, load_models)
+    else:
+        # ファイルの読み込み・展開は別スレッドで並列に行い、Rオブジェクトへの復元は予測処理の専用スレッドで行う
+        # （埋め込みRは1つのスレッドからしか呼び出せないため、読み込み中は予測が待たされる。
+        #   予測を受け付けている間の読み込み直しは in_process_r_reload() で断る）
+        raw_files = await loop.run_in_executor(None, read_model_files)
+        extra_raw_files = {}
+        for name in primary_model_sets()[1:]:
+            extra_raw_files[name] = await loop.run_in_executor(None, read_model_files, name)
+        await prediction_executor.run(load_models, raw_files, extra_raw_files, admit=False)
+        start_shadow_pool_in_background()
+
+async def load_models_in_background():
+    """モデルを読み込み、完了したら予測できる状態にする
+    
+    読み込み中もプロセスは起動しており、/healthには応答する（/readyは503を返す）。
+    """
+    global model_load_seconds
+    
+    started = time.perf_counter()
+    try:
+        async with reload_lock:
+            await load_model_set()
+    except Exception as e:
+        print(f"❌ エラー: モデルの読み込みに失敗しました: {e}")
+        import traceback
+        print(traceback.format_exc())
+    
+    model_load_seconds = round(time.perf_counter() - started, 3)
+    print(f"モデルの読み込み時間: {model_load_seconds}秒")
+    update_readiness()
+
+def preload_models():
+    """イベントループを起動する前にモデルを読み込み、予測できる状態にする
+    
+    pre-fork方式（prefork_server.py）の親プロセスで呼び出し、読み込んだモデルをforkしたワーカーで共有する。
+    ワーカーの起動時（startup）には読み込み済みのモデルをそのまま使う。
+    """
+    global model_load_seconds
+    
+    started = time.perf_counter()
+    load_models()
+    model_load_seconds = round(time.perf_counter() - started, 3)
+    print(f"モデルの読み込み時間: {model_load_seconds}秒")
+    update_readiness()
+
+def update_readiness():
+    """読み込んだモデルを確認し、問題がなければ予測できる状態にする"""
+    global models_ready
+    
+    if schema_errors():
+        print("❌ エラー: モデルの変数が入力の列と一致しないため、予測を受け付けません。")
+    elif len(available_model_keys()) == 0:
         print("警告: Rモデルが読み込まれていません。")
         print(f"モデルディレクトリ: {MODELS_DIR}")
         print("先にRスクリプトでモデルを学習・保存してください。")
+    else:
+        models_ready = True
+
+def in_process_r_reload() -> bool:
+    """読み込み直すと予測が止まる構成か（埋め込みRを予測処理の専用スレッドで使う場合）
+    
+    Rモデルの復元・ウォームアップは予測と同じスレッドで行う必要があるため、読み込み中の予測は待ち行列で待ち、
+    429（待ち行列が満杯）や504（期限切れ）になる。この構成では読み込み直しを行わず、
+    R_WORKERS（新しいワーカープールを起動してから差し替え）かpre-fork方式（親プロセスにSIGHUP）を使う。
+    """
+    return PREDICTION_ENGINE == 'r' and R_WORKERS == 0
+
+async def reload_models():
+    """モデルをバックグラウンドで読み込み直し、完了したら差し替える
+    
+    読み込み中も現在のモデルで予測を続ける（in_process_r_reload()の構成では読み込み直さない）。
+    """
+    global models_ready
+    
+    if in_process_r_reload():
+        print("⚠️  警告: R_WORKERS=0 のRモデルは予測を止めずに読み込み直せないため、読み込み直しません"
+              "（R_WORKERSかpre-fork方式を使ってください）")
+        return
+    async with reload_lock:
+        previous_version = current_model_version()
+        started = time.perf_counter()
+        await load_model_set()
+        print(f"モデルの再読み込み完了: {previous_version} -> {current_model_version()} "
+              f"({time.perf_counter() - started:.2f}秒)")
+        if len(available_model_keys()) > 0:
+            models_ready = True
+
+def watched_files_version() -> str:
+    """監視するモデルファイルのバージョン（モデルセットを使う場合は全てのセットのバージョンをつなげたもの）"""
+    if not MODEL_SETS or R_WORKERS > 0:
+        return model_files_version()
+    return ','.join(model_files_version(model_set=name) for name in primary_model_sets())
+
+def loaded_files_version() -> Optional[str]:
+    """読み込み済みのモデルのバージョン（watched_files_version()と同じ形式、読み込めていないセットは空）"""
+    if not MODEL_SETS or R_WORKERS > 0:
+        return current_model_version()
+    return ','.join(model_set_snapshot(name).version or '' if name in loaded_model_sets() else ''
+                    for name in primary_model_sets())
+
+async def watch_model_files():
+    """モデルディレクトリを定期的に確認し、ファイルが置き換えられたら読み込み直す
+    
+    書き込み途中のファイルを読み込まないよう、同じ変更を2回続けて検出してから読み込む。
+    """
+    pending_version = None
+    while True:
+        await asyncio.sleep(MODEL_WATCH_INTERVAL)
+        try:
+            version = watched_files_version()
+            if not models_ready or version == loaded_files_version():
+                pending_version = None
+            elif version != pending_version:
+                pending_version = version
+            else:
+                print(f"モデルファイルの変更を検出しました: {version}")
+                pending_version = None
+                await reload_models()
+        except Exception as e:
+            print(f"❌ 警告: モデルディレクトリの監視中にエラー: {e}")
+
+async def monitor_event_loop():
+    """一定間隔でsleepし、予定より遅れて再開した時間をイベントループの遅延として記録
+    
+    同期的な予測処理などでイベントループが止まっていると遅延が大きくなる。
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(EVENT_LOOP_MONITOR_INTERVAL)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - started - EVENT_LOOP_MONITOR_INTERVAL))
+
+def check_admin_token(token: Optional[str]):
+    """管理用エンドポイントのトークンを確認"""
+    if ADMIN_TOKEN and token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="管理用トークンが正しくありません")
+
+@app.on_event("startup")
+async def startup_event():
+    """アプリケーション起動時にモデルの読み込みを開始する"""
+    global micro_batcher, model_loading_task, reload_lock, model_watch_task, event_loop_monitor_task
+    global shadow_evaluator, shadow_executor
+    
+    reload_lock = asyncio.Lock()
+    event_loop_monitor_task = asyncio.create_task(monitor_event_loop())
+    
+    if BATCH_WINDOW_MS > 0:
+        micro_batcher = MicroBatcher(run_batched_predictions, BATCH_WINDOW_MS, BATCH_MAX_SIZE)
+        micro_batcher.start()
+        print(f"マイクロバッチ処理: 待ち時間 {BATCH_WINDOW_MS}ms, 最大 {BATCH_MAX_SIZE}件")
+    
+    if MODEL_SETS and R_WORKERS > 0:
+        print("⚠️  警告: ワーカープール使用時はモデルセットの振り分け・シャドウの予測は行いません（デフォルトのセットのみ）")
+    elif MODEL_SETS:
+        print(f"モデルセット: {MODEL_SETS}（振り分けの重み: {PRIMARY_WEIGHTS}, シャドウ: {SHADOW_MODEL_SET}）")
+        if SHADOW_MODEL_SET is not None:
+            # Rは1つのスレッドからのみ呼び出せるため、Rモデルの場合はシャドウ専用のワーカープロセス
+            # （モデルの読み込み後に起動）、ネイティブモデル・近傍モデルの場合はシャドウ専用のスレッドで予測する
+            if PREDICTION_ENGINE != 'r':
+                shadow_executor = PredictionExecutor()
+            shadow_evaluator = ShadowEvaluator(evaluate_shadow, prediction_idle)
+            shadow_evaluator.start()
+    
+    if models_ready:
+        # pre-fork方式の親プロセスで読み込んだモデルをそのまま使う
+        print(f"読み込み済みのモデルを使用します（PID {os.getpid()}, モデルバージョン: {current_model_version()}）")
+        start_shadow_pool_in_background()
+    else:
+        if PREDICTION_ENGINE == 'r' and R_WORKERS == 0:
+            # 埋め込みRはメインスレッドで起動する（モデルの読み込み・予測は予測処理の専用スレッドで行う）
+            init_r_engine()
+        # 読み込みの完了を待たずにリクエストの受け付けを開始する
+        model_loading_task = asyncio.create_task(load_models_in_background())
+    
+    if MODEL_WATCH_INTERVAL > 0 and in_process_r_reload():
+        print("⚠️  警告: R_WORKERS=0 のRモデルは予測を止めずに読み込み直せないため、モデルディレクトリを監視しません"
+              "（R_WORKERSかpre-fork方式を使ってください）")
+    elif MODEL_WATCH_INTERVAL > 0:
+        model_watch_task = asyncio.create_task(watch_model_files())
+        print(f"モデルディレクトリを監視します（{MODEL_WATCH_INTERVAL}秒ごと）")
+
+def start_shadow_pool_in_background():
+    """Rモデルでシャドウの予測を行う場合、シャドウの予測用のワーカーの起動を開始する（起動を待たない）"""
+    global shadow_pool_task
+    
+    if shadow_evaluator is not None and PREDICTION_ENGINE == 'r':
+        shadow_pool_task = asyncio.create_task(start_shadow_pool())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """アプリケーション終了時にバックグラウンド処理とワーカープロセスを終了する"""
+    if model_watch_task is not None:
+        model_watch_task.cancel()
+    if event_loop_monitor_task is not None:
+        event_loop_monitor_task.cancel()
+    if micro_batcher is not None:
+        await micro_batcher.stop()
+    if shadow_evaluator is not None:
+        await shadow_evaluator.stop()
+    if shadow_pool_task is not None:
+        shadow_pool_task.cancel()
+    if worker_pool is not None:
+        worker_pool.shutdown()
+    if shadow_pool is not None:
+        shadow_pool.shutdown()
+    if shadow_executor is not None:
+        shadow_executor.shutdown()
+    prediction_executor.shutdown()
+
+def model_memory_bytes(load_stats: Dict) -> int:
+    """読み込み時に記録したモデルの使用メモリの合計"""
+    return sum(stats.get("memory", {}).get("total_bytes", 0) for stats in load_stats.values())
+
+def current_model_memory() -> Dict:
+    """デフォルトのセットのモデルの使用メモリ（ワーカープール使用時は全ワーカーの合計とワーカーごとの値）"""
+    if worker_pool is not None:
+        return {
+            "model_memory_bytes": sum(worker_pool.model_memory.values()),
+            "worker_model_memory_bytes": worker_pool.model_memory,
+        }
+    return {"model_memory_bytes": model_memory_bytes(model_load_stats)}
+
+def model_sets_summary() -> Optional[Dict]:
+    """モデルセットごとのバージョン・使用メモリ・予測時間と、シャドウとプライマリの予測値の差
+    
+    モデルセットを使わない場合・ワーカープール使用時はNone。
+    """
+    if not MODEL_SETS or R_WORKERS > 0:
+        return None
+    loaded = loaded_model_sets()
+    sets = {}
+    for name in MODEL_SETS:
+        if name == SHADOW_MODEL_SET and shadow_set_in_pool_only():
+            # シャドウの予測用のワーカーに読み込んだモデル
+            pool = shadow_pool
+            sets[name] = {
+                "model_version": pool.model_version if pool else None,
+                "models_loaded": len(pool.available_models) if pool else 0,
+                "weight": PRIMARY_WEIGHTS.get(name, 0.0),
+                "memory_bytes": sum(pool.model_memory.values()) if pool else 0,
+                "schema_errors": pool.schema_errors if pool else {},
+                "latency": model_set_stats.latency_summary(name),
+            }
+            continue
+        snapshot = model_set_snapshot(name) if name in loaded else None
+        sets[name] = {
+            "model_version": snapshot.version if snapshot else None,
+            "models_loaded": len(snapshot.models) if snapshot else 0,
+            "weight": PRIMARY_WEIGHTS.get(name, 0.0),
+            "memory_bytes": model_memory_bytes(load_stats_for(name)),
+            "schema_errors": model_schema_errors if name == default_model_set() else model_set_schema_errors.get(name, {}),
+            "latency": model_set_stats.latency_summary(name),
+        }
+    return {
+        "default": default_model_set(),
+        "shadow": SHADOW_MODEL_SET,
+        "sets": sets,
+        "shadow_queue": shadow_evaluator.stats() if shadow_evaluator is not None else None,
+        "differences": model_set_stats.difference_summary(),
+    }
 
 @app.get("/health")
 async def health_check():
-    """ヘルスチェックエンドポイント"""
+    """ヘルスチェックエンドポイント（プロセスが起動していれば200を返す）"""
     return {
         "status": "ok",
-        "models_loaded": len(r_models),
-        "available_models": list(r_models.keys())
+        "ready": models_ready,
+        "engine": current_engine(),
+        "degraded": current_engine() == 'knn' and PREDICTION_ENGINE != 'knn',
+        "model_version": current_model_version(),
+        "workers": R_WORKERS,
+        "models_loaded": len(available_model_keys()),
+        "available_models": available_model_keys(),
+        "model_load_seconds": model_load_seconds,
+        "r_init_seconds": r_engine_init_seconds,
+        "model_load": current_load_stats(),
+        "warmup": current_warmup_stats(),
+        **current_model_memory(),
+        "model_sets": model_sets_summary(),
+        "schema_errors": schema_errors(),
+        "queue": prediction_executor.stats() if worker_pool is None else {
+            "queued": worker_pool.queued, "max_queue": worker_pool.max_queue
+        },
+        "cache": prediction_cache.stats(),
+        "pid": os.getpid(),
+        "memory": process_memory()
     }
 
+@app.get("/ready")
+async def readiness_check():
+    """レディネスチェックエンドポイント（全モデルの読み込みが完了するまで503を返す）"""
+    if not models_ready:
+        errors = schema_errors()
+        return JSONResponse(
+            status_code=503,
+            content={
+                "status": "schema_mismatch" if errors else "loading",
+                "models_loaded": len(available_model_keys()),
+                "schema_errors": errors,
+            }
+        )
+    return {
+        "status": "ready",
+        "model_version": current_model_version(),
+        "models_loaded": len(available_model_keys())
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """メトリクスエンドポイント（Prometheusのテキスト形式）"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.post("/admin/reload")
+async def admin_reload(x_admin_token: Optional[str] = Header(None)):
+    """モデルを読み込み直す管理用エンドポイント
+    
+    新しいモデルの読み込みが完了してから差し替えるため、読み込み中も予測は止まらない。
+    pre-fork方式では親プロセスにSIGHUPを送り、親で読み込み直して全てのワーカーを入れ替える
+    （このワーカーのみ読み込み直すと、ワーカーごとにモデルのバージョンが異なり共有もできなくなるため）。
+    R_WORKERS=0 のRモデルは予測を止めずに読み込み直せないため、409を返す。
+    """
+    check_admin_token(x_admin_token)
+    if prefork_parent_pid is not None:
+        os.kill(prefork_parent_pid, signal.SIGHUP)
+        return JSONResponse(status_code=202, content={
+            "status": "reload_requested",
+            "parent_pid": prefork_parent_pid,
+            "model_version": current_model_version(),
+        })
+    if in_process_r_reload():
+        raise HTTPException(
+            status_code=409,
+            detail="R_WORKERS=0 のRモデルは予測を止めずに読み込み直せません。"
+                   "R_WORKERSを設定するか、pre-fork方式（prefork_server.py）で起動して親プロセスにSIGHUPを送ってください。"
+        )
+    previous_version = current_model_version()
+    await reload_models()
+    return {
+        "status": "reloaded",
+        "previous_version": previous_version,
+        "model_version": current_model_version(),
+        "models_loaded": len(available_model_keys()),
+        "schema_errors": schema_errors()
+    }
+
+@app.post("/admin/profiling")
+async def admin_profiling(enabled: bool = Query(...), x_admin_token: Optional[str] = Header(None)):
+    """全ての/predictでServer-Timingヘッダーを返すかを切り替える管理用エンドポイント（このプロセスのみ）"""
+    global profiling_enabled
+    
+    check_admin_token(x_admin_token)
+    profiling_enabled = enabled
+    print(f"Server-Timingヘッダー: {'有効' if enabled else '無効'}（PID {os.getpid()}）")
+    return {"profiling": profiling_enabled}
+
+@app.post("/admin/profile")
+async def admin_profile(seconds: float = Query(10.0, gt=0, le=PROFILE_MAX_SECONDS),
+                        x_admin_token: Optional[str] = Header(None)):
+    """seconds秒間の予測処理をプロファイリングし、結果をzipで返す管理用エンドポイント
+    
+    python.prof / python.txt: 予測処理の専用スレッドのcProfileの結果（pstats形式と累積時間順のテキスト）
+    r_profile.out / r_summary.txt: Rprofの結果とsummaryRprofの出力（Rモデルを使用している場合のみ）
+    """
+    global profile_session_active
+    
+    check_admin_token(x_admin_token)
+    if worker_pool is not None:
+        raise HTTPException(status_code=400, detail="ワーカープール使用時は予測がワーカーのプロセスで行われるため、プロファイリングできません")
+    if profile_session_active:
+        raise HTTPException(status_code=409, detail="別のプロファイリングを実行中です")
+    
+    profile_session_active = True
+    profiler = cProfile.Profile()
+    use_r = current_engine() == 'r'
+    with tempfile.TemporaryDirectory() as directory:
+        r_path = os.path.join(directory, 'r_profile.out')
+        try:
+            # cProfileは呼び出したスレッドのみ記録するため、予測処理の専用スレッドで開始・終了する
+            await prediction_executor.run(profiler.enable, admit=False)
+            if use_r:
+                await prediction_executor.run(r_engine.start_profiling, r_path, RPROF_INTERVAL, admit=False)
+            print(f"プロファイリングを開始しました（{seconds}秒）")
+            await asyncio.sleep(seconds)
+        finally:
+            r_summary = None
+            if use_r:
+                r_summary = await prediction_executor.run(r_engine.stop_profiling, r_path, admit=False)
+            await prediction_executor.run(profiler.disable, admit=False)
+            profile_session_active = False
+        
+        files = python_profile_files(profiler)
+        if use_r:
+            with open(r_path, 'rb') as f:
+                files['r_profile.out'] = f.read()
+            files['r_summary.txt'] = str(r_summary[0]).encode('utf-8')
+    
+    filename = f"profile_{time.strftime('%Y%m%d_%H%M%S')}.zip"
+    return Response(
+        content=make_zip(files),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+def overload_error(e: Exception) -> HTTPException:
+    """待ち行列の上限・期限切れをHTTPエラーに変換（429: 混雑中, 504: 期限切れ）"""
+    if isinstance(e, QueueFullError):
+        REQUESTS_REJECTED.inc(reason='queue_full')
+        return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    REQUESTS_REJECTED.inc(reason='deadline')
+    return HTTPException(status_code=504, detail=str(e))
+
 @app.post("/predict", response_model=PredictionResponse)
-async def predict(request: PredictionRequest):
-    """予測APIエンドポイント"""
+async def predict(request: PredictionRequest, http_request: Request, response: Response,
+                  background_tasks: BackgroundTasks,
+                  x_request_timeout: Optional[float] = Header(None),
+                  x_profile: Optional[str] = Header(None),
+                  x_model_set: Optional[str] = Header(None)):
+    """予測APIエンドポイント
+    
+    X-Request-Timeoutヘッダー（秒）で期限を指定できる（省略時はREQUEST_TIMEOUT）。
+    X-Profile: 1 の場合（または/admin/profilingで有効にした場合）は、処理時間の内訳をServer-Timingヘッダーで返す。
+    MODEL_SETSを指定した場合はX-Model-Setヘッダーでモデルセットを指定できる（省略時は重みで選ぶ）。
+    予測したセットはレスポンスのX-Model-Setヘッダーで返し、シャドウの予測はレスポンスを返した後に行う。
+    """
+    deadline = deadline_after(x_request_timeout)
     try:
-        if len(r_models) == 0:
+        if not models_ready:
             raise HTTPException(
                 status_code=503,
                 detail="Rモデルが読み込まれていません。モデルを学習・保存してください。"
             )
+        try:
+            model_set = route_request(x_model_set)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
-        # 入力データをRのデータフレーム形式に変換
-        input_df = prepare_r_dataframe(request)
+        if profiling_enabled or x_profile == '1':
+            profiled, result = await profiled_predict(request, http_request.state.started, deadline, model_set)
+            background_tasks.add_task(submit_shadow, [request], model_set, [result])
+            return profiled
         
-        # 予測を実行
-        predictions = {}
-        
-        # 運動機能項目の予測（12項目）
-        motion_items = ['eat', 'groom', 'bath', 'dress_up', 'dress_low', 
-                       'toile', 'bladder', 'bowel', 'trans_bed', 
-                       'trans_toile', 'trans_bath', 'gait']
-        motion_predictions = []
-        for item in motion_items:
-            if item in r_models:
-                try:
-                    pred = predict_with_r_model(item, input_df)
-                    motion_predictions.append(max(0.0, min(7.0, pred)))  # FIMスコアは0-7の範囲
-                except Exception as e:
-                    print(f"予測エラー ({item}): {e}")
-                    motion_predictions.append(0.0)
-            else:
-                motion_predictions.append(0.0)
-        
-        # 認知機能項目の予測（5項目）
-        cognitive_items = ['comp', 'express', 'social', 'problem', 'memory']
-        cognitive_predictions = []
-        for item in cognitive_items:
-            if item in r_models:
-                try:
-                    pred = predict_with_r_model(item, input_df)
-                    cognitive_predictions.append(max(0.0, min(7.0, pred)))  # FIMスコアは0-7の範囲
-                except Exception as e:
-                    print(f"予測エラー ({item}): {e}")
-                    cognitive_predictions.append(0.0)
-            else:
-                cognitive_predictions.append(0.0)
-        
-        # 合計値の予測
-        motion_total = 0.0
-        cognitive_total = 0.0
-        total = 0.0
-        
-        if 'motion_total' in r_models:
-            try:
-                motion_total = predict_with_r_model('motion_total', input_df)
-            except Exception as e:
-                motion_total = sum(motion_predictions)
+        # 予測を実行（同時に届いたリクエストとまとめて1回で予測）
+        if micro_batcher is not None:
+            result = await wait_until(micro_batcher.submit((request, deadline, model_set)), deadline)
         else:
-            motion_total = sum(motion_predictions)
-        
-        if 'cognitive_total' in r_models:
-            try:
-                cognitive_total = predict_with_r_model('cognitive_total', input_df)
-            except Exception as e:
-                cognitive_total = sum(cognitive_predictions)
-        else:
-            cognitive_total = sum(cognitive_predictions)
-        
-        if 'total' in r_models:
-            try:
-                total = predict_with_r_model('total', input_df)
-            except Exception as e:
-                total = motion_total + cognitive_total
-        else:
-            total = motion_total + cognitive_total
-        
-        # 階段の値を追加（モデルがない場合は0）
-        motion_predictions.append(0.0)
-        
-        return PredictionResponse(
-            motion=motion_predictions,
-            cognitive=cognitive_predictions,
-            motionTotal=float(motion_total),
-            cognitiveTotal=float(cognitive_total),
-            total=float(total)
-        )
+            result = (await run_predictions([request], deadline, model_set))[0]
+        if model_set is not None:
+            response.headers[MODEL_SET_HEADER] = model_set
+            background_tasks.add_task(submit_shadow, [request], model_set, [result])
+        return result
         
     except HTTPException:
         # HTTPExceptionはそのまま再発生
         raise
+    except (QueueFullError, DeadlineExceededError) as e:
+        raise overload_error(e)
     except Exception as e:
         print(f"予測エラー: {e}")
         import traceback
         error_trace = traceback.format_exc()
         print(error_trace)
         # より詳細なエラーメッセージを返す
-        error_detail = str(e)
-        if "モデル" in error_detail or "model" in error_detail.lower():
-            error_detail += "\nRモデルが正しく読み込まれているか確認してください。"
-        elif "列名" in error_detail or "column" in error_detail.lower():
-            error_detail += "\n入力データの列名がRモデルの期待する形式と一致しているか確認してください。"
-        elif "rpy2" in error_detail.lower():
-            error_detail += "\nrpy2が正しくインストールされ、Rが利用可能か確認してください。"
-        raise HTTPException(status_code=500, detail=error_detail)
+        raise HTTPException(status_code=500, detail=build_error_detail(e))
+
+def sensitivity_grid(request: SensitivityRequest) -> List[PredictionRequest]:
+    """基準の入力と、各項目の値をvaluesの値に置き換えた入力（項目順・値順）のリスト"""
+    base = request.base
+    grid = [base]
+    for item in request.items:
+        field = 'motionValues' if item in MOTION_FEATURES else 'cognitiveValues'
+        for value in request.values:
+            grid.append(base.model_copy(update={field: {**getattr(base, field), item: value}}))
+    return grid
+
+def sensitivity_response(request: SensitivityRequest, results: List[PredictionResponse]) -> SensitivityResponse:
+    """グリッドの予測結果を項目ごとの表にまとめる"""
+    base, rows = results[0], results[1:]
+    fields = [field for field, value in base.model_dump().items() if value is not None and field != 'modelVersion']
+    n_values = len(request.values)
+    items = {}
+    for k, item in enumerate(request.items):
+        item_rows = rows[k * n_values:(k + 1) * n_values]
+        items[item] = {field: [getattr(row, field) for row in item_rows] for field in fields}
+    return SensitivityResponse(values=request.values, base=base, items=items, modelVersion=base.modelVersion)
+
+@app.post("/predict/sensitivity", response_model=SensitivityResponse)
+async def predict_sensitivity(request: SensitivityRequest, x_request_timeout: Optional[float] = Header(None)):
+    """感度分析APIエンドポイント
+    
+    指定した項目の値を1つずつvaluesの値（既定は1-7）に動かした入力を全て1つの入力行列にまとめ、
+    各モデルを1回ずつ呼び出して予測する（項目数 x 値の数 + 基準の1行）。
+    """
+    deadline = deadline_after(x_request_timeout)
+    try:
+        if not models_ready:
+            raise HTTPException(
+                status_code=503,
+                detail="Rモデルが読み込まれていません。モデルを学習・保存してください。"
+            )
+        
+        results = await compute_predictions(sensitivity_grid(request), deadline)
+        return sensitivity_response(request, results)
+        
+    except HTTPException:
+        raise
+    except (QueueFullError, DeadlineExceededError) as e:
+        raise overload_error(e)
+    except Exception as e:
+        print(f"感度分析エラー: {e}")
+        import traceback
+        print(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=build_error_detail(e))
+
+async def predict_bulk(requests: List[PredictionRequest],
+                       fallbacks: Optional[List[List[str]]] = None) -> List[PredictionResponse]:
+    """一括予測（待ち行列が空くまで待って予測する、対話的な予測のキャッシュは使わない）"""
+    while True:
+        try:
+            return await compute_predictions(requests, fallbacks=fallbacks)
+        except QueueFullError:
+            await asyncio.sleep(BULK_RETRY_INTERVAL)
+
+async def stream_csv_predictions(source, output_format: str, chunk_size: int,
+                                 id_column: Optional[str]):
+    """CSVをchunk_size行ずつ読み込んで予測し、結果を順に出力する
+    
+    CSVの読み込みは別スレッドで行い、イベントループは止めない。
+    読み込めなくなった場合はエラーのレコードを出力して終了する。
+    """
+    loop = asyncio.get_running_loop()
+    columns = output_columns(id_column)
+    if output_format == 'csv':
+        yield format_csv([], columns, header=True)
+    
+    start_row = 0
+    try:
+        reader = await loop.run_in_executor(None, read_csv_chunks, source, chunk_size)
+        while True:
+            chunk = await loop.run_in_executor(None, next, reader, None)
+            if chunk is None:
+                break
+            records, requests, indices = prepare_chunk(chunk, start_row, PredictionRequest, id_column)
+            if requests:
+                try:
+                    fallbacks = [[] for _ in requests]
+                    responses = await predict_bulk(requests, fallbacks)
+                    fill_records(records, indices, [response.model_dump() for response in responses])
+                    mark_fallbacks(records, indices, fallbacks)
+                except Exception as e:
+                    print(f"一括予測エラー（{start_row + 1}行目から）: {e}")
+                    fail_records(records, indices, e)
+            start_row += len(chunk)
+            yield format_csv(records, columns) if output_format == 'csv' else format_ndjson(records)
+    except Exception as e:
+        print(f"CSVの読み込みエラー（{start_row + 1}行目から）: {e}")
+        record = {ERROR_COLUMN: f"CSVの読み込みに失敗しました（{start_row + 1}行目から）: {e}"}
+        yield format_csv([record], columns) if output_format == 'csv' else format_ndjson([record])
+
+@app.post("/predict/csv")
+async def predict_csv(
+    file: UploadFile = File(...),
+    output_format: str = Query('ndjson', alias='format'),
+    chunk_size: int = Query(CSV_CHUNK_SIZE, ge=1),
+    id_column: Optional[str] = None,
+):
+    """CSV一括予測APIエンドポイント
+    
+    病院システム形式のCSV（CP932、学習データと同じ列）をアップロードすると、
+    chunk_size行ずつ予測し、結果をNDJSON（format=ndjson）またはCSV（format=csv）で順に返す。
+    id_columnを指定すると、その列の値を結果に含める。
+    """
+    if not models_ready:
+        raise HTTPException(
+            status_code=503,
+            detail="Rモデルが読み込まれていません。モデルを学習・保存してください。"
+        )
+    if output_format not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"formatには次の値を指定してください: {list(OUTPUT_FORMATS)}")
+    
+    media_type = "text/csv; charset=Windows-31J" if output_format == 'csv' else "application/x-ndjson"
+    return StreamingResponse(
+        stream_csv_predictions(file.file, output_format, chunk_size, id_column),
+        media_type=media_type
+    )
+
+@app.post("/predict/batch", response_model=List[PredictionResponse])
+async def predict_batch(requests: List[PredictionRequest], response: Response, background_tasks: BackgroundTasks,
+                        x_request_timeout: Optional[float] = Header(None),
+                        x_model_set: Optional[str] = Header(None)):
+    """一括予測APIエンドポイント
+    
+    複数患者分の入力を1つの入力行列にまとめ、各モデルを1回ずつ呼び出す。
+    結果は入力と同じ順序で返す。モデルセットは/predictと同じく選ぶ（全患者で同じセット）。
+    """
+    deadline = deadline_after(x_request_timeout)
+    try:
+        if not models_ready:
+            raise HTTPException(
+                status_code=503,
+                detail="Rモデルが読み込まれていません。モデルを学習・保存してください。"
+            )
+        
+        if len(requests) == 0:
+            return []
+        try:
+            model_set = route_request(x_model_set)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        # 全患者分をまとめて予測を実行
+        results = await run_predictions(requests, deadline, model_set)
+        if model_set is not None:
+            response.headers[MODEL_SET_HEADER] = model_set
+            background_tasks.add_task(submit_shadow, requests, model_set, results)
+        return results
+        
+    except HTTPException:
+        raise
+    except (QueueFullError, DeadlineExceededError) as e:
+        raise overload_error(e)
+    except Exception as e:
+        print(f"一括予測エラー: {e}")
+        import traceback
+        print(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=build_error_detail(e))
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,59 @@
+"""
+予測結果のキャッシュ（LRU）
+同じ入力（モデルが受け取る値が同じ入力）の予測結果を再利用する
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+# キャッシュする最大件数（0の場合はキャッシュしない）
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', '1024'))
+
+
+class PredictionCache:
+    """件数上限付きのLRUキャッシュ（ヒット・ミス・追い出しの回数を記録）"""
+
+    def __init__(self, max_size: int = PREDICTION_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """キャッシュから取得（見つからない場合はNone）"""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any):
+        """キャッシュに追加（上限を超えた場合は最も古く使われたものを追い出す）"""
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """全てのキャッシュを破棄（モデルを読み込み直した場合など）"""
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,99 @@
+"""
+予測処理の専用スレッドと受け付け制御
+RやNumPyの同期的な予測処理をイベントループから切り離して1つの専用スレッドで順に実行し、
+待ちが上限を超えた場合はすぐに断る。呼び出し元が諦めた（期限を過ぎた）処理は実行しない
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+# 予測の待ち行列の上限（処理中を含む件数、マイクロバッチ処理の場合は1バッチで1件）
+PREDICTION_QUEUE_SIZE = int(os.environ.get('PREDICTION_QUEUE_SIZE', '32'))
+# リクエストの期限（秒、Node.jsサーバーのタイムアウトに合わせる）
+REQUEST_TIMEOUT = float(os.environ.get('REQUEST_TIMEOUT', '10'))
+
+
+class QueueFullError(Exception):
+    """予測の待ち行列が上限に達している"""
+
+
+class DeadlineExceededError(Exception):
+    """リクエストの期限までに予測が完了しなかった"""
+
+
+def deadline_after(timeout: Optional[float] = None) -> float:
+    """timeout秒後の期限（time.monotonic()の値）"""
+    return time.monotonic() + (REQUEST_TIMEOUT if timeout is None else timeout)
+
+
+async def wait_until(awaitable: Awaitable, deadline: Optional[float]) -> Any:
+    """期限まで結果を待つ（期限を過ぎた場合は待つのをやめ、まだ始まっていない処理は取り消す）"""
+    if deadline is None:
+        return await awaitable
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        if asyncio.isfuture(awaitable):
+            awaitable.cancel()
+        elif asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise DeadlineExceededError("リクエストの期限を過ぎました")
+    try:
+        return await asyncio.wait_for(awaitable, remaining)
+    except asyncio.TimeoutError:
+        raise DeadlineExceededError("リクエストの期限までに予測が完了しませんでした")
+
+
+class PredictionExecutor:
+    """予測処理を実行する専用スレッド（待ち行列の長さに上限あり）
+
+    埋め込みRはシングルスレッドのため、Rを呼び出す処理は全てこのスレッドで順に実行する。
+    待ち行列の件数は処理が実際に終わった（または取り消された）時点で減らす。
+    """
+
+    def __init__(self, max_queue: int = PREDICTION_QUEUE_SIZE):
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prediction')
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.rejected = 0
+        self.expired = 0
+
+    def _release(self, _future):
+        with self.lock:
+            self.queued -= 1
+
+    def _call(self, fn: Callable, args: tuple, deadline: Optional[float]) -> Any:
+        # 順番が来た時点で期限を過ぎていれば実行しない
+        if deadline is not None and time.monotonic() > deadline:
+            self.expired += 1
+            raise DeadlineExceededError("リクエストの期限を過ぎたため予測を実行しませんでした")
+        return fn(*args)
+
+    async def run(self, fn: Callable, *args, deadline: Optional[float] = None, admit: bool = True) -> Any:
+        """fn(*args)を専用スレッドで実行し、期限まで結果を待つ
+
+        admit: Falseの場合は待ち行列の上限を確認しない（モデルの読み込みなど）
+        """
+        with self.lock:
+            if admit and self.queued >= self.max_queue:
+                self.rejected += 1
+                raise QueueFullError(f"予測の待ちが上限（{self.max_queue}件）に達しています")
+            self.queued += 1
+        future = self.executor.submit(self._call, fn, args, deadline)
+        future.add_done_callback(self._release)
+        # 期限を過ぎて待つのをやめた場合、まだ始まっていなければ取り消される
+        return await wait_until(asyncio.wrap_future(future), deadline)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+            "expired": self.expired,
+        }
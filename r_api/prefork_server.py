@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+pre-fork方式のFastAPIサーバー
+親プロセスでモデルを1回だけ読み込んでからワーカープロセスをforkし、
+モデルのメモリ（Rのヒープ・ネイティブモデルの配列）をワーカー間でコピーオンライトで共有する。
+（uvicorn --workers はワーカーをspawnで起動するため、ワーカーごとにモデルを読み込み直す）
+
+親プロセスはリクエストを処理せず、ワーカーの監視・再起動と使用メモリの表示のみ行う。
+終了したワーカーは、読み込み済みのモデルを持つ親プロセスから再びforkする。
+
+使い方:
+  python prefork_server.py --workers 4 --port 5000
+  kill -HUP <親プロセスのPID>   # 親でモデルを読み込み直し、ワーカーを順に入れ替える
+                               # （ワーカーの /admin/reload も親プロセスにSIGHUPを送る）
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from process_memory import format_megabytes, memory_summary
+
+# ワーカープロセス数
+PREFORK_WORKERS = int(os.environ.get('PREFORK_WORKERS', '2'))
+# ワーカーの使用メモリを表示する間隔（秒、0の場合は起動時のみ）
+MEMORY_REPORT_INTERVAL = float(os.environ.get('MEMORY_REPORT_INTERVAL', '60'))
+# 終了を依頼したワーカーが終わるまで待つ時間（秒、過ぎた場合は強制終了）
+WORKER_STOP_TIMEOUT = 30.0
+
+# 親プロセスが受け取ったシグナル（シグナルハンドラーでは記録のみ行い、メインループで処理する）
+received_signals = []
+
+
+def handle_signal(signum, _frame):
+    received_signals.append(signum)
+
+
+def create_socket(host: str, port: int) -> socket.socket:
+    """全ワーカーで共有する待ち受けソケット（親プロセスで作成してforkで引き継ぐ）"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(sock: socket.socket, host: str, port: int):
+    """forkしたワーカープロセスでuvicornを起動する（終了までこの関数から戻らない）"""
+    import uvicorn
+    import predict_api_fastapi as api
+
+    # 親プロセス用のシグナルハンドラーを戻す（SIGINT・SIGTERMはuvicornが設定する）
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    gc.unfreeze()
+
+    config = uvicorn.Config(api.app, host=host, port=port)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def fork_worker(sock: socket.socket, host: str, port: int) -> int:
+    """ワーカープロセスをforkし、PIDを返す"""
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            run_worker(sock, host, port)
+        except BaseException as e:
+            print(f"❌ エラー: ワーカー {os.getpid()} が異常終了しました: {e}")
+            status = 1
+        finally:
+            # 親プロセスから引き継いだ終了処理（atexitなど）は実行しない
+            os._exit(status)
+    print(f"ワーカーを起動しました: PID {pid}")
+    return pid
+
+
+def prepare_fork():
+    """forkの直前に呼び出す
+
+    読み込み済みのオブジェクトをPythonのGCの対象から外し、ワーカーでGCが参照カウント以外の
+    管理情報を書き換えて共有しているページがコピーされるのを減らす。
+    """
+    gc.collect()
+    gc.freeze()
+
+
+def stop_workers(pids, timeout: float = WORKER_STOP_TIMEOUT):
+    """ワーカーに終了を依頼し、終わるまで待つ（timeoutを過ぎたら強制終了）"""
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + timeout
+    remaining = set(pids)
+    while remaining and time.monotonic() < deadline:
+        for pid in list(remaining):
+            try:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done = pid
+            if done:
+                remaining.discard(pid)
+        time.sleep(0.1)
+    for pid in remaining:
+        print(f"⚠️  警告: ワーカー {pid} が終了しないため強制終了します")
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+
+def report_memory(workers):
+    """親プロセスと各ワーカーの使用メモリを表示
+
+    RSSは共有しているページをプロセスごとに重複して数える。PSSの合計が実際に使っているメモリ。
+    """
+    summary = memory_summary([os.getpid()] + list(workers))
+    if not summary["processes"]:
+        print("（このOSではプロセスの使用メモリを取得できません）")
+        return
+    print("使用メモリ（PID: RSS / PSS / 共有 / 専有）")
+    for pid, memory in summary["processes"].items():
+        role = "親" if pid == os.getpid() else "ワーカー"
+        print(f"  {role} {pid}: {format_megabytes(memory['rss_bytes'])} / {format_megabytes(memory['pss_bytes'])} / "
+              f"{format_megabytes(memory.get('shared_bytes', 0))} / {format_megabytes(memory.get('private_bytes', 0))}")
+    worker_rss = [summary["processes"][pid]["rss_bytes"] for pid in workers if pid in summary["processes"]]
+    if worker_rss:
+        print(f"  合計PSS: {format_megabytes(summary['total_pss_bytes'])}"
+              f"（共有しない場合の目安: 1ワーカーのRSS×{len(worker_rss)} = {format_megabytes(max(worker_rss) * len(worker_rss))}）")
+
+
+def reload_and_replace(api, sock, host, port, workers):
+    """親プロセスでモデルを読み込み直し、ワーカーを1つずつ新しいモデルのワーカーに入れ替える
+
+    新しいワーカーを起動してから古いワーカーを終了するため、入れ替え中も受け付けを止めない。
+    """
+    previous_version = api.current_model_version()
+    gc.unfreeze()
+    api.load_models()
+    print(f"モデルの再読み込み完了: {previous_version} -> {api.current_model_version()}")
+    prepare_fork()
+    for old_pid in list(workers):
+        workers.add(fork_worker(sock, host, port))
+        workers.discard(old_pid)
+        stop_workers([old_pid])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pre-fork方式のFastAPIサーバー（モデルをワーカー間で共有）")
+    parser.add_argument('--workers', type=int, default=PREFORK_WORKERS, help="ワーカープロセス数")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args()
+
+    if not hasattr(os, 'fork'):
+        print("エラー: このOSではforkが使えないため、pre-fork方式は使用できません")
+        sys.exit(1)
+
+    import predict_api_fastapi as api
+
+    if api.R_WORKERS > 0:
+        print("エラー: pre-fork方式ではR_WORKERSは使用できません（ワーカー数は --workers で指定してください）")
+        sys.exit(1)
+    if api.MODEL_WATCH_INTERVAL > 0:
+        # ワーカーごとに読み込み直すと共有できなくなるため、読み込み直しは親プロセスで行う
+        print("⚠️  警告: pre-fork方式ではモデルディレクトリを監視しません（読み込み直す場合は親プロセスにSIGHUPを送ってください）")
+        api.MODEL_WATCH_INTERVAL = 0
+
+    print(f"親プロセス（PID {os.getpid()}）でモデルを読み込み中...")
+    api.preload_models()
+    if not api.models_ready:
+        print("❌ エラー: モデルを読み込めないため起動しません")
+        sys.exit(1)
+
+    sock = create_socket(args.host, args.port)
+    # ワーカーの /admin/reload は親プロセスにSIGHUPを送る
+    api.prefork_parent_pid = os.getpid()
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, handle_signal)
+
+    prepare_fork()
+    workers = {fork_worker(sock, args.host, args.port) for _ in range(args.workers)}
+    print(f"pre-fork方式で起動しました: http://{args.host}:{args.port} （ワーカー {args.workers}個）")
+
+    # ワーカーの起動（インポート・初期化）を待ってから使用メモリを表示
+    time.sleep(2.0)
+    report_memory(workers)
+    next_report = time.monotonic() + MEMORY_REPORT_INTERVAL
+
+    while True:
+        while received_signals:
+            signum = received_signals.pop(0)
+            if signum == signal.SIGHUP:
+                print("SIGHUPを受け取りました。モデルを読み込み直します...")
+                reload_and_replace(api, sock, args.host, args.port, workers)
+                report_memory(workers)
+            else:
+                print("終了します...")
+                stop_workers(list(workers))
+                sock.close()
+                return
+
+        # 終了したワーカーを親プロセスから再びforkする
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid in workers:
+            print(f"⚠️  警告: ワーカー {pid} が終了しました（status {status}）。再起動します")
+            workers.discard(pid)
+            workers.add(fork_worker(sock, args.host, args.port))
+
+        if MEMORY_REPORT_INTERVAL > 0 and time.monotonic() >= next_report:
+            report_memory(workers)
+            next_report = time.monotonic() + MEMORY_REPORT_INTERVAL
+        time.sleep(0.5)
+
+
+if __name__ == "__main__":
+    main()
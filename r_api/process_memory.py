@@ -0,0 +1,50 @@
+"""
+プロセスの使用メモリ（Linuxの /proc/<pid>/smaps_rollup から取得）
+pre-fork方式で複数のワーカーがモデルのメモリを共有している場合、RSSは共有分を
+ワーカーごとに重複して数えるため、共有分をプロセス数で按分したPSSで実際の使用量を確認する
+"""
+from typing import Dict, List, Union
+
+# smaps_rollupの項目 -> 返す値の名前
+_SMAPS_FIELDS = {
+    'Rss': 'rss_bytes',
+    'Pss': 'pss_bytes',
+    'Shared_Clean': 'shared_bytes',
+    'Shared_Dirty': 'shared_bytes',
+    'Private_Clean': 'private_bytes',
+    'Private_Dirty': 'private_bytes',
+}
+
+
+def process_memory(pid: Union[int, str] = 'self') -> Dict[str, int]:
+    """プロセスの使用メモリ（バイト）: rss, pss, 他のプロセスと共有している分, このプロセスのみの分
+
+    /proc/<pid>/smaps_rollup がない環境（Linux以外など）では空のdictを返す。
+    """
+    memory = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                name = parts[0].rstrip(':')
+                if name in _SMAPS_FIELDS and len(parts) >= 2:
+                    key = _SMAPS_FIELDS[name]
+                    memory[key] = memory.get(key, 0) + int(parts[1]) * 1024
+    except (OSError, ValueError):
+        return {}
+    return memory
+
+
+def memory_summary(pids: List[int]) -> Dict:
+    """複数のプロセスの使用メモリと合計（PSSの合計が実際に使っているメモリ）"""
+    processes = {pid: process_memory(pid) for pid in pids}
+    processes = {pid: memory for pid, memory in processes.items() if memory}
+    return {
+        "processes": processes,
+        "total_rss_bytes": sum(memory['rss_bytes'] for memory in processes.values()),
+        "total_pss_bytes": sum(memory['pss_bytes'] for memory in processes.values()),
+    }
+
+
+def format_megabytes(n_bytes: int) -> str:
+    return f"{n_bytes / (1024 * 1024):.1f}MB"
@@ -0,0 +1,68 @@
+"""
+予測処理のプロファイリング（必要な時のみ有効にする）
+- Server-Timingヘッダー: 1件の予測の段階ごと・モデルごとの処理時間
+- サンプリング: 一定時間のcProfile（予測処理のスレッド）とRprofの結果をまとめたzip
+"""
+import cProfile
+import io
+import os
+import pstats
+import tempfile
+import zipfile
+from typing import Dict, List, Tuple
+
+from metrics import STAGE_DURATION, MODEL_DURATION
+
+# サンプリングの時間の上限（秒）
+PROFILE_MAX_SECONDS = 300
+# cProfileのテキストの結果に含める関数の数
+PROFILE_TEXT_LINES = 60
+# Rprofのサンプリング間隔（秒）
+RPROF_INTERVAL = 0.005
+
+
+def timing_entries(observations: List[Tuple]) -> Dict[str, float]:
+    """record_observations()で集めた値を、Server-Timingの項目名 -> 秒（同じ項目は合計）にする
+
+    段階（prepare, convert, r_predict など）はその名前、モデルごとの予測時間は model_<キー> とする。
+    """
+    entries = {}
+    for metric, labels, seconds in observations:
+        if metric is STAGE_DURATION:
+            name = labels[0]
+        elif metric is MODEL_DURATION:
+            name = f"model_{labels[0]}"
+        else:
+            continue
+        entries[name] = entries.get(name, 0.0) + seconds
+    return entries
+
+
+def server_timing_header(entries: Dict[str, float]) -> str:
+    """Server-Timingヘッダーの値（ミリ秒、項目の順序はentriesの順）"""
+    return ', '.join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in entries.items())
+
+
+def python_profile_files(profiler: cProfile.Profile) -> Dict[str, bytes]:
+    """cProfileの結果（pstats形式のファイルと、累積時間順のテキスト）"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'python.prof')
+        profiler.dump_stats(path)
+        with open(path, 'rb') as f:
+            raw = f.read()
+    text = io.StringIO()
+    try:
+        pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(PROFILE_TEXT_LINES)
+    except TypeError:
+        # 予測が1件もなかった場合は記録がない
+        text.write("記録された関数呼び出しがありません\n")
+    return {'python.prof': raw, 'python.txt': text.getvalue().encode('utf-8')}
+
+
+def make_zip(files: Dict[str, bytes]) -> bytes:
+    """ファイル名 -> 内容をzipにまとめる"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in files.items():
+            archive.writestr(name, content)
+    return buffer.getvalue()
@@ -0,0 +1,115 @@
+"""
+埋め込みR（rpy2）の起動と、予測に使うRパッケージ・R関数の読み込み
+このモジュールをインポートするとRが起動する（caretの読み込みを含め数秒かかる）ため、
+predict_api_fastapi.init_r_engine() からRモデルが必要になった時に初めてインポートする
+"""
+import rpy2.robjects as ro
+from rpy2.robjects import pandas2ri
+from rpy2.robjects.packages import importr
+
+from feature_encoder import FEATURE_COLUMNS
+
+# Rのパッケージを読み込む
+base = importr('base')
+caret = importr('caret')
+pandas2ri.activate()
+unserialize = ro.r['unserialize']
+# 全モデルを1回のR呼び出しで評価する関数
+# values: モデルキーを名前に持つ数値ベクトル（モデルごとにnrow(newdata)個ずつ並ぶ）
+# seconds: モデルごとの予測時間（秒）
+# 予測に失敗したモデルはNAを返す
+predict_all = ro.r('''
+    function(models, newdata) {
+        n <- nrow(newdata)
+        seconds <- setNames(numeric(length(models)), names(models))
+        preds <- lapply(names(models), function(key) {
+            started <- proc.time()[["elapsed"]]
+            p <- tryCatch({
+                p <- as.numeric(predict(models[[key]], newdata))
+                if (length(p) != n) stop("予測値の件数が入力行数と一致しません")
+                p
+            }, error = function(e) {
+                message(sprintf("予測エラー (%s): %s", key, conditionMessage(e)))
+                rep(NA_real_, n)
+            })
+            seconds[[key]] <<- proc.time()[["elapsed"]] - started
+            p
+        })
+        out <- unlist(preds, use.names = FALSE)
+        names(out) <- rep(names(models), each = n)
+        list(values = out, seconds = seconds)
+    }
+''')
+# 列優先の数値ベクトルから列名付きのデータフレームを作成する関数
+make_frame = ro.r('''
+    function(values, n, columns) {
+        m <- matrix(values, nrow = n)
+        colnames(m) <- columns
+        as.data.frame(m)
+    }
+''')
+feature_columns = ro.StrVector(FEATURE_COLUMNS)
+# caretのモデルが予測に使う変数名と型を取り出す関数
+# ptype（caret 6.0-87以降）、formulaのterms、coefnamesの順に確認する
+model_schema = ro.r('''
+    function(model) {
+        if (!is.null(model$ptype)) {
+            names <- colnames(model$ptype)
+            types <- vapply(model$ptype, function(col) class(col)[1], character(1))
+        } else if (!is.null(model$terms)) {
+            names <- attr(model$terms, "term.labels")
+            types <- attr(model$terms, "dataClasses")[names]
+        } else {
+            names <- model$coefnames
+            types <- rep("numeric", length(names))
+        }
+        names <- gsub("`", "", names)
+        list(names = names, types = unname(as.character(types)))
+    }
+''')
+# モデルの使用メモリ（object.size）を構成要素ごとに求める関数（finalModelはその中の要素ごと）
+model_memory = ro.r('''
+    function(model) {
+        size <- function(x) as.numeric(object.size(x))
+        sizes <- vapply(names(model), function(name) size(model[[name]]), numeric(1))
+        if (is.list(model$finalModel)) {
+            inner <- vapply(names(model$finalModel), function(name) size(model$finalModel[[name]]), numeric(1))
+            names(inner) <- paste0("finalModel$", names(inner))
+            sizes <- c(sizes, inner)
+        }
+        list(total = size(model), components = sizes)
+    }
+''')
+# 予測に使わない要素を取り除いたモデルを作る関数
+# 学習データの先頭の行で取り除く前と予測値が完全に一致した場合のみ、取り除いたモデルを返す
+slim_model = ro.r('''
+    function(model, drop, control_drop, final_drop, n_check) {
+        if (is.null(model$trainingData)) {
+            return(list(model = model, slimmed = FALSE, reason = "確認に使う学習データ（trainingData）がありません"))
+        }
+        predictors <- setdiff(names(model$trainingData), ".outcome")
+        check <- head(model$trainingData[, predictors, drop = FALSE], n_check)
+        before <- tryCatch(predict(model, check), error = function(e) NULL)
+        if (is.null(before)) {
+            return(list(model = model, slimmed = FALSE, reason = "学習データで予測できません"))
+        }
+        slim <- model
+        for (name in drop) slim[[name]] <- NULL
+        if (is.list(slim$control)) for (name in control_drop) slim$control[[name]] <- NULL
+        if (is.list(slim$finalModel)) for (name in final_drop) slim$finalModel[[name]] <- NULL
+        after <- tryCatch(predict(slim, check), error = function(e) conditionMessage(e))
+        if (!identical(before, after)) {
+            reason <- if (is.character(after)) after else "予測値が一致しません"
+            return(list(model = model, slimmed = FALSE, reason = reason))
+        }
+        list(model = slim, slimmed = TRUE, reason = "")
+    }
+''')
+# Rprofによるプロファイリングの開始・終了（終了時はsummaryRprofの結果をテキストで返す）
+start_profiling = ro.r('function(path, interval) Rprof(path, interval = interval)')
+stop_profiling = ro.r('''
+    function(path) {
+        Rprof(NULL)
+        paste(capture.output(print(summaryRprof(path))), collapse = "\n")
+    }
+''')
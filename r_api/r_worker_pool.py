@@ -0,0 +1,243 @@
+"""
+Rワーカープール
+埋め込みRはプロセスごとに1つでシングルスレッドのため、
+モデルを読み込んだRセッションを持つワーカープロセスを複数起動して予測を分散する
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from metrics import export_observations, record_observations, replay_observations
+from prediction_executor import PREDICTION_QUEUE_SIZE, QueueFullError
+
+# ワーカープロセス数（0の場合はプールを使わずAPIのプロセス内で予測）
+R_WORKERS = int(os.environ.get('R_WORKERS', '0'))
+# 最初のワーカーの読み込みが終わってから、全ワーカーの読み込みが終わるまで待つ時間の上限（秒）
+WORKER_START_TIMEOUT = float(os.environ.get('WORKER_START_TIMEOUT', '600'))
+
+# ワーカープロセス内の状態（init_workerで設定する）
+# 読み込みに失敗した場合のエラー
+worker_load_error = None
+# 起動時の確認を全ワーカーで1回ずつ実行するためのバリア
+worker_start_barrier = None
+# ワーカーで読み込むモデルセット（Noneの場合はデフォルトのセット）
+worker_model_set = None
+
+
+def init_worker(start_barrier=None, model_set=None):
+    """ワーカープロセスの初期化（プロセスごとのRセッションにモデルを読み込む）
+
+    model_set: 読み込むモデルセット（シャドウの予測用のワーカーの場合、そのセットのみを読み込む）
+    読み込みに失敗しても例外は送出せず（プール全体が使えなくなるため）、worker_start_report()で親に返す。
+    """
+    global worker_load_error, worker_start_barrier, worker_model_set
+    import predict_api_fastapi as api
+    worker_start_barrier = start_barrier
+    worker_model_set = model_set
+    print(f"[worker {os.getpid()}] モデルを読み込み中...")
+    try:
+        if model_set is None:
+            api.load_models()
+        else:
+            api.load_single_model_set(model_set)
+    except Exception as e:
+        worker_load_error = str(e)
+        print(f"❌ [worker {os.getpid()}] エラー: モデルの読み込みに失敗しました: {e}")
+
+
+def worker_start_report() -> Dict:
+    """起動時の確認（ワーカー数と同じ回数だけ投入する）
+
+    全ワーカーがこの関数を同時に実行するまでバリアで待つため、1つのワーカーが複数回実行することはなく、
+    必ず全てのワーカーの読み込み結果が1つずつ返る。
+    """
+    if worker_start_barrier is not None:
+        worker_start_barrier.wait(WORKER_START_TIMEOUT)
+    return worker_model_info()
+
+
+def worker_model_info() -> Dict:
+    """ワーカーで読み込まれているモデルのバージョンとキー"""
+    import predict_api_fastapi as api
+    model_set = worker_model_set
+    is_default = model_set is None or model_set == api.default_model_set()
+    if is_default:
+        snapshot = api.model_snapshot
+        schema_errors = api.model_schema_errors
+    else:
+        # シャドウの予測用のワーカーが読み込んだセットはloaded_model_sets()（振り分け先）に含まれないため、直接確認する
+        loaded = model_set in api.model_set_snapshots
+        snapshot = api.model_set_snapshot(model_set) if loaded else api.ModelSnapshot(None, {})
+        schema_errors = api.model_set_schema_errors.get(model_set, {})
+    load_stats = api.load_stats_for(model_set)
+    return {
+        "pid": os.getpid(),
+        "error": worker_load_error,
+        "version": snapshot.version,
+        "engine": snapshot.engine,
+        "models": list(snapshot.models.keys()),
+        "schema_errors": schema_errors,
+        "warmup": api.warmup_stats if is_default else {},
+        "load_stats": load_stats,
+        "model_memory_bytes": api.model_memory_bytes(load_stats),
+    }
+
+
+def worker_predict(payloads: List[Dict], model_set: Optional[str] = None,
+                   role: str = 'primary') -> Tuple[List[Dict], List[Tuple], List[List[str]]]:
+    """ワーカー内で複数患者分の予測を実行（入出力はプロセス間で受け渡せるdict）
+
+    ワーカーで記録した処理時間・予測行数・代替値の件数は、親プロセスの/metricsに含めるため結果とあわせて返す。
+    あわせて、患者ごとに代替値を使ったモデルのキーのリストも返す（一括予測でエラーとして数えるため）。
+    """
+    import predict_api_fastapi as api
+    requests = [api.PredictionRequest(**payload) for payload in payloads]
+    fallbacks = [[] for _ in requests]
+    with record_observations(publish=False) as observations:
+        responses = api.predict_requests(requests, model_set, role, fallbacks)
+    return [response.model_dump() for response in responses], export_observations(observations), fallbacks
+
+
+def merge_load_stats(reports: List[Dict]) -> Dict:
+    """ワーカーごとのモデルの読み込み時間をモデルごとにまとめる
+
+    数値は全ワーカーの最大値（最も遅いワーカーの値、プールはこのワーカーを待って予測を始める）、
+    それ以外（ファイル名など）は最初のワーカーの値とする。
+    """
+    merged = {}
+    for report in reports:
+        for key, stats in report["load_stats"].items():
+            entry = merged.setdefault(key, {})
+            for name, value in stats.items():
+                if isinstance(value, (int, float)) and isinstance(entry.get(name), (int, float)):
+                    entry[name] = max(entry[name], value)
+                else:
+                    entry.setdefault(name, value)
+    return merged
+
+
+def worker_problems(report: Dict) -> List[str]:
+    """worker_model_info()の結果から、予測を受け付けられない理由のリスト"""
+    problems = []
+    if report["error"]:
+        problems.append(f"モデルの読み込みに失敗しました: {report['error']}")
+    elif not report["models"]:
+        problems.append("モデルが1つも読み込まれていません")
+    if report["schema_errors"]:
+        problems.append(f"変数が入力の列と一致しないモデルがあります: {list(report['schema_errors'])}")
+    return problems
+
+
+class RWorkerPool:
+    """モデルを事前に読み込んだワーカープロセスのプール
+
+    予測はプールのキューに投入され、空いているワーカーが処理する。
+    キューの件数（処理中を含む）が max_queue に達している場合は QueueFullError を送出する。
+    """
+
+    def __init__(self, n_workers: int, max_queue: int = PREDICTION_QUEUE_SIZE,
+                 model_set: Optional[str] = None, role: str = 'primary'):
+        self.n_workers = n_workers
+        self.max_queue = max_queue
+        # 読み込んで予測するモデルセット（Noneの場合はデフォルトのセット）と、予測時間を記録する役割
+        self.model_set = model_set
+        self.role = role
+        self.queued = 0
+        self.executor = None
+        self.available_models = []
+        self.model_version = None
+        self.engine = None
+        self.schema_errors = {}
+        self.warmup = {}
+        # モデルごとの読み込み時間（全ワーカーをまとめた値、/healthのmodel_load）
+        self.load_stats = {}
+        # ワーカーのPID -> ワーカーが読み込んだモデルの使用メモリの合計
+        self.model_memory = {}
+        # ワーカーのPID -> worker_model_info()の結果
+        self.workers = {}
+
+    async def start(self):
+        """ワーカーを起動し、全ワーカーでモデルが読み込まれるのを待つ
+
+        全ワーカーが同じモデルを問題なく読み込んだ場合のみ available_models を設定する
+        （1つでも失敗・不一致があれば空のままにし、このプールでは予測しない）。
+        """
+        # 各ワーカーが独立したRセッションを持つよう、forkではなくspawnで起動する
+        context = multiprocessing.get_context('spawn')
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.n_workers,
+            mp_context=context,
+            initializer=init_worker,
+            initargs=(context.Barrier(self.n_workers), self.model_set),
+        )
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*[
+            loop.run_in_executor(self.executor, worker_start_report)
+            for _ in range(self.n_workers)
+        ], return_exceptions=True)
+
+        problems = []
+        for result in results:
+            if isinstance(result, BaseException):
+                problems.append(f"ワーカーの起動を確認できません: {result!r}")
+                continue
+            self.workers[result["pid"]] = result
+            problems.extend(f"ワーカー {result['pid']}: {problem}" for problem in worker_problems(result))
+        reports = list(self.workers.values())
+        if len(reports) < self.n_workers and not problems:
+            problems.append(f"{self.n_workers}個のうち{len(reports)}個のワーカーのみ応答しました")
+        if len({(report["version"], tuple(report["models"])) for report in reports}) > 1:
+            problems.append("ワーカーによって読み込んだモデルが異なります")
+
+        for report in reports:
+            self.schema_errors.update(report["schema_errors"])
+        self.load_stats = merge_load_stats(reports)
+        self.model_memory = {pid: report["model_memory_bytes"] for pid, report in self.workers.items()}
+        if problems:
+            for problem in problems:
+                print(f"❌ エラー: {problem}")
+            print("❌ Rワーカープールを起動できません（全てのワーカーでモデルを読み込めた場合のみ予測を受け付けます）")
+            return
+        self.available_models = reports[0]["models"]
+        self.model_version = reports[0]["version"]
+        self.engine = reports[0]["engine"]
+        self.warmup = reports[0]["warmup"]
+        print(f"Rワーカープール起動完了: {self.n_workers}プロセス（PID {sorted(self.workers)}）, "
+              f"{len(self.available_models)}個のモデル")
+
+    async def predict(self, payloads: List[Dict], fallbacks: Optional[List[List[str]]] = None) -> List[Dict]:
+        """予測をワーカーに振り分ける（複数行の場合はワーカー数に分割して並列実行）
+        
+        待つのをやめた（キャンセルされた）場合、まだワーカーに渡していない分は取り消される。
+        fallbacks: ペイロードと同じ長さのリストを指定した場合、ペイロードごとに代替値を使ったモデルのキーのリストを設定する
+        """
+        if self.queued >= self.max_queue:
+            raise QueueFullError(f"予測の待ちが上限（{self.max_queue}件）に達しています")
+        loop = asyncio.get_running_loop()
+        chunk_size = -(-len(payloads) // self.n_workers)
+        chunks = [payloads[i:i + chunk_size] for i in range(0, len(payloads), chunk_size)]
+        self.queued += 1
+        try:
+            results = await asyncio.gather(*[
+                loop.run_in_executor(self.executor, worker_predict, chunk, self.model_set, self.role)
+                for chunk in chunks
+            ])
+        finally:
+            self.queued -= 1
+        for _, observations, _ in results:
+            replay_observations(observations)
+        if fallbacks is not None:
+            for i, keys in enumerate(keys for _, _, chunk_fallbacks in results for keys in chunk_fallbacks):
+                fallbacks[i] = keys
+        return [response for responses, _, _ in results for response in responses]
+
+    def shutdown(self, cancel_pending: bool = True):
+        """ワーカープロセスを終了
+
+        cancel_pending: Falseの場合はキューにある予測を全て処理してから終了する
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=cancel_pending)
+            self.executor = None
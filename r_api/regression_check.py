@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+予測精度と速度の回帰テストスクリプト
+CSV（学習データ・テストデータ）の全行を1つの行列にまとめて全20モデルで一度に予測し、
+モデルごとのMedAE（r_models/R_modelsの medae_train_all_FIM などと同じ、誤差の絶対値の中央値）・MAEと
+1秒あたりの予測行数を求めて、保存した基準値と比較する。
+精度が許容範囲を超えて変わった場合や、速度が基準より大きく落ちた場合は終了コード1で終了する。
+
+使い方:
+  python regression_check.py --update-baseline          # 現在のモデルで基準値を保存
+  python regression_check.py                            # 基準値と比較
+  python regression_check.py テストデータ.csv --baseline regression_baseline_test.json
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from typing import Dict
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from training_data import TRAINING_CSV_PATH, discharge_columns, read_training_csv, csv_to_payloads
+
+# 基準値のファイル
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'regression_baseline.json')
+# MedAE・MAEの許容する変化（FIMの点数）
+ACCURACY_TOLERANCE = float(os.environ.get('REGRESSION_ACCURACY_TOLERANCE', '0.01'))
+# 速度の許容する低下の割合（0.2: 基準の80%未満で失敗）
+SPEED_TOLERANCE = float(os.environ.get('REGRESSION_SPEED_TOLERANCE', '0.2'))
+
+
+def prediction_errors(predicted, actual) -> Dict:
+    """予測値と実測値の誤差（実測値が欠損している行・予測に失敗した行は除く）"""
+    predicted = np.asarray(predicted, dtype=np.float64)
+    actual = np.asarray(actual, dtype=np.float64)
+    valid = ~np.isnan(actual)
+    failed = valid & np.isnan(predicted)
+    errors = np.abs(predicted[valid & ~failed] - actual[valid & ~failed])
+    return {
+        "medae": float(np.median(errors)) if len(errors) else math.nan,
+        "mae": float(np.mean(errors)) if len(errors) else math.nan,
+        "rows": int(valid.sum()),
+        "failed": int(failed.sum()),
+    }
+
+
+def evaluate(api, csv_path: str, repeat: int) -> Dict:
+    """CSVの全行を全モデルで予測し、モデルごとの誤差と1秒あたりの予測行数を求める"""
+    snapshot = api.load_models()
+    if len(snapshot.models) == 0:
+        print("エラー: モデルが読み込まれていません")
+        sys.exit(1)
+
+    df = read_training_csv(csv_path)
+    requests = [api.PredictionRequest(**payload) for payload in csv_to_payloads(df)]
+    X = api.encode_requests(requests).copy()
+
+    # 全行・全モデルを1回で予測する時間を計測（最も速かった回を使う）
+    seconds = []
+    for _ in range(max(repeat, 1)):
+        started = time.perf_counter()
+        predictions = api.predict_all_models(X, snapshot.models, snapshot.engine)
+        seconds.append(time.perf_counter() - started)
+    best = min(seconds)
+
+    targets = discharge_columns(api.MOTION_ITEMS, api.COGNITIVE_ITEMS)
+    metrics = {}
+    for key, column in targets.items():
+        if key not in predictions:
+            continue
+        if column not in df.columns:
+            print(f"⚠️  警告: {column} の列がないため {key} の精度は求めません")
+            continue
+        metrics[key] = prediction_errors(predictions[key], df[column].to_numpy())
+
+    return {
+        "data": os.path.basename(csv_path),
+        "engine": snapshot.engine,
+        "model_version": snapshot.version,
+        "rows": len(X),
+        "seconds": round(best, 6),
+        "rows_per_second": round(len(X) / best, 1) if best > 0 else None,
+        "metrics": metrics,
+    }
+
+
+def compare(result: Dict, baseline: Dict, accuracy_tolerance: float, speed_tolerance: float) -> list:
+    """基準値と比べて許容範囲を超えた項目のメッセージのリスト"""
+    problems = []
+    if result["rows"] != baseline["rows"]:
+        problems.append(f"行数が基準と異なります（基準 {baseline['rows']}行, 今回 {result['rows']}行）")
+    for key, base in baseline["metrics"].items():
+        current = result["metrics"].get(key)
+        if current is None:
+            problems.append(f"{key}: モデルがありません")
+            continue
+        if current["failed"]:
+            problems.append(f"{key}: {current['failed']}行の予測に失敗しました")
+        for name in ("medae", "mae"):
+            if not abs(current[name] - base[name]) <= accuracy_tolerance:
+                problems.append(f"{key}: {name.upper()}が変わりました（基準 {base[name]:.4f}, 今回 {current[name]:.4f}）")
+    base_speed = baseline.get("rows_per_second")
+    if base_speed and result["rows_per_second"] < base_speed * (1 - speed_tolerance):
+        problems.append(f"予測速度が低下しました（基準 {base_speed:.0f}行/秒, 今回 {result['rows_per_second']:.0f}行/秒, "
+                        f"許容 {(1 - speed_tolerance) * 100:.0f}%まで）")
+    return problems
+
+
+def print_result(result: Dict, baseline: Dict = None):
+    print("\n" + "=" * 50)
+    print(f"予測精度（{result['data']}, {result['rows']}行, エンジン: {result['engine']}）")
+    print("=" * 50)
+    for key, current in result["metrics"].items():
+        line = f"{key:16s} MedAE {current['medae']:7.4f}  MAE {current['mae']:7.4f}"
+        base = (baseline or {}).get("metrics", {}).get(key)
+        if base:
+            line += f"  （基準 MedAE {base['medae']:7.4f}  MAE {base['mae']:7.4f}）"
+        print(line)
+    print(f"\n予測速度: {result['rows_per_second']}行/秒（全{len(result['metrics'])}モデル, {result['seconds'] * 1000:.1f}ms）"
+          + (f"（基準 {baseline['rows_per_second']}行/秒）" if baseline else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="予測精度と速度の回帰テスト")
+    parser.add_argument('csv', nargs='?', default=TRAINING_CSV_PATH, help="予測するCSV（CP932、退院時FIMの列を含む）")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="基準値のファイル")
+    parser.add_argument('--update-baseline', action='store_true', help="今回の結果を基準値として保存する")
+    parser.add_argument('--repeat', type=int, default=5, help="速度を計測する回数（最も速かった回を使う）")
+    parser.add_argument('--accuracy-tolerance', type=float, default=ACCURACY_TOLERANCE,
+                        help="MedAE・MAEの許容する変化（FIMの点数）")
+    parser.add_argument('--speed-tolerance', type=float, default=SPEED_TOLERANCE,
+                        help="予測速度の許容する低下の割合")
+    args = parser.parse_args()
+
+    import predict_api_fastapi as api
+
+    result = evaluate(api, args.csv, args.repeat)
+
+    if args.update_baseline:
+        print_result(result)
+        result["created_at"] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\n基準値を保存しました: {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\n❌ エラー: 基準値のファイルがありません: {args.baseline}")
+        print("   先に python regression_check.py --update-baseline で基準値を保存してください")
+        sys.exit(1)
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    print_result(result, baseline)
+    problems = compare(result, baseline, args.accuracy_tolerance, args.speed_tolerance)
+
+    print("\n" + "=" * 50)
+    if problems:
+        print("❌ 基準値から外れました:")
+        for problem in problems:
+            print(f"   - {problem}")
+        sys.exit(1)
+    print(f"✅ 精度・速度とも基準値の範囲内です（基準のモデルバージョン: {baseline.get('model_version')}）")
+
+
+if __name__ == "__main__":
+    main()
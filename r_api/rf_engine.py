@@ -0,0 +1,149 @@
+"""
+ランダムフォレストのネイティブ推論エンジン（NumPy）
+export_rf_models.py で.rdsから書き出した木構造（.npz）を読み込み、
+Rを使わずに全ての木を全行に対してベクトル化して評価する
+"""
+import os
+from typing import Dict, List
+
+import numpy as np
+
+
+def native_model_filename(rds_filename: str) -> str:
+    """.rdsのファイル名から書き出し先の.npzファイル名を作成"""
+    return os.path.splitext(rds_filename)[0] + '.npz'
+
+
+class ForestModel:
+    """1つの回帰ランダムフォレスト（randomForestのfinalModel相当）
+
+    全ての木のノードを1次元配列に詰めて保持する。
+    子ノードは配列全体での位置（0始まり）で持ち、葉ノードは自分自身を指す。
+    そのため最大の深さの回数だけ辿れば、全ての行・木が葉に到達する。
+    """
+
+    def __init__(self, feature: np.ndarray, threshold: np.ndarray,
+                 left: np.ndarray, right: np.ndarray, value: np.ndarray,
+                 roots: np.ndarray, max_depth: int, feature_names: List[str]):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.feature_names = list(feature_names)
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    @classmethod
+    def from_trees(cls, trees: List[Dict[str, np.ndarray]], feature_names: List[str]) -> 'ForestModel':
+        """木ごとの配列（randomForest::getTree相当）から作成
+
+        各木は以下の配列を持つ（ノードは0始まり、子がない場合は-1）:
+        feature: 分割に使う変数の位置, threshold: 分割値（x <= 分割値なら左）,
+        left / right: 子ノード, value: ノードの予測値
+        """
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        max_depth = 0
+        offset = 0
+        for tree in trees:
+            n_nodes = len(tree['value'])
+            is_leaf = tree['left'] < 0
+            own = np.arange(n_nodes, dtype=np.int32)
+            # 葉ノードは自分自身を指す（何回辿っても同じ葉に留まる）
+            lefts.append(np.where(is_leaf, own, tree['left']).astype(np.int32) + offset)
+            rights.append(np.where(is_leaf, own, tree['right']).astype(np.int32) + offset)
+            features.append(np.where(is_leaf, 0, tree['feature']).astype(np.int32))
+            thresholds.append(np.where(is_leaf, 0.0, tree['threshold']).astype(np.float64))
+            values.append(np.asarray(tree['value'], dtype=np.float64))
+            roots.append(offset)
+            max_depth = max(max_depth, _tree_depth(tree['left'], tree['right']))
+            offset += n_nodes
+
+        return cls(
+            feature=np.concatenate(features),
+            threshold=np.concatenate(thresholds),
+            left=np.concatenate(lefts),
+            right=np.concatenate(rights),
+            value=np.concatenate(values),
+            roots=np.asarray(roots, dtype=np.int32),
+            max_depth=max_depth,
+            feature_names=feature_names,
+        )
+
+    @classmethod
+    def load(cls, path: str) -> 'ForestModel':
+        """.npzファイルから読み込む"""
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                feature=data['feature'],
+                threshold=data['threshold'],
+                left=data['left'],
+                right=data['right'],
+                value=data['value'],
+                roots=data['roots'],
+                max_depth=int(data['max_depth']),
+                feature_names=[str(name) for name in data['feature_names']],
+            )
+
+    def save(self, path: str):
+        """.npzファイルに書き出す"""
+        np.savez_compressed(
+            path,
+            feature=self.feature,
+            threshold=self.threshold,
+            left=self.left,
+            right=self.right,
+            value=self.value,
+            roots=self.roots,
+            max_depth=np.int32(self.max_depth),
+            feature_names=np.array(self.feature_names, dtype=str),
+        )
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """全行について全ての木を同時に辿り、木の予測値の平均を返す
+
+        X: 行が患者、列がfeature_namesの順に並んだ数値配列
+        """
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim != 2 or X.shape[1] != len(self.feature_names):
+            raise ValueError(
+                f"入力の列数が一致しません（期待: {len(self.feature_names)}列, 入力: {X.shape}）"
+            )
+        rows = np.arange(X.shape[0])[:, None]
+        node = np.broadcast_to(self.roots, (X.shape[0], self.n_trees))
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[node]] <= self.threshold[node]
+            node = np.where(go_left, self.left[node], self.right[node])
+        return self.value[node].mean(axis=1)
+
+
+def _tree_depth(left: np.ndarray, right: np.ndarray) -> int:
+    """木の深さ（根から最も遠い葉までの辺の数）を求める"""
+    depth = 0
+    level = [0]
+    while True:
+        children = [c for node in level for c in (left[node], right[node]) if c >= 0]
+        if not children:
+            return depth
+        depth += 1
+        level = children
+
+
+def load_forests(models_dir: str, model_files: Dict[str, str]) -> Dict[str, ForestModel]:
+    """書き出し済みの.npzファイルを読み込む（見つからないモデルは除く）"""
+    forests = {}
+    for key, filename in model_files.items():
+        path = os.path.join(models_dir, native_model_filename(filename))
+        if not os.path.exists(path):
+            print(f"⚠️  警告: {path} が見つかりません（export_rf_models.pyで書き出してください）")
+            continue
+        try:
+            forests[key] = ForestModel.load(path)
+            print(f"✅ ネイティブモデル読み込み完了: {key} ({forests[key].n_trees}本の木)")
+        except Exception as e:
+            print(f"❌ 警告: {path} の読み込みに失敗: {e}")
+    return forests
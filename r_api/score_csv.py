@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+病院システム形式のCSV（CP932）を一括予測するスクリプト
+/predict/csv と同じ処理をAPIを起動せずにこのプロセス内で行い、結果をNDJSONまたはCSVに書き出します
+（CSVは一定の行数ずつ読み込んで予測するため、行数が多くても使用メモリは増えません）
+
+使い方:
+  python score_csv.py 入力.csv -o 結果.ndjson
+  python score_csv.py 入力.csv -o 結果.csv --chunk-size 1000 --id-column 患者ID
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from csv_scoring import (
+    CSV_CHUNK_SIZE, ERROR_COLUMN, OUTPUT_FORMATS, output_columns, read_csv_chunks, prepare_chunk,
+    fill_records, mark_fallbacks, fail_records, format_ndjson, format_csv
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="病院システム形式のCSVの一括予測")
+    parser.add_argument('input', help="入力のCSV（CP932、学習データと同じ列）")
+    parser.add_argument('-o', '--output', required=True, help="結果の保存先（.ndjson または .csv）")
+    parser.add_argument('--format', choices=OUTPUT_FORMATS,
+                        help="出力形式（省略時は保存先の拡張子から判定）")
+    parser.add_argument('--chunk-size', type=int, default=CSV_CHUNK_SIZE, help="1回に読み込んで予測する行数")
+    parser.add_argument('--id-column', help="結果に含める入力の列（患者IDなど）")
+    args = parser.parse_args()
+
+    output_format = args.format or ('csv' if args.output.lower().endswith('.csv') else 'ndjson')
+
+    import predict_api_fastapi as api
+
+    print("モデルを読み込み中...")
+    snapshot = api.load_models()
+    if len(snapshot.models) == 0:
+        print("エラー: モデルが読み込まれていません")
+        sys.exit(1)
+    if api.model_schema_errors:
+        print(f"エラー: モデルの変数が入力の列と一致しません: {api.model_schema_errors}")
+        sys.exit(1)
+
+    columns = output_columns(args.id_column)
+    started = time.perf_counter()
+    start_row = 0
+    errors = 0
+    with open(args.output, 'wb') as out:
+        if output_format == 'csv':
+            out.write(format_csv([], columns, header=True))
+        for chunk in read_csv_chunks(args.input, args.chunk_size):
+            records, requests, indices = prepare_chunk(chunk, start_row, api.PredictionRequest, args.id_column)
+            if requests:
+                try:
+                    # 代替値（0または項目の合計）を使った行は、予測値を書き込んだうえでエラーとして数える
+                    fallbacks = [[] for _ in requests]
+                    responses = api.predict_requests(requests, fallbacks=fallbacks)
+                    fill_records(records, indices, [response.model_dump() for response in responses])
+                    mark_fallbacks(records, indices, fallbacks)
+                except Exception as e:
+                    print(f"予測エラー（{start_row + 1}行目から）: {e}")
+                    fail_records(records, indices, e)
+            errors += sum(1 for record in records if ERROR_COLUMN in record)
+            out.write(format_csv(records, columns) if output_format == 'csv' else format_ndjson(records))
+            start_row += len(chunk)
+            elapsed = time.perf_counter() - started
+            print(f"{start_row}行を予測しました（{start_row / elapsed:.0f}行/秒）")
+
+    print(f"\n完了: {start_row}行（エラー {errors}行）, {time.perf_counter() - started:.2f}秒")
+    print(f"結果を保存しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
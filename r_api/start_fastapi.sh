@@ -1,6 +1,7 @@
 #!/bin/bash
 # FastAPI起動スクリプト（PM2用）
 # 仮想環境があればそれを使用、なければシステムのPythonを使用
+# PREFORK_WORKERS を指定した場合は、モデルをワーカー間で共有するpre-fork方式で起動
 
 SCRIPT_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )"
 cd "$SCRIPT_DIR"
@@ -8,11 +9,18 @@ cd "$SCRIPT_DIR"
 # 仮想環境の確認
 if [ -f "venv/bin/python3" ]; then
     echo "仮想環境を使用します"
-    exec venv/bin/python3 -m uvicorn predict_api_fastapi:app --host 0.0.0.0 --port 5000
+    PYTHON=venv/bin/python3
 elif [ -f "venv/bin/python" ]; then
     echo "仮想環境を使用します（python）"
-    exec venv/bin/python -m uvicorn predict_api_fastapi:app --host 0.0.0.0 --port 5000
+    PYTHON=venv/bin/python
 else
     echo "システムのPythonを使用します"
-    exec python3 -m uvicorn predict_api_fastapi:app --host 0.0.0.0 --port 5000
+    PYTHON=python3
+fi
+
+if [ -n "$PREFORK_WORKERS" ]; then
+    echo "pre-fork方式で起動します（ワーカー ${PREFORK_WORKERS}個）"
+    exec "$PYTHON" prefork_server.py --workers "$PREFORK_WORKERS" --host 0.0.0.0 --port 5000
+else
+    exec "$PYTHON" -m uvicorn predict_api_fastapi:app --host 0.0.0.0 --port 5000
 fi
@@ -0,0 +1,60 @@
+"""
+ネイティブ推論エンジンとRモデルの予測値が一致するかを確認するテストスクリプト
+学習データCSVの入院時データを全行入力して、モデルごとの最大誤差を確認
+使い方: python export_rf_models.py を実行してから python test_native_engine.py
+"""
+import sys
+import os
+
+# 親ディレクトリをパスに追加
+sys.path.insert(0, os.path.dirname(__file__))
+
+from predict_api_fastapi import (
+    PredictionRequest, encode_requests, load_r_models, load_native_models,
+    predict_all_r_models, predict_all_native_models
+)
+from training_data import read_training_csv, csv_to_payloads
+
+# 許容誤差（木の予測値の平均の計算順序による差のみを許容）
+TOLERANCE = 1e-8
+
+print("Rモデルを読み込み中...")
+r_models = load_r_models()
+print("ネイティブモデルを読み込み中...")
+native_models = load_native_models()
+
+if len(r_models) == 0 or len(native_models) == 0:
+    print("\nエラー: Rモデルまたはネイティブモデルが読み込まれていません")
+    sys.exit(1)
+
+# 学習データCSVの入院時データを入力として使用
+payloads = csv_to_payloads(read_training_csv())
+# 同じ行列をRとネイティブの両方に渡すため、エンコーダーのバッファからコピーしておく
+X = encode_requests([PredictionRequest(**payload) for payload in payloads]).copy()
+
+print("\n" + "=" * 50)
+print(f"予測値の比較（{len(X)}行）")
+print("=" * 50 + "\n")
+
+r_predictions = predict_all_r_models(X, r_models)
+native_predictions = predict_all_native_models(X, native_models)
+
+failed = []
+for key, r_values in r_predictions.items():
+    if key not in native_predictions:
+        print(f"{key}: ネイティブモデルがありません")
+        failed.append(key)
+        continue
+    diffs = [abs(r - n) for r, n in zip(r_values, native_predictions[key])]
+    max_diff = max(diffs)
+    # 予測に失敗した値（NaN）が含まれる場合も不一致とする
+    status = "OK" if all(diff <= TOLERANCE for diff in diffs) else "NG"
+    print(f"{key}: 最大誤差 {max_diff:.2e} ({status})")
+    if status != "OK":
+        failed.append(key)
+
+print("\n" + "=" * 50)
+if failed:
+    print(f"❌ 一致しないモデル: {failed}")
+    sys.exit(1)
+print("✅ 全てのモデルでRと同じ予測値になりました")
@@ -10,7 +10,9 @@ import json
 # 親ディレクトリをパスに追加
 sys.path.insert(0, os.path.dirname(__file__))
 
-from predict_api_fastapi import prepare_r_dataframe, predict_with_r_model, load_r_models
+from predict_api_fastapi import (
+    PredictionRequest, encode_request, feature_encoder, predict_with_r_model, load_r_models
+)
 from pydantic import BaseModel
 from typing import Dict
 
@@ -55,15 +57,15 @@ print("=" * 50 + "\n")
 print("入力データ:")
 print(json.dumps(test_input, indent=2, ensure_ascii=False))
 
-# データフレームを準備
+# 入力の行列を準備
 try:
-    input_df = prepare_r_dataframe(test_input)
-    print("\n準備されたデータフレーム:")
-    print(input_df)
-    print("\nデータフレームの列名:")
-    print(list(input_df.columns))
+    X = encode_request(PredictionRequest(**test_input))
+    print("\n準備された入力:")
+    print(feature_encoder.to_dataframe(X))
+    print("\n入力の列名:")
+    print(feature_encoder.columns)
 except Exception as e:
-    print(f"\nエラー: データフレームの準備に失敗しました: {e}")
+    print(f"\nエラー: 入力の準備に失敗しました: {e}")
     sys.exit(1)
 
 # 予測を実行
@@ -80,7 +82,7 @@ motion_items = ['eat', 'groom', 'bath', 'dress_up', 'dress_low',
 motion_predictions = []
 for item in motion_items:
     try:
-        pred = predict_with_r_model(item, input_df)
+        pred = predict_with_r_model(item, X)
         motion_predictions.append(pred)
         print(f"{item}: {pred:.2f}")
     except Exception as e:
@@ -92,7 +94,7 @@ cognitive_items = ['comp', 'express', 'social', 'problem', 'memory']
 cognitive_predictions = []
 for item in cognitive_items:
     try:
-        pred = predict_with_r_model(item, input_df)
+        pred = predict_with_r_model(item, X)
         cognitive_predictions.append(pred)
         print(f"{item}: {pred:.2f}")
     except Exception as e:
@@ -101,21 +103,21 @@ for item in cognitive_items:
 
 # 合計値の予測
 try:
-    motion_total = predict_with_r_model('motion_total', input_df)
+    motion_total = predict_with_r_model('motion_total', X)
     print(f"\n運動機能合計: {motion_total:.2f}")
 except Exception as e:
     print(f"\n運動機能合計: エラー - {e}")
     motion_total = sum(motion_predictions)
 
 try:
-    cognitive_total = predict_with_r_model('cognitive_total', input_df)
+    cognitive_total = predict_with_r_model('cognitive_total', X)
     print(f"認知機能合計: {cognitive_total:.2f}")
 except Exception as e:
     print(f"認知機能合計: エラー - {e}")
     cognitive_total = sum(cognitive_predictions)
 
 try:
-    total = predict_with_r_model('total', input_df)
+    total = predict_with_r_model('total', X)
     print(f"総合得点: {total:.2f}")
 except Exception as e:
     print(f"総合得点: エラー - {e}")
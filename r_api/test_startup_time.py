@@ -0,0 +1,139 @@
+"""
+起動時間を確認するテストスクリプト
+- インポート時間: 新しいプロセスで predict_api_fastapi をインポートする時間（Rは起動しないこと）
+- 最初の予測までの時間: uvicornでサーバーを起動してから /ready が200を返すまでと、最初の /predict の応答まで
+どちらかが目安の時間を超えた場合は終了コード1で終了する
+使い方: python test_startup_time.py
+"""
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+# 親ディレクトリをパスに追加
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from training_data import read_training_csv, csv_to_payloads
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+# インポート時間の目安（秒）
+IMPORT_BUDGET_SECONDS = float(os.environ.get('IMPORT_BUDGET_SECONDS', '2'))
+# サーバーの起動から最初の予測の応答までの目安（秒、Rの起動とモデルの読み込みを含む）
+FIRST_REQUEST_BUDGET_SECONDS = float(os.environ.get('FIRST_REQUEST_BUDGET_SECONDS', '60'))
+# サーバーの起動を待つ時間の上限（秒）
+SERVER_START_TIMEOUT = 300
+
+# インポート時間を計測する子プロセスで実行するコード
+IMPORT_CODE = """
+import json, sys, time
+started = time.perf_counter()
+import predict_api_fastapi
+seconds = time.perf_counter() - started
+print(json.dumps({
+    "seconds": seconds,
+    "r_loaded": "rpy2.robjects" in sys.modules,
+    "pandas_loaded": "pandas" in sys.modules,
+}))
+"""
+
+
+def measure_import():
+    """新しいプロセスで predict_api_fastapi をインポートする時間と、読み込まれたモジュール"""
+    result = subprocess.run([sys.executable, '-c', IMPORT_CODE], cwd=API_DIR,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def request(url: str, payload=None):
+    """GET（payloadがある場合はJSONをPOST）してステータスコードを返す"""
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=SERVER_START_TIMEOUT) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def measure_first_request(payload):
+    """サーバーを起動し、/readyが200になるまでと最初の/predictの応答までの時間"""
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'predict_api_fastapi:app', '--host', '127.0.0.1', '--port', str(port)],
+        cwd=API_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        listening = ready = None
+        while time.perf_counter() - started < SERVER_START_TIMEOUT:
+            if server.poll() is not None:
+                raise RuntimeError(f"サーバーが終了しました（終了コード {server.returncode}）")
+            try:
+                status = request(f"{base_url}/ready")
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.05)
+                continue
+            if listening is None:
+                listening = time.perf_counter() - started
+            if status == 200:
+                ready = time.perf_counter() - started
+                break
+            time.sleep(0.05)
+        if ready is None:
+            raise RuntimeError(f"{SERVER_START_TIMEOUT}秒以内に予測できる状態になりませんでした")
+
+        status = request(f"{base_url}/predict", payload)
+        first_request = time.perf_counter() - started
+        if status != 200:
+            raise RuntimeError(f"最初の予測に失敗しました（ステータス {status}）")
+        return {"listening": listening, "ready": ready, "first_request": first_request}
+    finally:
+        server.terminate()
+        server.wait()
+
+
+print("=" * 50)
+print("起動時間の確認")
+print("=" * 50 + "\n")
+
+failed = []
+
+imported = measure_import()
+print(f"インポート時間: {imported['seconds']:.3f}秒（目安 {IMPORT_BUDGET_SECONDS}秒）")
+print(f"  インポート時のR（rpy2）の読み込み: {'あり' if imported['r_loaded'] else 'なし'}")
+print(f"  インポート時のpandasの読み込み: {'あり' if imported['pandas_loaded'] else 'なし'}")
+if imported['seconds'] > IMPORT_BUDGET_SECONDS:
+    failed.append("インポート時間が目安を超えました")
+if imported['r_loaded']:
+    failed.append("インポート時にRが起動しています")
+
+# 学習データCSVの1行目を最初の予測の入力として使用
+payload = csv_to_payloads(read_training_csv().head(1))[0]
+try:
+    timing = measure_first_request(payload)
+except RuntimeError as e:
+    print(f"\n❌ エラー: {e}")
+    sys.exit(1)
+print(f"\nリクエストの受け付け開始: {timing['listening']:.3f}秒")
+print(f"予測できる状態（/ready）: {timing['ready']:.3f}秒")
+print(f"最初の予測の応答: {timing['first_request']:.3f}秒（目安 {FIRST_REQUEST_BUDGET_SECONDS}秒）")
+if timing['first_request'] > FIRST_REQUEST_BUDGET_SECONDS:
+    failed.append("最初の予測までの時間が目安を超えました")
+
+print("\n" + "=" * 50)
+if failed:
+    print(f"❌ {', '.join(failed)}")
+    sys.exit(1)
+print("✅ 起動時間は目安の範囲内です")
@@ -0,0 +1,107 @@
+"""
+学習データCSV（r_models/学習全データ.csv）の読み込み
+CP932の病院システム形式の行を/predictの入力形式に変換する
+（列名の対応はserver_r_model.jsのCSV_COLUMN_MAPPINGと同じ）
+"""
+import os
+from typing import TYPE_CHECKING, Dict, List
+
+if TYPE_CHECKING:
+    # pandasはインポートに時間がかかるため、使う関数の中でインポートする
+    import pandas as pd
+
+TRAINING_CSV_PATH = os.path.join(os.path.dirname(__file__), 'r_models', '学習全データ.csv')
+CSV_ENCODING = 'cp932'
+
+# 個人情報の列名
+PERSONAL_COLUMNS = {
+    'gender': '性別01',
+    'age': '年齢',
+    'bmi': '入院時BMI',
+    'careLevel': '入院時要介護度の有無',
+    'daysFromOnset': '発症から入棟までの日数',
+}
+
+# 入院時FIM運動機能項目（12項目）: 入力の項目名 -> 列名
+ADMISSION_MOTION_COLUMNS = {
+    '食事': '入棟時FIM食事',
+    '整容': '入棟時FIM整容',
+    '清拭': '入棟時FIM清拭',
+    '更衣上半身': '入棟時FIM更衣上半身',
+    '更衣下半身': '入棟時FIM更衣下半身',
+    'トイレ動作': '入棟時FIMトイレ動作',
+    '排尿管理': '入棟時FIM排尿管理',
+    '排便管理': '入棟時FIM排便管理',
+    'ベッド移乗': '入棟時FIMベッド移乗',
+    'トイレ移乗': '入棟時FIMトイレ移乗',
+    '浴槽移乗': '入棟時FIM浴槽移乗',
+    '歩行': '入棟時FIM歩行',
+}
+
+# 入院時FIM認知機能項目（5項目）: 入力の項目名 -> 列名
+ADMISSION_COGNITIVE_COLUMNS = {
+    '理解': '入棟時FIM理解',
+    '表出': '入棟時FIM表出',
+    '社会的交流': '入棟時FIM社会的交流',
+    '問題解決': '入棟時FIM問題解決',
+    '記憶': '入棟時FIM記憶',
+}
+
+
+# 退院時FIM運動機能項目（12項目）: 入力の項目名 -> 列名
+DISCHARGE_MOTION_COLUMNS = {
+    item: column.replace('入棟時', '退院時') for item, column in ADMISSION_MOTION_COLUMNS.items()
+}
+
+# 退院時FIM認知機能項目（5項目）: 入力の項目名 -> 列名
+DISCHARGE_COGNITIVE_COLUMNS = {
+    item: column.replace('入棟時', '退院時') for item, column in ADMISSION_COGNITIVE_COLUMNS.items()
+}
+
+# 退院時FIMの合計値: レスポンスの項目名 -> 列名
+DISCHARGE_TOTAL_COLUMNS = {
+    'motionTotal': '退院時FIM運動項目合計',
+    'cognitiveTotal': '退院時FIM認知項目合計',
+    'total': '退院時FIM総得点',
+}
+
+
+def discharge_columns(motion_items: List[str], cognitive_items: List[str]) -> Dict[str, str]:
+    """モデルのキー -> モデルが予測する退院時の列
+
+    motion_items / cognitive_items: 項目のモデルのキー（ADMISSION_MOTION_COLUMNS / ADMISSION_COGNITIVE_COLUMNSと同じ順）
+    """
+    columns = dict(zip(motion_items, DISCHARGE_MOTION_COLUMNS.values()))
+    columns.update(zip(cognitive_items, DISCHARGE_COGNITIVE_COLUMNS.values()))
+    columns['motion_total'] = DISCHARGE_TOTAL_COLUMNS['motionTotal']
+    columns['cognitive_total'] = DISCHARGE_TOTAL_COLUMNS['cognitiveTotal']
+    columns['total'] = DISCHARGE_TOTAL_COLUMNS['total']
+    return columns
+
+
+def read_training_csv(path: str = TRAINING_CSV_PATH) -> 'pd.DataFrame':
+    """学習データCSVを読み込む"""
+    import pandas as pd
+    return pd.read_csv(path, encoding=CSV_ENCODING)
+
+
+def row_to_payload(row: Dict) -> Dict:
+    """CSVの1行を/predictのリクエスト形式（dict）に変換"""
+    return {
+        'gender': 'male' if int(row[PERSONAL_COLUMNS['gender']]) == 0 else 'female',
+        'age': float(row[PERSONAL_COLUMNS['age']]),
+        'bmi': float(row[PERSONAL_COLUMNS['bmi']]),
+        'careLevel': 'yes' if int(row[PERSONAL_COLUMNS['careLevel']]) == 1 else 'no',
+        'daysFromOnset': float(row[PERSONAL_COLUMNS['daysFromOnset']]),
+        'motionValues': {
+            item: float(row[col]) for item, col in ADMISSION_MOTION_COLUMNS.items()
+        },
+        'cognitiveValues': {
+            item: float(row[col]) for item, col in ADMISSION_COGNITIVE_COLUMNS.items()
+        },
+    }
+
+
+def csv_to_payloads(df: 'pd.DataFrame') -> List[Dict]:
+    """CSVのデータフレームを/predictのリクエスト形式（dict）のリストに変換"""
+    return [row_to_payload(row) for row in df.to_dict('records')]
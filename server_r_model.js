@@ -243,10 +243,10 @@ db.serialize(() => {
   });
 });
 
-// R FastAPIのヘルスチェック
+// R FastAPIのレディネスチェック（全モデルの読み込みが完了するまでは503が返る）
 async function checkRAPI() {
   try {
-    const response = await axios.get(`${R_API_URL}/health`, { timeout: 2000 });
+    const response = await axios.get(`${R_API_URL}/ready`, { timeout: 2000 });
     console.log('R FastAPI接続成功:', response.data);
     return true;
   } catch (error) {